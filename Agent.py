@@ -26,15 +26,26 @@ Parameters:
 
 '''
 import numpy as np
-import random
+import heapq
+import itertools
 import pdb
+from Value_Table import DenseTable, RecoveringTable, RecoveringDenseTable, VisitedStates
+from Transition_Model import TransitionModel
+from Random_Stream import RandomStream
 
 
 
 class Agent:
 
-    def __init__(self, parameters):
+    def __init__(self, parameters, maze = None, rng = None):
+        '''
+        maze: optional environment object. Only used to size dense value tables
+        (maze.nb_states x maze.action_space); the agent never reads transitions or rewards.
+        rng: RandomStream used for every random decision of the agent (action choice,
+        perception noise, planning samples). Defaults to a freshly seeded stream.
+        '''
         self.parameters = parameters
+        self.rng = rng if rng is not None else RandomStream()
         if 'learning rate' in parameters:
             self.learn_rate = parameters['learning rate']
         else:
@@ -56,6 +67,9 @@ class Agent:
             self.probabilistic = parameters['probabilistic agent state']
         else:
             self.probabilistic = False
+        self.visited_states = VisitedStates()
+        if self.probabilistic:
+            self.init_perception_noise(maze)
         if 'discount rate' in parameters:
             self.discount_rate = parameters['discount rate']
         else:
@@ -64,17 +78,118 @@ class Agent:
         self.prev_state = None
         self.prev_action = None
         if parameters['learn model']:
-            self.Model = {} ## initial format: key = (STATE, ACTION). map = (STATE, REWARD)
+            self.Model = TransitionModel() ## (STATE, ACTION) -> (REWARD, STATE), stored as arrays
             if 'planning steps' in parameters:
                 self.planning_steps = parameters['planning steps']
             else:
                 raise Exception('Model-based agent instantiated under parameters. \n'
                                 'Please indicate the number of planning steps (> 0).')
+            self.init_planning()
         else:
             self.Model = None
-        if parameters['add exploration bonus']:
-            self.exploration_bonus = {}  # format: key = (state, action), content = value between 0 and 1
-        self.Qfunction = {}
+        if 'Q table' in parameters:
+            self.dense = parameters['Q table'] == 'dense'
+        else:
+            self.dense = False
+        self.init_value_tables(maze)
+
+    def init_value_tables(self, maze):
+        '''
+        Q table 'dict' (default): python dictionaries keyed by (state, action).
+        Q table 'dense': preallocated nb_states x nb_actions arrays + seen mask (see Value_Table.py).
+        Both support the same dictionary interface, so Interact / Analysis records are unchanged.
+        '''
+        if self.dense and getattr(maze, 'implicit', False):
+            raise Exception('Dense Q tables cannot be sized from an implicit maze, use the dict Q table')
+        if maze is not None:
+            nb_states, nb_actions = maze.nb_states, maze.action_space
+        else:  # tables grow on demand
+            nb_states, nb_actions = 1, 1
+        if self.learn_mode == 'MC':
+            # number of returns averaged into each Q(s,a), same backend as the Q table
+            if self.dense:
+                self.return_counts = DenseTable(nb_states, nb_actions, dtype = np.int64)
+            else:
+                self.return_counts = {}
+        if self.parameters['add exploration bonus']:
+            self.init_novelty_recovery()
+        if self.dense:
+            self.Qfunction = DenseTable(nb_states, nb_actions)
+            if self.parameters['add exploration bonus']:
+                # at least 4 columns: init_novelty may touch reversal actions (0-3) outside the action space
+                if self.novelty_increase:
+                    self.exploration_bonus = RecoveringDenseTable(nb_states, max(nb_actions, 4),
+                                                                  rate = self.novelty_recovery_rate)
+                else:
+                    self.exploration_bonus = DenseTable(nb_states, max(nb_actions, 4))
+        else:
+            if self.parameters['add exploration bonus']:
+                # format: key = (state, action), content = value between 0 and 1
+                if self.novelty_increase:
+                    self.exploration_bonus = RecoveringTable(rate = self.novelty_recovery_rate)
+                else:
+                    self.exploration_bonus = {}
+            self.Qfunction = {}
+
+    def init_novelty_recovery(self):
+        '''
+        novelty increase: if True, novelty of all pairs not visited recovers towards 1 every step
+        (memory decay). Default False.
+        novelty recovery rate: fraction of the distance to 1 recovered per step (default 0.1).
+        '''
+        if 'novelty increase' in self.parameters:
+            self.novelty_increase = self.parameters['novelty increase']
+        else:
+            self.novelty_increase = False
+        if 'novelty recovery rate' in self.parameters:
+            self.novelty_recovery_rate = self.parameters['novelty recovery rate']
+        else:
+            self.novelty_recovery_rate = 0.1
+
+    def init_perception_noise(self, maze):
+        '''
+        perception noise (probabilistic agent state only):
+            'visited' (default): perceived state drawn uniformly from all states visited so far
+            'neighbours': perceived state drawn uniformly from states within 'perception radius'
+            moves of the true state (default 1). Neighbour lists are precomputed from the maze.
+        '''
+        if 'perception noise' in self.parameters:
+            self.perception_noise = self.parameters['perception noise']
+        else:
+            self.perception_noise = 'visited'
+        if self.perception_noise == 'neighbours':
+            if maze is None:
+                raise Exception('Perception noise by neighbours requires the maze to be passed to Agent.')
+            if 'perception radius' in self.parameters:
+                radius = self.parameters['perception radius']
+            else:
+                radius = 1
+            self.neighbour_indptr, self.neighbour_states = maze.compute_neighbour_table(radius)
+        elif self.perception_noise != 'visited':
+            raise Exception('Unknown perception noise: ' + str(self.perception_noise))
+
+    def init_planning(self):
+        '''
+        planning: 'uniform' (default) Dyna-Q replay of random modelled transitions, or
+        'prioritized' sweeping: state-action pairs are queued by TD error magnitude and the
+        predecessors of every backed-up state are re-queued, so value propagates backwards
+        from the reward first.
+        priority threshold: minimum TD error for a pair to be queued (prioritized only).
+        '''
+        if 'planning' in self.parameters:
+            self.planning_mode = self.parameters['planning']
+        else:
+            self.planning_mode = 'uniform'
+        if self.planning_mode == 'prioritized':
+            if 'priority threshold' in self.parameters:
+                self.priority_threshold = self.parameters['priority threshold']
+            else:
+                self.priority_threshold = 1e-4
+            self.priority_queue = []  # heap of (-priority, tie breaker, state, action)
+            self.priorities = {}  # (state, action) -> priority of its live queue entry
+            self.priority_counter = itertools.count()
+        elif self.planning_mode != 'uniform':
+            raise Exception('Unknown planning: ' + str(self.planning_mode))
 
     def init_memory(self):
         self.use_memory = True
@@ -82,8 +197,20 @@ class Agent:
         self.episode_memory = []  # memory for current episode only
 
     def init_MC_variables(self):
+        '''
+        MC visits: 'every' (default) or 'first' visit of a state-action pair per episode.
+        MC step size: 'average' (default) running mean of all returns, or 'constant'
+        (learning rate) for an exponential recency-weighted average.
+        '''
         self.init_memory()
-        self.state_return_dict = {} # this keeps a list of returns for each visited state
+        if 'MC visits' in self.parameters:
+            self.MC_visits = self.parameters['MC visits']
+        else:
+            self.MC_visits = 'every'
+        if 'MC step size' in self.parameters:
+            self.MC_step_size = self.parameters['MC step size']
+        else:
+            self.MC_step_size = 'average'
 
     def init_TD_variables(self):
         if 'lambda' in self.parameters:
@@ -92,9 +219,28 @@ class Agent:
             raise Exception('TD value updating mode instantiated under parameters.\n'
                             'Please indicate lambda parameters (0 to 1)')
         if self.TD_lambda > 0:
-            self.init_memory()
+            self.init_traces()
+        self.use_memory = False
+
+    def init_traces(self):
+        '''
+        Eligibility traces for TD(lambda), kept sparse: {(state, action): eligibility}.
+        trace: 'accumulating' (default), 'replacing' or 'dutch'
+        trace cutoff: entries are dropped once their eligibility falls below this value
+        (i.e. once (lambda * discount)^k < cutoff), which bounds the work per step.
+        '''
+        if 'trace' in self.parameters:
+            self.trace_mode = self.parameters['trace']
+        else:
+            self.trace_mode = 'accumulating'
+        if self.trace_mode not in ['accumulating', 'replacing', 'dutch']:
+            raise Exception('Unknown trace: ' + str(self.trace_mode))
+        if 'trace cutoff' in self.parameters:
+            self.trace_cutoff = self.parameters['trace cutoff']
         else:
-            self.use_memory = False
+            self.trace_cutoff = 1e-8
+        self.traces = {}
+        self.trace_boundary = False
 
     def step(self, env_obs, can_terminate = True):
         '''
@@ -105,7 +251,11 @@ class Agent:
         agent_obs = self.determine_agent_state(env_obs)
         self.curr_state = agent_obs[1]  # current set to integer state (0,1,2,...)
         self.curr_actionspace = agent_obs[0]
+        if self.dense:
+            # the dense table rows are python lists, indexed faster by python ints
+            self.curr_actions = np.asarray(self.curr_actionspace).tolist()
         self.reward = agent_obs[2]
+        self.env_terminate = agent_obs[-1]
         if can_terminate:
             self.terminate = agent_obs[-1]
         else:
@@ -132,17 +282,11 @@ class Agent:
             if bonus_reduced < 0: bonus_reduced = 0
             self.exploration_bonus[self.curr_state, action] = bonus_reduced
 
-    def increase_state_novelty(self, action, max_novelty = 1, rate = 0.1):
+    def increase_state_novelty(self, action):
         # increase novelty for all state action pairs NOT selected
         # acts as memory decay (novelty increase back to 1)
-        curr_state_action = (self.curr_state, action)
-        all_state_actions = list(self.exploration_bonus.keys())
-        all_state_actions.remove(curr_state_action)
-        for state_action in all_state_actions:
-            bonus_current = self.exploration_bonus[state_action]
-            diff = max_novelty - bonus_current
-            bonus_new =+ rate * diff
-            self.exploration_bonus[state_action] = bonus_new
+        # recovery is lazy: the table advances its step clock and evaluates values when read
+        self.exploration_bonus.advance(exclude = (self.curr_state, action))
 
     def update_novelty(self, action, reduction, novelty_increase = False):
         if action is not None: # not terminal
@@ -150,21 +294,18 @@ class Agent:
             self.reduce_state_novelty(action, reduction = reduction)
             # increase novelty for all other pairs
             if novelty_increase:
-                self.increase_state_novelty(action, rate = 0.1)
+                self.increase_state_novelty(action)
 
     def step_TD(self, obs):
         action = self.pick_action()
         # update novelty below. Must be done before value updates occurs
         if self.parameters['add exploration bonus']:
-            self.update_novelty(action, self.parameters['reduction'])
-        if self.use_memory:
-            # general purpose memory for use in eligibility trace
-            self.add_memory(obs, action)
+            self.update_novelty(action, self.parameters['reduction'], self.novelty_increase)
         # ONLY running if prev_state field is populated!
         if self.TD_lambda == 0:
             self.learn_TD0_value()
         else:  # TD_lambda > 0:
-            self.learn_TDl_values()
+            self.learn_TDl_values(action)
             # note: TD(lambda) is updated online, every episode
             # in contrast with MC, which updates at the end of episodes
         if self.Model is not None:
@@ -187,27 +328,31 @@ class Agent:
         2) agent has superstitious actions (actions outside of set of environment action space)
         '''
         if self.probabilistic:
-            if random.random() > p_random:
+            if self.rng.random() > p_random:
                 agent_obs = env_obs
             else:
-                all_visited_states = self.find_states_visited()
-                if all_visited_states is not None:
-                    state = np.random.choice(all_visited_states)
+                state = self.perceive_random_state(env_obs[1])
+                if state is not None:
                     env_obs[1] = state # change perceived current state
                 agent_obs = env_obs
         else:
             agent_obs = env_obs
         return agent_obs
 
-    def find_states_visited(self):
-        '''find states visited from q function'''
-        state_action_pairs = np.array(list(self.Qfunction.keys()))
-        if len(state_action_pairs) > 0:
-            states = list(set(state_action_pairs[:,0]))
-        else:
-            states = None
-        return states
+    def perceive_random_state(self, true_state):
+        '''draw a perceived state according to the perception noise model. None if there is no candidate.'''
+        if self.perception_noise == 'neighbours':
+            start, end = self.neighbour_indptr[true_state], self.neighbour_indptr[true_state + 1]
+            if end > start:
+                return self.neighbour_states[start + self.rng.integers(end - start)]
+            return None
+        return self.find_states_visited()
 
+    def find_states_visited(self):
+        '''uniformly sample one of the states visited so far (states in Q function). None if none.'''
+        if len(self.visited_states) > 0:
+            return self.visited_states.sample(self.rng)
+        return None
 
     def step_MC(self, obs):
         # ONLY running if prev_state field is populated!
@@ -237,51 +382,75 @@ class Agent:
         terminate = obs[-1]
         self.episode_memory.append([state, reward, action])
         if terminate:
-            # Append memory of current episode to all memories
-            self.memory.append(self.episode_memory)
+            # keep the most recent episode only, so memory stays flat over long trials
+            self.memory = [self.episode_memory]
             self.episode_memory = [] # clear episode memory
 
-    def learn_TDl_values(self):
-        if len(self.memory) > 0 or len(self.episode_memory) > 0:
-            if len(self.episode_memory) > 0:
-                memory_episode = self.episode_memory
-            else:
-                memory_episode = self.memory[-1]
-            if len(memory_episode) >= 2: # only learn after there are two states visited
-                # compute target at current state
-                reward = memory_episode[-1][1]
-                curr_state = memory_episode[-1][0]
-                curr_action = memory_episode[-1][2]
-                prev_state = memory_episode[-2][0]
-                prev_action = memory_episode[-2][2]
-                if curr_action is not None: # not yet at a terminal state
-                    current_value = self.Qfunction[curr_state, curr_action]
-                else: # before reaching terminal state
-                    current_value = 0
-                    '''
-                    NOTE: this only works if the value of terminal state
-                    is the same as the reward, aka no more reward after.
-                    '''
-                prev_value = self.Qfunction[prev_state, prev_action]
-                if self.parameters['add exploration bonus']:
-                    # if curr_action is not None: # todo: QA
-                    # novelty_bonus = self.exploration_bonus[curr_state, curr_action]
-                    novelty_bonus = self.exploration_bonus[prev_state, prev_action] # is this correct?
-                    reward += novelty_bonus
-                delta_target = reward + self.discount_rate * current_value - prev_value
-                eligibility_t = 1
-                # pdb.set_trace()
-                for t in range(len(memory_episode) - 1, 0, -1): # iterate backwards
-                    # iterate backwards, from most recent state
-                    prev_state = memory_episode[t - 1][0]
-                    prev_action = memory_episode[t - 1][2]
-                    # Update Q function
-                    self.Qfunction[prev_state, prev_action] += \
-                        self.learn_rate * eligibility_t * delta_target
-                    eligibility_t *= self.TD_lambda * self.discount_rate
+    def learn_TDl_values(self, curr_action):
+        '''
+        Online TD(lambda) with eligibility traces (backward view). Each step decays all
+        traces by lambda * discount, bumps the trace of the previous state-action pair and
+        moves every traced Q(s,a) along the current TD error. Cost per step is bounded by
+        the number of traces above the cutoff, not by the episode length.
+        '''
+        if self.prev_state is not None and not self.trace_boundary: # only learn after there are two states visited
+            # compute target at current state
+            reward = self.reward
+            if curr_action is not None: # not yet at a terminal state
+                current_value = self.Qfunction[self.curr_state, curr_action]
+            else: # before reaching terminal state
+                current_value = 0
+                '''
+                NOTE: this only works if the value of terminal state
+                is the same as the reward, aka no more reward after.
+                '''
+            prev_value = self.Qfunction[self.prev_state, self.prev_action]
+            if self.parameters['add exploration bonus']:
+                # if curr_action is not None: # todo: QA
+                # novelty_bonus = self.exploration_bonus[curr_state, curr_action]
+                novelty_bonus = self.exploration_bonus[self.prev_state, self.prev_action] # is this correct?
+                reward += novelty_bonus
+            delta_target = reward + self.discount_rate * current_value - prev_value
+            self.update_traces()
+            for state_action, eligibility in self.traces.items():
+                # Update Q function
+                self.Qfunction[state_action] += self.learn_rate * eligibility * delta_target
+        # traces do not carry over episodes. An observation flagged terminal by the environment
+        # also closes them when the agent cannot terminate (start state), and the following
+        # transition is not learned, as with the former per-episode memory.
+        self.trace_boundary = self.env_terminate
+        if self.terminate or self.env_terminate:
+            self.traces = {}
+
+    def update_traces(self):
+        '''decay all traces, drop the ones below cutoff, then bump the previous state-action pair'''
+        decay = self.TD_lambda * self.discount_rate
+        traces = {}
+        for state_action, eligibility in self.traces.items():
+            eligibility *= decay
+            if eligibility >= self.trace_cutoff:
+                traces[state_action] = eligibility
+        prev_state_action = (self.prev_state, self.prev_action)
+        if self.trace_mode == 'accumulating':
+            traces[prev_state_action] = traces.get(prev_state_action, 0) + 1
+        elif self.trace_mode == 'replacing':
+            traces[prev_state_action] = 1
+        else: # dutch
+            traces[prev_state_action] = (1 - self.learn_rate) * traces.get(prev_state_action, 0) + 1
+        self.traces = traces
 
     def learn_MC_value(self):
+        '''
+        Q(s,a) is the mean of the returns observed after (s,a), updated incrementally:
+        Q <- Q + (G - Q) / n, or Q <- Q + lr * (G - Q) for a constant step size.
+        '''
         memory_episode = self.memory[-1] # pull out last episode memory
+        if self.MC_visits == 'first':
+            first_visit = {}
+            for t in range(len(memory_episode) - 1):
+                state_action = (memory_episode[t][0], memory_episode[t][2])
+                if state_action not in first_visit:
+                    first_visit[state_action] = t
         return_t = 0
         for t in range(len(memory_episode) - 1, 0, -1):
             # iterate backwards, from most recent state
@@ -289,11 +458,17 @@ class Agent:
             prev_state = memory_episode[t-1][0]
             prev_action = memory_episode[t-1][2]
             return_t = return_t * self.discount_rate + reward
-            if (prev_state, prev_action) not in self.state_return_dict:
-                self.state_return_dict[prev_state, prev_action] = []
-            self.state_return_dict[prev_state, prev_action].append(return_t)
-            # update Q function through averaging
-            self.Qfunction[prev_state, prev_action] = np.average(self.state_return_dict[prev_state, prev_action])
+            if self.MC_visits == 'first' and first_visit[prev_state, prev_action] != t - 1:
+                continue
+            if (prev_state, prev_action) not in self.return_counts:
+                self.return_counts[prev_state, prev_action] = 0
+            self.return_counts[prev_state, prev_action] += 1
+            if self.MC_step_size == 'constant':
+                step_size = self.learn_rate
+            else:
+                step_size = 1 / self.return_counts[prev_state, prev_action]
+            # update Q function through (running) averaging
+            self.Qfunction[prev_state, prev_action] += step_size * (return_t - self.Qfunction[prev_state, prev_action])
 
     def learn_TD0_value(self):
         '''
@@ -302,21 +477,36 @@ class Agent:
         '''
         if self.prev_state is not None: # after 1st step only!
             actionspace = self.curr_actionspace
+            self.visited_states.add(self.curr_state)
+            if self.dense:
+                self.learn_TD0_value_dense(self.curr_actions)
+                return
             max_value = -1 # arbitrary initial value less than 0
             for a in actionspace:
-                if (self.curr_state, a) not in self.Qfunction.keys():
+                if (self.curr_state, a) not in self.Qfunction:
                     self.Qfunction[self.curr_state, a] = 0
                 # Check if current Q(s,a) has the largest value
                 if self.Qfunction[self.curr_state,a] > max_value:
                     max_action = a
                     max_value = self.Qfunction[self.curr_state,a]
 
-            if (self.prev_state, self.prev_action) not in self.Qfunction.keys():
+            if (self.prev_state, self.prev_action) not in self.Qfunction:
                 self.Qfunction[self.prev_state, self.prev_action] = 0
             ### HERE THE Q VALUE IS UPDATED!
             self.Qfunction[self.prev_state, self.prev_action] += self.learn_rate * (self.reward + self.discount_rate * self.Qfunction[self.curr_state, max_action] - self.Qfunction[self.prev_state, self.prev_action])
             # if self.termination: pdb.set_trace()
 
+    def learn_TD0_value_dense(self, actionspace):
+        '''same update as learn_TD0_value, on the dense arrays'''
+        Q = self.Qfunction
+        Q.ensure(self.curr_state, actionspace)
+        Q.ensure(self.prev_state, (self.prev_action,))
+        curr_row = Q.rows[self.curr_state]
+        max_value = max([curr_row[a] for a in actionspace])
+        prev_value = Q.rows[self.prev_state][self.prev_action]
+        Q.write(self.prev_state, self.prev_action,
+                prev_value + self.learn_rate * (self.reward + self.discount_rate * max_value - prev_value))
+
     def learn_model(self):
         if self.prev_state is not None: # beyond 1st step only!
             ## epsilon greedy
@@ -326,20 +516,23 @@ class Agent:
             Model is in coordinate space
             '''
             ## learn state transition matrix
-            if (self.prev_state, self.prev_action) not in self.Model.keys():
-                self.Model[self.prev_state, self.prev_action] = (self.reward, self.curr_state)
+            self.Model.add(self.prev_state, self.prev_action, self.reward, self.curr_state)
 
     def pick_action(self):
         if self.terminate:
             return None
         actionspace = self.curr_actionspace
+        actions = self.curr_actions if self.dense else actionspace
         values = []
         if self.parameters['add exploration bonus']:
-            self.init_novelty(actionspace)
-        self.init_values(actionspace)
+            self.init_novelty(actions)
+        self.init_values(actions)
             ## softmax
-        for a in actionspace:
-            values.append(self.Qfunction[self.curr_state, a])
+        if self.dense:
+            values = self.Qfunction.lookup(self.curr_state, actions)
+        else:
+            for a in actionspace:
+                values.append(self.Qfunction[self.curr_state, a])
         ## Exploration policy based on values
         if self.exploration_policy == 'e-greedy':
             chosen_action = self.egreedy_choice(values, actionspace)
@@ -353,8 +546,16 @@ class Agent:
         '''
         This function ensures that all the Q(s,a) have initial values attached to them.
         '''
+        self.visited_states.add(self.curr_state)
+        if self.dense:
+            for a in self.Qfunction.unseen(self.curr_state, actionspace):
+                init_value = 0
+                if self.parameters['add exploration bonus']:
+                    init_value = init_value + lr * (self.exploration_bonus[self.curr_state, a] - init_value)
+                self.Qfunction.write(self.curr_state, a, init_value)
+            return
         for a in actionspace:
-            if (self.curr_state, a) not in self.Qfunction.keys():
+            if (self.curr_state, a) not in self.Qfunction:
                 if self.parameters['add exploration bonus']:
                     init_value = 0
                     novelty = self.exploration_bonus[self.curr_state, a]
@@ -376,10 +577,13 @@ class Agent:
                         3: 2} # map previous actions to curr actions that would take it there
         if reduce_for_reversal and self.prev_action is not None:
             reverse_action = flip_actions[self.prev_action]
-            if (self.curr_state, reverse_action) not in self.exploration_bonus.keys():
+            if (self.curr_state, reverse_action) not in self.exploration_bonus:
                 self.exploration_bonus[self.curr_state, reverse_action] = max_bonus - self.parameters['reduction']
+        if self.dense:
+            self.exploration_bonus.ensure(self.curr_state, actionspace, max_bonus)
+            return
         for a in actionspace:
-            if (self.curr_state, a) not in self.exploration_bonus.keys():
+            if (self.curr_state, a) not in self.exploration_bonus:
                 self.exploration_bonus[self.curr_state,a] = max_bonus
 
         # now, update value function. Note that this process is different from initializing Q functions
@@ -387,59 +591,99 @@ class Agent:
     def egreedy_choice(self, values, actionspace):
         # probablity of exploration
         e = self.parameters['epsilon']
-        rand = random.random()
+        rand = self.rng.random()
         if rand >= e and len(set(values)) > 1:
             # exploit
             argmax_V = np.argmax(values)
             chosen_action = actionspace[argmax_V]
         else:
             # explore
-            chosen_action = np.random.choice(actionspace)
+            chosen_action = self.rng.choice(actionspace)
         return chosen_action
 
     def softmax_choice(self, values, actionspace):
         exp = np.exp(values)
-        sum = np.sum(exp)
-        prob = exp / sum
-        chosen_action = np.random.choice(actionspace, p=prob)
+        # probabilities proportional to exp, normalized inside the draw
+        chosen_action = self.rng.choice(actionspace, p=exp)
         return chosen_action
 
     def random_choice(self, actionspace):
-        chosen_action = np.random.choice(actionspace)
+        chosen_action = self.rng.choice(actionspace)
         return chosen_action
 
     def plan(self):
         '''
         planning function based on DynaQ. Not model-based planning literature without value function
         approximation. Note distinction. Refer to Sutton and Barto Dyna-Q.
+        All planning steps are sampled at once from the model. With the dense Q table they are
+        backed up together in one vectorized update (see plan_batch).
         '''
-
-        if self.prev_state is not None: # only start planning after 1st step
-            for i in range(self.planning_steps):
-                random_stateaction = random.choice(list(self.Model.keys()))
-                next_rewardstate = self.Model[random_stateaction]
-                prev_state = random_stateaction[0]
-                prev_action = random_stateaction[1]
-                reward = next_rewardstate[0]
-                curr_state = next_rewardstate[1]
+        if self.prev_state is not None and self.planning_mode == 'prioritized':
+            self.plan_prioritized()
+        elif self.prev_state is not None: # only start planning after 1st step
+            samples = self.Model.sample(self.planning_steps, self.rng)
+            if self.dense:
+                self.plan_batch(*samples)
+                return
+            for prev_state, prev_action, reward, curr_state in zip(*[column.tolist() for column in samples]):
                 #### learn!
-                max_value = -1 # arbitrary value less than 0
-                for a in [0,1,2,3]:
-                    if (curr_state, a) in self.Qfunction.keys():
-                        if self.Qfunction[curr_state, a] > max_value:
-                            max_next_action = a
-                            max_next_value = self.Qfunction[curr_state,a]
+                max_next_value = self.max_value(curr_state)
                 ### HERE THE Q VALUE IS UPDATED!
-                self.Qfunction[prev_state, prev_action] += self.learn_rate * (reward + self.discount_rate * self.Qfunction[curr_state, max_next_action] - self.Qfunction[prev_state, prev_action])
-
-
-
-
-
-
-
-
-
-
-
+                self.Qfunction[prev_state, prev_action] += self.learn_rate * (reward + self.discount_rate * max_next_value - self.Qfunction[prev_state, prev_action])
 
+    def plan_batch(self, prev_states, prev_actions, rewards, curr_states):
+        '''
+        Vectorized backup of a batch of sampled transitions. Targets are computed from the Q values
+        before the batch. A pair sampled c times moves c learning-rate steps towards its target:
+        Q <- Q + (1 - (1 - lr)^c) * (target - Q)
+        '''
+        Q = self.Qfunction
+        next_values = np.where(Q.seen[curr_states], Q.table[curr_states], -np.inf).max(axis = 1)
+        next_values[np.isneginf(next_values)] = 0 # nothing known about next state
+        targets = rewards + self.discount_rate * next_values
+        _, first, counts = np.unique(prev_states * Q.table.shape[1] + prev_actions,
+                                     return_index = True, return_counts = True)
+        states, actions = prev_states[first], prev_actions[first]
+        step_size = 1 - (1 - self.learn_rate) ** counts
+        Q.table[states, actions] += step_size * (targets[first] - Q.table[states, actions])
+        Q.refresh(states)
+
+    def max_value(self, state):
+        '''max Q(state, a) over the actions known for state. 0 if nothing is known about state.'''
+        if self.dense:
+            Q = self.Qfunction
+            if state >= Q.table.shape[0] or not Q.seen[state].any():
+                return 0
+            return Q.table[state][Q.seen[state]].max()
+        values = [self.Qfunction[state, a] for a in self.curr_actionspace if (state, a) in self.Qfunction]
+        if len(values) > 0:
+            return max(values)
+        return 0
+
+    def queue_priority(self, state, action, reward, next_state):
+        '''queue (state, action) if its TD error exceeds the threshold'''
+        priority = abs(reward + self.discount_rate * self.max_value(next_state) - self.Qfunction[state, action])
+        if priority > self.priority_threshold and priority > self.priorities.get((state, action), 0):
+            self.priorities[state, action] = priority
+            heapq.heappush(self.priority_queue, (-priority, next(self.priority_counter), state, action))
+
+    def plan_prioritized(self):
+        '''
+        Prioritized sweeping (Sutton & Barto 8.4). The real transition is queued by its TD error,
+        then up to 'planning steps' of the highest priority pairs are backed up through the model.
+        '''
+        self.queue_priority(self.prev_state, self.prev_action, self.reward, self.curr_state)
+        for i in range(self.planning_steps):
+            # pop highest priority pair, skipping entries superseded by a later push
+            while len(self.priority_queue) > 0:
+                neg_priority, _, state, action = heapq.heappop(self.priority_queue)
+                if self.priorities.get((state, action)) == -neg_priority:
+                    del self.priorities[state, action]
+                    break
+            else:
+                break
+            reward, next_state = self.Model[state, action]
+            self.Qfunction[state, action] += self.learn_rate * (reward + self.discount_rate * self.max_value(next_state) - self.Qfunction[state, action])
+            # pairs leading into state may now have a larger TD error
+            for prev_state, prev_action, prev_reward in self.Model.predecessors_of(state):
+                self.queue_priority(prev_state, prev_action, prev_reward, state)
@@ -8,7 +8,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os, sys, glob
 import math
-import pickle
 
 class Analysis:
     '''
@@ -20,16 +19,16 @@ class Analysis:
         self.exp_path = exp_path
         self.sess_id = sess_id
         self.Map = Maze
-        # History of [s_t, a_t, s_t+1] tupples
-        self.state_action_history = Interact.state_act_history_trials
-        # History of combined Interact output to Agent
-        self.state_obs_history = Interact.state_obs_history_trials
-        self.value_history = Interact.agent_qvalues_history_trials
+        # columnar history of [s_t, a_t, s_t+1] transitions and observations (Trajectory_Buffer.py)
+        self.trajectories = Interact.trajectories
+        # Q value / novelty snapshots (Snapshot_Log.py)
+        self.value_log = Interact.value_log
         self.maze_type = Interact.maze_type
-        self.novelty_history = Interact.agent_novelty_history_trials
+        self.novelty_log = Interact.novelty_log
+        self.Session = Interact
         self.init_sub_session_path()
         if save_log:
-            pickle.dump(Interact.state_act_history_trials, open(f'{self.sess_output_path}/state_act_history.p', 'wb'))
+            self.trajectories.save(f'{self.sess_output_path}/trajectories.npz')
         self.cumulative_rewards = [] # for all trials
         self.all_timesteps_trial = [] # for the entire trial
 
@@ -43,49 +42,52 @@ class Analysis:
         print('\nLogging experiment data..\n\n')
         self.compare_total_steps_till_reward(dpi)
         self.visualize_reward_all_episodes(dpi)
-        if self.maze_type == 'binary':
+        if self.maze_type == 'binary' and not getattr(self.Map, 'implicit', False):
+            # one row per leaf: skipped for implicit (very deep) mazes
             self.visualize_final_states(dpi)
         self.log_reward(dpi = dpi)
         self.visualize_state_values(dpi)
         self.visualize_state_novelty(dpi)
         self.visualize_timesteps_per_episode(dpi)
+        if hasattr(self.Map, 'distance_to_rewards'):
+            self.log_path_efficiency(dpi)
+
+    def final_rewards(self):
+        '''reward at the end of every episode, per trial'''
+        return self.trajectories.per_trial(self.trajectories.final_obs('reward').astype(float))
 
     def visualize_reward_all_episodes(self, dpi, plot = False):
-        for trial_nb, trial_i in enumerate(self.state_obs_history):
-            nb_episodes = len(trial_i)
-            reward_record = []
-            for episode_nb, episode_j in enumerate(trial_i):
-                reward = episode_j[-1][-2]
-                reward_record.append(reward)
-            if plot:
-                plt.figure(figsize = (10,1))
-                x = np.arange(nb_episodes)
-                plt.scatter(x + 1, reward_record,
-                            s = 20,
-                            facecolor = (0,0,0,0),
-                            linewidths = 0.6,
-                            edgecolor = 'C3')
-                plt.xlabel('Episode')
-                plt.xlim(0, nb_episodes+1)
-                plt.ylim(-1, max(reward_record) + 1)
-                plt.ylabel('Reward')
-                plt.savefig(self.sess_output_path + self.Map.name + '_t' +
-                            str(trial_nb) + '_reward_record.png',
-                            dpi = dpi, bbox_inches = 'tight')
-                print('Reward log visualized.')
-                plt.close()
+        if not plot:
+            return
+        for trial_nb, reward_record in enumerate(self.final_rewards()):
+            nb_episodes = len(reward_record)
+            plt.figure(figsize = (10,1))
+            x = np.arange(nb_episodes)
+            plt.scatter(x + 1, reward_record,
+                        s = 20,
+                        facecolor = (0,0,0,0),
+                        linewidths = 0.6,
+                        edgecolor = 'C3')
+            plt.xlabel('Episode')
+            plt.xlim(0, nb_episodes+1)
+            plt.ylim(-1, max(reward_record) + 1)
+            plt.ylabel('Reward')
+            plt.savefig(self.sess_output_path + self.Map.name + '_t' +
+                        str(trial_nb) + '_reward_record.png',
+                        dpi = dpi, bbox_inches = 'tight')
+            print('Reward log visualized.')
+            plt.close()
 
     def visualize_final_states(self, dpi, plot = False):
         list_of_final_states = self.Map.states_by_level[-1]
         min_state = list_of_final_states[0]
         nb_final_states = len(list_of_final_states)
-        nb_episodes = len(self.state_obs_history[0])
-        for trial_nb, trial_i in enumerate(self.state_obs_history):
+        final_states = self.trajectories.per_trial(self.trajectories.final_obs('state'))
+        for trial_nb, final_states_i in enumerate(final_states):
+            nb_episodes = len(final_states_i)
             visual_matrix = np.zeros((nb_final_states, nb_episodes))
-            # extract last states
-            for episode_nb, episode_j in enumerate(trial_i):
-                state = episode_j[-1][1]
-                visual_matrix[state - min_state, episode_nb] = 1
+            # mark last states
+            visual_matrix[final_states_i - min_state, np.arange(nb_episodes)] = 1
             # plot
             if plot:
                 plt.figure(figsize = (7,3))
@@ -101,12 +103,9 @@ class Analysis:
                 print('Final states visited visualized.')
 
     def visualize_timesteps_per_episode(self, dpi, plot = False):
-        for trial_nb, trial_i in enumerate(self.state_obs_history):
-            episodes_length = []
-            for episode_nb, episode_j in enumerate(trial_i):
-                episode_length = len(episode_j)
-                episodes_length.append(episode_length)
-            nb_episodes = len(trial_i)
+        all_lengths = self.trajectories.per_trial(self.trajectories.episode_lengths())
+        for trial_nb, episodes_length in enumerate(all_lengths):
+            nb_episodes = len(episodes_length)
             # plot
             if plot:
                 plt.figure(figsize = (5,3.5))
@@ -125,36 +124,65 @@ class Analysis:
                 print('Timesteps per episode plotted.')
             self.all_timesteps_trial.append(episodes_length)
 
+    def compute_path_efficiency(self):
+        '''
+        shortest number of moves from the start state to a reward, divided by the number of moves
+        taken, for every episode that ended in a reward (NaN otherwise). Per trial.
+        Distances come from the maze of each episode's reward configuration (Binary_Maze.py).
+        '''
+        trajectories = self.trajectories
+        trial_offsets = np.array(trajectories.trial_offsets)
+        episodes = np.arange(trajectories.nb_episodes) - np.repeat(trial_offsets[:-1], np.diff(trial_offsets))
+        configs = np.maximum(np.searchsorted(self.Session.reward_schedule, episodes, side = 'right') - 1, 0)
+        init_states = trajectories.init_state[:trajectories.nb_episodes]
+        shortest = np.zeros(trajectories.nb_episodes)
+        for config in np.unique(configs):
+            in_config = configs == config
+            shortest[in_config] = self.Session.maze_of_config(config).distance_to_rewards(init_states[in_config])
+        moves = trajectories.episode_lengths() - 1
+        rewarded = (trajectories.final_obs('reward') > 0) & (moves > 0) & (shortest >= 0)
+        efficiency = np.full(trajectories.nb_episodes, np.nan)
+        efficiency[rewarded] = shortest[rewarded] / moves[rewarded]
+        return trajectories.per_trial(efficiency)
+
+    def log_path_efficiency(self, dpi, plot = False):
+        '''
+        saves compute_path_efficiency (trials x episodes, NaN for unrewarded episodes) to
+        path_efficiency.npy in the session folder. plot: mean over trials per episode.
+        '''
+        self.path_efficiency = np.array(self.compute_path_efficiency())
+        np.save(self.sess_output_path + 'path_efficiency.npy', self.path_efficiency)
+        if plot:
+            nb_episodes = self.path_efficiency.shape[1]
+            plt.figure(figsize = (5,3.5))
+            x = np.arange(nb_episodes) + 1
+            # mean over the trials rewarded in each episode
+            rewarded = np.sum(~np.isnan(self.path_efficiency), axis = 0)
+            mean = np.full(nb_episodes, np.nan)
+            mean[rewarded > 0] = np.nansum(self.path_efficiency, axis = 0)[rewarded > 0] / rewarded[rewarded > 0]
+            plt.plot(x, mean, color = 'C2', linewidth = 2)
+            ax = plt.axes()
+            ax.spines['top'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+            plt.xlabel('Episode')
+            plt.xlim(1, nb_episodes)
+            plt.ylim(0, 1.05)
+            plt.ylabel('Path Efficiency')
+            plt.savefig(self.sess_output_path + self.Map.name + '_path_efficiency.png',
+                        dpi = dpi, bbox_inches = 'tight')
+            plt.close()
+            print('Path efficiency plotted.')
+
     def compare_total_steps_till_reward(self, dpi):
         ''' compute how many total steps it takes until first reward is encountered
-        state_obs_history: trials, episodes, timesteps within episode
+        (number of observations before the first rewarded one, across episodes of a trial)
         '''
-        self.steps = []
-        for trial_nb, trial_i in enumerate(self.state_obs_history):
-            steps_trial_i = 0
-            for episode_nb, episode_j in enumerate(trial_i):
-                for obs_t in episode_j:
-                    reward = obs_t[2]
-                    if reward > 0:
-                        break
-                    else:
-                        steps_trial_i += 1
-                if reward > 0: break
-            self.steps.append(steps_trial_i)
+        self.steps = self.trajectories.steps_until_reward().tolist()
 
     def log_reward(self, plot = False, dpi = 300):
-        for trial_nb, trial_i in enumerate(self.state_obs_history):
-            nb_episodes = len(trial_i)
-            reward_record = []
-            for episode_nb, episode_j in enumerate(trial_i):
-                reward = episode_j[-1][-2]
-                if episode_nb > 0:
-                    reward_record.append(reward)
-                    # changed
-                else:
-                    reward_record.append(reward)
+        for trial_nb, reward_record in enumerate(self.final_rewards()):
             if plot:
-                self.plot_reward(dpi, nb_episodes, reward_record, trial_nb)
+                self.plot_reward(dpi, len(reward_record), reward_record, trial_nb)
                 print('Trial-averaged rewards across episodes plotted.')
             self.cumulative_rewards.append(reward_record)
 
@@ -176,21 +204,31 @@ class Analysis:
                     dpi=dpi, bbox_inches='tight')
         plt.close()
 
+    def snapshot_matrix(self, log, trial_nb):
+        '''
+        (state-actions, snapshots) matrix of one trial, for the state-action pairs present in the
+        last snapshot (sorted by state, action). Pairs missing from a snapshot are 0.
+        '''
+        if log.mode == 'sparse':
+            snapshots, columns, values = log.trial_entries(trial_nb)
+            nb_snapshots = len(log.snapshot_episodes)
+            visited_stateactions = np.unique(columns[snapshots == nb_snapshots - 1])
+            keep = np.isin(columns, visited_stateactions)
+            matrix = np.zeros((len(visited_stateactions), nb_snapshots))
+            matrix[np.searchsorted(visited_stateactions, columns[keep]), snapshots[keep]] = values[keep]
+            return matrix
+        snapshots = log.trial_snapshots(trial_nb)
+        visited_stateactions = np.flatnonzero(~np.isnan(snapshots[-1]))
+        return np.nan_to_num(snapshots[:, visited_stateactions].T, nan = 0)
+
     def visualize_state_values(self, dpi, plot = False):
         '''
         Visualize q value changes over episodes and trials.
-        NOTE: this dictionary object may contain incomplete state access history,
+        NOTE: the snapshots may contain incomplete state access history,
         due to the nature of the exploration policy.
         '''
-        for trial_nb, trial_i in enumerate(self.value_history):
-            visited_stateactions = list(trial_i[-1])
-            visited_stateactions.sort()
-            nb_episodes = len(trial_i)
-            value_matrix = np.zeros((len(visited_stateactions), nb_episodes))
-            for episode_nb, episode_j in enumerate(trial_i):
-                for row_nb, stateaction_k in enumerate(visited_stateactions):
-                    if stateaction_k in episode_j:
-                        value_matrix[row_nb, episode_nb] = episode_j[stateaction_k]
+        for trial_nb in np.flatnonzero(self.value_log.recorded):
+            value_matrix = self.snapshot_matrix(self.value_log, trial_nb)
             # plot
             if plot:
                 plt.figure(figsize = (6,4))
@@ -198,7 +236,7 @@ class Analysis:
                            vmin=math.floor(np.min(value_matrix)),
                            vmax=math.ceil(np.max(value_matrix)))
                 plt.ylabel('Agent State-Action Value')
-                plt.xlabel('Episode')
+                plt.xlabel('Snapshot')
                 plt.colorbar()
                 plt.savefig(self.sess_output_path + self.Map.name + '_t' + str(trial_nb) +
                             '_value_across_learning.png', dpi = dpi, bbox_inches = 'tight')
@@ -209,19 +247,12 @@ class Analysis:
 
     def visualize_state_novelty(self, dpi, plot = False):
         '''
-        Visualize q value changes over episodes and trials.
-        NOTE: this dictionary object may contain incomplete state access history,
+        Visualize novelty changes over episodes and trials.
+        NOTE: the snapshots may contain incomplete state access history,
         due to the nature of the exploration policy.
         '''
-        for trial_nb, trial_i in enumerate(self.novelty_history):
-            visited_stateactions = list(trial_i[-1])
-            visited_stateactions.sort()
-            nb_episodes = len(trial_i)
-            novelty_matrix = np.zeros((len(visited_stateactions), nb_episodes))
-            for episode_nb, episode_j in enumerate(trial_i):
-                for row_nb, stateaction_k in enumerate(visited_stateactions):
-                    if stateaction_k in episode_j:
-                        novelty_matrix[row_nb, episode_nb] = episode_j[stateaction_k]
+        for trial_nb in np.flatnonzero(self.novelty_log.recorded):
+            novelty_matrix = self.snapshot_matrix(self.novelty_log, trial_nb)
             # plot
             if plot:
                 plt.figure(figsize = (6,4))
@@ -229,7 +260,7 @@ class Analysis:
                            vmin=math.floor(np.min(novelty_matrix)),
                            vmax=math.ceil(np.max(novelty_matrix)))
                 plt.ylabel('Agent State-Action Novelty')
-                plt.xlabel('Episode')
+                plt.xlabel('Snapshot')
                 plt.colorbar()
                 plt.savefig(self.sess_output_path + self.Map.name + '_t' + str(trial_nb) +
                             '_novelty_across_learning.png', dpi = dpi, bbox_inches = 'tight')
@@ -237,7 +268,3 @@ class Analysis:
                 print('Novelty visualized.')
             self.value_matrix = novelty_matrix
             # USEFUL FOR DEBUGGING: print(np.max(value_matrix))
-
-
-
-
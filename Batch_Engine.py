@@ -0,0 +1,227 @@
+'''
+Batched multi-trial engine. Runs all trials of a session in lockstep, with the
+trial index as the first array dimension.
+
+Each tick advances every unfinished trial by one agent step + one environment step:
+    Q function:       (trials * states, actions) float array + seen flag per row
+    exploration bonus (trials * states, max(actions, 4)) float array + seen mask
+    previous row / action: (trials,) int arrays
+Row trial * nb_states + state of a table holds the values of state in that trial, so
+the rows of all trials are read or written with one index per tick.
+The environment is a VecInteract with one instance per trial (Vec_Interact.py), which
+holds current states and episode counters and starts new episodes by itself.
+Trials that finished all their episodes are masked out until every trial is done.
+
+The update rules are a vectorized copy of Agent.step for the configurations below,
+and every trial consumes its own random stream (Random_Stream.RandomStreams) with the
+same recipe and in the same order as Agent / Interact. Given the same trial seeds, the
+batched run is identical to the per-trial loop in Experiment.serialloop.
+
+Supported configurations:
+    value update: TD with lambda = 0
+    exploration policy: e-greedy, softmax, random
+    add exploration bonus: True / False (without novelty increase)
+    learn model: False
+    probabilistic agent state: False
+Environment: episode_termination = 'environment termination states'
+
+Visited states and actions are logged by VecInteract and handed to the Interact trajectory
+buffer in trial order (Interact.record_trial). Q / novelty snapshots go to the Interact
+snapshot logs at the end of each episode.
+
+Runs can stop at an episode boundary (run(until_episode)), e.g. to checkpoint the whole
+object with its Interact logs, and resume from there (see Experiment.batchloop).
+'''
+import numpy as np
+from Random_Stream import RandomStreams
+from Vec_Interact import VecInteract
+
+
+def batch_supported(agent_spec, env_settings):
+    '''check whether the batched engine implements this agent / environment configuration'''
+    if agent_spec['value update'] != 'TD' or agent_spec.get('lambda', 0) != 0:
+        return False
+    if agent_spec['exploration policy'] not in ['e-greedy', 'softmax', 'random']:
+        return False
+    if agent_spec['learn model'] or agent_spec.get('probabilistic agent state', False):
+        return False
+    if agent_spec.get('novelty increase', False):
+        return False
+    if env_settings['episode_termination'] != 'environment termination states':
+        return False
+    return True
+
+
+class BatchTrials:
+
+    flip_actions = np.array([1, 0, 3, 2]) # same reversal map as Agent.init_novelty
+
+    def __init__(self, agent_spec, Session, nb_trials, nb_episodes, seed_sequences):
+        self.parameters = agent_spec
+        self.rng = RandomStreams(seed_sequences)
+        self.Session = Session
+        self.nb_trials = nb_trials
+        self.nb_episodes = nb_episodes
+        self.learn_rate = agent_spec.get('learning rate', 0.1)
+        self.discount_rate = agent_spec.get('discount rate', 0.8)
+        self.exploration_policy = agent_spec['exploration policy']
+        self.add_bonus = agent_spec['add exploration bonus']
+        # one environment instance per trial, sharing the trial's random stream
+        self.env = VecInteract(Session, nb_trials, nb_episodes, self.rng)
+        self.nb_states = self.env.nb_states
+        self.nb_actions = self.env.nb_actions
+        self.init_agents()
+
+    def init_agents(self):
+        # row trial * nb_states + state holds the values of state in that trial
+        shape = (self.nb_trials * self.nb_states, self.nb_actions)
+        self.Q = np.zeros(shape)
+        # Q values of a state are assigned for all actions at once: one seen flag per row
+        self.Q_seen = np.zeros(shape[0], dtype = bool)
+        if self.add_bonus:
+            shape = (self.nb_trials * self.nb_states, max(self.nb_actions, 4))
+            self.novelty = np.zeros(shape)
+            self.novelty_seen = np.zeros(shape, dtype = bool)
+        self.state = self.env.state  # current state of every trial, updated in place by the environment
+        self.prev_row = np.full(self.nb_trials, -1)
+        self.prev_action = np.full(self.nb_trials, -1)
+
+    def run(self, until_episode = None):
+        '''
+        runs all trials to the end, or only until every trial reached the start of episode
+        until_episode: the object can then be saved (pickled) and the run continued later with
+        the same results. Logs are handed to Interact once all episodes are done.
+        '''
+        active = self.env.active_before(until_episode)
+        while len(active) > 0:
+            self.tick(active)
+            active = self.env.active_before(until_episode)
+        if len(self.env.active) == 0:
+            self.env.write_logs()
+
+    def tick(self, trials):
+        states, reward, terminal = self.env.observe(trials)
+        terminate = self.env.episode_done(trials, terminal)  # can_terminate = False at episode start
+        rows = trials * self.nb_states + states
+        ending = trials[terminate]
+        if len(ending) == 0:
+            acting, acting_rows = trials, rows
+        else:
+            acting, acting_rows = trials[~terminate], rows[~terminate]
+        # agent step: pick action for non-terminal trials
+        acting_actions = np.zeros(0, dtype = int)
+        if len(acting) > 0:
+            acting_actions = self.pick_actions(acting, acting_rows)
+            if self.add_bonus:
+                self.reduce_novelty(acting_rows, acting_actions)
+        # TD(0) update wherever a previous state exists
+        self.learn_TD0(trials, rows, reward)
+        # end of episode for terminal trials
+        actions = acting_actions
+        if len(ending) > 0:
+            for b in ending.tolist():
+                self.record_values(b)
+            self.prev_row[ending] = -1
+            self.prev_action[ending] = -1
+            actions = np.full(len(trials), -1)
+            actions[~terminate] = acting_actions
+        self.prev_row[acting] = acting_rows
+        self.prev_action[acting] = acting_actions
+        # environment step: terminal trials start their next episode
+        self.env.step(trials, actions, terminate)
+
+    def pick_actions(self, trials, rows):
+        self.init_rows(trials, rows)
+        values = self.Q.take(rows, axis = 0)
+        if self.exploration_policy == 'e-greedy':
+            return self.egreedy_choice(trials, values)
+        elif self.exploration_policy == 'softmax':
+            return self.softmax_choice(trials, values)
+        return self.rng.integers(self.nb_actions, trials)
+
+    def init_rows(self, trials, rows, max_bonus = 1, lr = 0.2):
+        '''
+        vectorized Agent.init_novelty (reduce_for_reversal = True) followed by Agent.init_values.
+        Both fill all actions of a state at once, so the novelty of a state is seen for all
+        actions in the action space or for none (column 0 tells which rows are new). Only new rows
+        are written, plus the reversal novelty entries outside the action space.
+        '''
+        if self.add_bonus:
+            new = ~self.novelty_seen[rows, 0]
+            prev_action = self.prev_action[trials]
+            reverse_action = self.flip_actions[prev_action]  # meaningless where prev_action = -1
+            # checked before the new rows are filled, as Agent.init_novelty does
+            reversal = (prev_action >= 0) & ~self.novelty_seen[rows, reverse_action]
+            if np.count_nonzero(new):
+                self.novelty[rows[new], :self.nb_actions] = max_bonus
+                self.novelty_seen[rows[new], :self.nb_actions] = True
+            if np.count_nonzero(reversal):
+                self.novelty[rows[reversal], reverse_action[reversal]] = max_bonus - self.parameters['reduction']
+                self.novelty_seen[rows[reversal], reverse_action[reversal]] = True
+        new = ~self.Q_seen.take(rows)
+        if np.count_nonzero(new):
+            new_rows = rows[new]
+            if self.add_bonus:
+                self.Q[new_rows] = lr * self.novelty[new_rows, :self.nb_actions]
+            self.Q_seen[new_rows] = True
+
+    def egreedy_choice(self, trials, values):
+        explore = self.rng.random(trials) < self.parameters['epsilon']
+        actions = values.argmax(axis = 1)
+        explore |= actions == values.argmin(axis = 1)  # all values equal
+        if np.count_nonzero(explore):
+            actions[explore] = self.rng.integers(self.nb_actions, trials[explore])
+        return actions
+
+    def softmax_choice(self, trials, values):
+        return self.rng.choice(np.exp(values), trials)
+
+    def reduce_novelty(self, rows, actions, min_novelty = 0):
+        '''vectorized Agent.reduce_state_novelty'''
+        novelty, pairs = self.novelty.reshape(-1), rows * self.novelty.shape[1] + actions
+        bonus_current = novelty[pairs]
+        bonus_reduced = np.maximum(bonus_current - self.parameters['reduction'], 0)
+        novelty[pairs] = np.where(bonus_current > min_novelty, bonus_reduced, bonus_current)
+
+    def learn_TD0(self, trials, rows, reward):
+        '''vectorized Agent.learn_TD0_value'''
+        prev_row = self.prev_row[trials]
+        has_prev = prev_row >= 0
+        nb_prev = np.count_nonzero(has_prev)
+        if nb_prev < len(trials):
+            if nb_prev == 0:
+                return
+            trials, rows, reward, prev_row = trials[has_prev], rows[has_prev], reward[has_prev], prev_row[has_prev]
+        prev_action = self.prev_action[trials]
+        # unseen Q(s, a) of the current state are initialized to 0 (terminal states)
+        new = ~self.Q_seen.take(rows)
+        if np.count_nonzero(new):
+            self.Q_seen[rows[new]] = True
+        max_value = self.Q.take(rows, axis = 0).max(axis = 1)
+        Q, pairs = self.Q.reshape(-1), prev_row * self.nb_actions + prev_action
+        prev_value = Q[pairs]
+        Q[pairs] = prev_value + self.learn_rate * (reward + self.discount_rate * max_value - prev_value)
+
+    def learner(self, trial):
+        '''
+        final state of a trial in the episode kernel format (EpisodeKernel.run_trial):
+        {'rng': RandomStream at the trial's position, 'tables': (Q rows, novelty)}
+        '''
+        block = slice(trial * self.nb_states, (trial + 1) * self.nb_states)
+        Q = [row if seen else None for row, seen in zip(self.Q[block].tolist(), self.Q_seen[block].tolist())]
+        novelty = {}
+        if self.add_bonus:
+            states, actions = np.nonzero(self.novelty_seen[block])
+            values = self.novelty[block][states, actions]
+            novelty = dict(zip(zip(states.tolist(), actions.tolist()), values.tolist()))
+        return {'rng': self.rng.stream(trial), 'tables': (Q, novelty)}
+
+    def record_values(self, trial):
+        '''snapshots of Q / novelty at the end of an episode, as in Interact.add_value_to_record'''
+        Session, episode = self.Session, self.env.episode[trial]
+        # trials are handed to Interact after the run, in order
+        trial_id = Session.trajectories.nb_trials + trial
+        block = slice(trial * self.nb_states, (trial + 1) * self.nb_states)
+        Session.value_log.record_array(trial_id, episode, self.Q[block], self.Q_seen[block, None])
+        if self.add_bonus:
+            Session.novelty_log.record_array(trial_id, episode, self.novelty[block], self.novelty_seen[block])
@@ -16,7 +16,17 @@ Variables:
     Transition matrix: State(t+1) = state_transition_matrix[State(t), action(t)]
     All variables are fixed. Transition matrix is instantiated based on parameter 'levels'
 
+States are heap indexed (children of s: 2s + 1, 2s + 2, parent: (s - 1) // 2), so the
+transition, level, position and parent tables are int32 arrays computed in closed form
+(a 20 level maze, ~1M states, builds in tens of milliseconds).
+termination_mask: boolean array over states, termination_states: its nonzero states.
+
+Distances: distance_table(targets) is a cached multi-source BFS over the transition table
+(moves to the nearest target, per state, see Maze_Graph.py), tree_distance(a, b) the
+closed-form distance between arrays of state pairs via their lowest common ancestor.
+
 Each state ALWAYS has 2 or 3 actions (depending on if reversal is allowed.
+(k-ary trees, branching = k: k or k + 1 actions.)
 For custom mazes with arbitrary action space in grid space, use Maze.py
 
 Note: Nothing is stored / modified in this object during learning.
@@ -24,24 +34,58 @@ Note: Nothing is stored / modified in this object during learning.
 '''
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 import os, sys, glob
+import copy
+from Maze_Graph import MazeGraph
+
+
+def heap_levels(states):
+    '''level of each heap-indexed state (vectorized: bit length of state + 1, minus 1)'''
+    return np.frexp(np.asarray(states, dtype = np.float64) + 1)[1] - 1
 
 
-class BinaryMaze:
+def tree_distance(states_a, states_b, allow_reversals = True):
+    '''
+    number of moves between heap-indexed states, pairwise over arrays, in closed form.
+    With reversals: path through the lowest common ancestor (LCA), level(a) + level(b) - 2 level(LCA).
+    Without reversals, b is only reachable from a if a is an ancestor of b (else -1).
+    Exact for states < 2^53.
+    '''
+    nodes_a = np.asarray(states_a, dtype = np.int64) + 1  # 1-based: parent of n is n >> 1
+    nodes_b = np.asarray(states_b, dtype = np.int64) + 1
+    levels_a, levels_b = heap_levels(states_a), heap_levels(states_b)
+    # ancestors of a and b at the level of the shallower state
+    ancestors_a = nodes_a >> np.maximum(levels_a - levels_b, 0)
+    ancestors_b = nodes_b >> np.maximum(levels_b - levels_a, 0)
+    lca_levels = np.minimum(levels_a, levels_b) - np.frexp((ancestors_a ^ ancestors_b).astype(np.float64))[1]
+    if allow_reversals:
+        return levels_a + levels_b - 2 * lca_levels
+    return np.where(lca_levels == levels_a, levels_b - levels_a, -1)
 
-    def __init__(self, name, nb_levels, reward_location, allow_reversals = True, save = False):
-        assert nb_levels > 1
+
+class BinaryMaze(MazeGraph):
+
+    # arrays that only depend on (nb_levels, branching, allow_reversals), see init_structure
+    structure_arrays = ['states', 'level_of_state', 'position_of_state', 'parent_of_state', 'state_trans_matrix']
+
+    def __init__(self, name, nb_levels, reward_location, allow_reversals = True, save = False, store = None,
+                 branching = 2):
+        '''
+        store: optional Maze_Store.MazeStore to load the structure arrays from (memory-mapped)
+        branching: number of children per state (k-ary tree, see Maze_Generator.py). Default 2.
+        '''
+        assert nb_levels > 1 and branching > 1
         self.name = name
         self.nb_levels = nb_levels
+        self.branching = branching
         self.allow_reversals = allow_reversals
         if self.allow_reversals:
-            self.action_space = 3
+            self.action_space = branching + 1
         else:
-            self.action_space = 2
-        self.nb_states = 2 ** (nb_levels) - 1
-        self.assign_states_to_levels()
-        self.init_state_transition_map()
+            self.action_space = branching
+        self.nb_states = (branching ** nb_levels - 1) // (branching - 1)
+        self.init_structure(store)
+        self.distance_cache = {}  # target states -> distance table, see distance_table
         self.reward_locations = reward_location
         self.init_reward()
         self.start_state = 0
@@ -55,53 +99,61 @@ class BinaryMaze:
             os.mkdir(path)
 
     def init_state_transition_map(self):
-        self.state_trans_matrix = np.zeros((self.nb_states, self.action_space))
         self.compute_trans_map()
 
+    def init_structure(self, store = None):
+        if store is None:
+            self.compile_structure()
+            return
+        params = {'maze type': 'binary', 'number of levels': self.nb_levels, 'allow reversals': self.allow_reversals,
+                  'branching': self.branching}
+        arrays = store.load(params, self.compile_structure)
+        for name in self.structure_arrays:
+            setattr(self, name, arrays[name])
+        self.split_levels()
+
+    def compile_structure(self):
+        '''compute the structure arrays, returned as {name: array}'''
+        self.assign_states_to_levels()
+        self.init_state_transition_map()
+        return {name: getattr(self, name) for name in self.structure_arrays}
+
     def assign_states_to_levels(self):
-        self.states_by_level = []
-        curr_state = 0
-        for level_i in range(self.nb_levels):
-            nb_states_in_level_i = 2 ** level_i
-            states_in_level_i = np.arange(curr_state,curr_state+nb_states_in_level_i)
-            self.states_by_level.append(states_in_level_i)
-            curr_state = curr_state+nb_states_in_level_i
+        '''
+        heap layout: level l holds states 2^l - 1 .. 2^(l + 1) - 2, from left to right
+        (k-ary trees: the k^l states from (k^l - 1) / (k - 1) on).
+        level_of_state / position_of_state / parent_of_state are int arrays indexed by state,
+        states_by_level[l] is a view on the states of level l.
+        '''
+        self.states = np.arange(self.nb_states, dtype = np.int32)
+        level_sizes, level_starts = self.level_sizes()
+        self.level_of_state = np.repeat(np.arange(self.nb_levels, dtype = np.int8), level_sizes)
+        self.position_of_state = self.states - level_starts.astype(np.int32)[self.level_of_state]
+        self.parent_of_state = np.maximum((self.states - 1) // self.branching, 0)  # root is its own parent
+        self.split_levels()
+
+    def level_sizes(self):
+        '''number of states and first state of each level'''
+        level_sizes = self.branching ** np.arange(self.nb_levels, dtype = np.int64)
+        return level_sizes, (level_sizes - 1) // (self.branching - 1)
+
+    def split_levels(self):
+        level_sizes, level_starts = self.level_sizes()
+        self.states_by_level = [self.states[start:start + size] for start, size in zip(level_starts, level_sizes)]
 
     def compute_trans_map(self):
-        # for level_i in range(self.nb_levels):
-        #     if level_i < self.nb_levels - 1: # before reaching final layer
-        #         for pos, state_j in enumerate(self.states_by_level[level_i]):
-        #             next_level = level_i + 1
-        #             next_state_a0_position = pos*2
-        #             next_state_a0 = self.states_by_level[next_level][next_state_a0_position]
-        #             next_state_a1 = next_state_a0 + 1
-        #             self.state_trans_matrix[state_j] = [next_state_a0, next_state_a1]
-        # ### allow reversals
-        # if self.allow_reversals:
-        # todo: fix transition from leaf node for conditions allowing reversal
-        for level_i in range(self.nb_levels):
-            for pos, state_j in enumerate(self.states_by_level[level_i]):
-                next_states = []
-                if level_i < self.nb_levels - 1:  # before reaching final layer
-                    next_level = level_i + 1
-                    next_state_a0_position = pos * 2
-                    next_state_a0 = self.states_by_level[next_level][next_state_a0_position]
-                    next_state_a1 = next_state_a0 + 1
-                    next_states.append(next_state_a0) # next level, action L
-                    next_states.append(next_state_a1) # next level, action R
-                else: # last level. no more next states, only previous
-                    next_states.extend([state_j, state_j]) # todo: verify statistics with this
-                if self.allow_reversals:
-                    if level_i > 0:
-                        if pos % 2 == 0:
-                            prev_state_pos = pos // 2
-                        else:
-                            prev_state_pos = (pos - 1) // 2
-                        prev_state = self.states_by_level[level_i - 1][prev_state_pos]
-                    else:
-                        prev_state = 0
-                    next_states.append(prev_state)
-                self.state_trans_matrix[state_j] = next_states
+        '''
+        int32 transition table by heap arithmetic: actions 0 / 1 lead to children 2s + 1 / 2s + 2
+        (k-ary: action a < k leads to ks + 1 + a), leaves (last level) loop onto themselves,
+        action k (reversal, if allowed) leads to the parent (root: itself).
+        '''
+        states = self.states
+        is_leaf = self.level_of_state == self.nb_levels - 1
+        self.state_trans_matrix = np.empty((self.nb_states, self.action_space), dtype = np.int32)
+        for action in range(self.branching):
+            self.state_trans_matrix[:, action] = np.where(is_leaf, states, self.branching * states + 1 + action)
+        if self.allow_reversals:
+            self.state_trans_matrix[:, self.branching] = self.parent_of_state
 
     def init_reward(self):
         self.state_reward_matrix = np.zeros(self.nb_states)
@@ -111,18 +163,29 @@ class BinaryMaze:
             state = self.states_by_level[level][pos]
             self.state_reward_matrix[state] = self.reward_locations[reward_loc]
 
+    def with_rewards(self, reward_location):
+        '''
+        copy of this maze with another reward location. Structure (transition matrix, levels)
+        is shared with this maze, only reward and termination arrays are rebuilt.
+        '''
+        maze = copy.copy(self)
+        maze.reward_locations = reward_location
+        maze.init_reward()
+        maze.set_termination_states(reward_state = True, start_state = True)
+        return maze
+
     def set_termination_states(self, reward_state = True, leaf_nodes = False, start_state = False):
-        # set last level states to termination
-        self.termination_states = []
+        '''termination_mask: boolean array indexed by state. termination_states: the terminal states.'''
+        self.termination_mask = np.zeros(self.nb_states, dtype = bool)
         if reward_state:
             # only set rewarding state as terminal
-            self.termination_states.extend(np.where(self.state_reward_matrix != 0)[0])
+            self.termination_mask[self.state_reward_matrix != 0] = True
         if leaf_nodes:
             # set all states at lowest level to be terminal
-            self.termination_states.extend(self.states_by_level[-1])
+            self.termination_mask[self.states_by_level[-1]] = True
         if start_state:
-            start_state = 0
-            self.termination_states = np.append(self.termination_states, start_state)
+            self.termination_mask[self.start_state] = True
+        self.termination_states = np.flatnonzero(self.termination_mask)
 
     def save_map(self, name):
         self.init_save_path('data/maps/')
@@ -131,74 +194,100 @@ class BinaryMaze:
                 state_reward_matrix = self.state_reward_matrix)
         # print('** Maze successfully saved as .npz file: '+name)
 
-    def compute_shortest_dist(self, point = None, visualize = True):
-        '''
-        *** Deprecated function from Maze.py
-        compute shortest distance between each state and the point
-        Do this by assigning distances for adjacent states and progressively
-        move down.
-        This function is akin to Dijkstra's Algorithm.
-        Currently computing shortest distance to one reward location
-        '''
-        print('* Computing shortest distance to reward for each state..')
-        unvisited_states = set(np.arange(self.nb_states))
-        distances = np.full((self.nb_states), np.inf) # this is used to keep track of all distances.
-        curr_state = list(self.reward_func.keys())[0]
-        distances[curr_state] = 0 # reward state set to distance of 0
-        neighbor_states = self.find_neighbors(curr_state)
-        while len(unvisited_states) > 0:
-            if len(neighbor_states) > 0:
-                for neighborState in neighbor_states:
-                    if neighborState in unvisited_states:
-                        distances[neighborState] = distances[curr_state] + 1
-            # when finished with updating neighbor state dists, remove curr state
-            unvisited_states.discard(curr_state)
-            print('States left: '+str(len(unvisited_states)))
-            ## now pick next state: one with the smallest dist
-            minDist = float("inf")
-            for unvisitedState in unvisited_states:
-                dist = distances[unvisitedState]
-                if dist < minDist:
-                    minDist = dist
-                    minDistState = unvisitedState
-            curr_state = minDistState
-            neighbor_states = self.find_neighbors(curr_state)
-
-        self.state_reward_distance = distances
-
-        if visualize:
-            plt.ioff()
-            fig = plt.figure()
-            ax = fig.add_subplot(111)
-            cax = ax.matshow(np.reshape(distances, (17,17)), cmap = 'Reds')
-            map_png_dir = '/media/tzhang/Tony_WD_4TB/Maze_Videos/Maze_Design.png'
-            maze_map_png = mpimg.imread(map_png_dir)
-            height = np.shape(maze_map_png)[0]
-            maze_map_png = maze_map_png[:, 0:height]
-            plt.imshow(maze_map_png, extent=[-0.5, 16.5, -0.5, 16.5], origin='lower')
-            plt.gca().invert_yaxis()  # invert axis to align with video
-            fig.colorbar(cax)
-            plt.savefig('MazeDistanceMap.png', dpi = 200)
-            plt.close()
-
-    def find_neighbors(self, state):
-        '''
-        *** Deprecated function from Maze.py
-        for deterministic state transition maps only.
-        Returns all neighboring states, no corresponding actions
-        '''
-        stateTransProb = self.state_transition_prob[state]
-        neighbors = []
-        for actionProb in stateTransProb:
-            nextState = np.where(actionProb)[0][0] # finding where prob is 1
-            if nextState != state:
-                neighbors.append(nextState)
-        return neighbors
+    def distance(self, states_a, states_b):
+        '''shortest number of moves from states_a to states_b, pairwise (see tree_distance)'''
+        if self.branching != 2:
+            raise Exception('Closed-form distances are only implemented for binary trees, use distance_table')
+        return tree_distance(states_a, states_b, self.allow_reversals)
+
+
+class ImplicitBinaryMaze:
+    '''
+    Binary maze without tables, for trees too large to materialize (30 levels: ~1e9 states).
+    Same heap indexing and parameters as BinaryMaze; transitions (reversals and leaf
+    self-loops included) are computed from the state index, rewards are a sparse
+    {state: reward} dictionary and termination is a set membership test.
+    Used by Interact for mazes with 'implicit': True, with the dictionary Q table and the
+    per-step (agent) loop. nb_levels <= 31, so states fit the int32 trajectory columns.
+    '''
+
+    implicit = True
+
+    def __init__(self, name, nb_levels, reward_location, allow_reversals = True):
+        assert 1 < nb_levels <= 31
+        self.name = name
+        self.nb_levels = nb_levels
+        self.allow_reversals = allow_reversals
+        if self.allow_reversals:
+            self.action_space = 3
+        else:
+            self.action_space = 2
+        self.nb_states = 2 ** (nb_levels) - 1
+        self.first_leaf = 2 ** (nb_levels - 1) - 1
+        self.start_state = 0
+        self.reward_locations = reward_location
+        self.init_reward()
+        self.set_termination_states(reward_state = True, start_state = True)
+
+    def state_at(self, level, pos):
+        if not 0 <= pos < 2 ** level:
+            raise Exception('Position ' + str(pos) + ' out of range for level ' + str(level))
+        return 2 ** level - 1 + pos
+
+    def level_of(self, state):
+        return (state + 1).bit_length() - 1
+
+    def position_of(self, state):
+        return state - (2 ** self.level_of(state) - 1)
 
+    def init_reward(self):
+        self.state_rewards = {}
+        for reward_loc in self.reward_locations:
+            level, pos = reward_loc[0], reward_loc[1]
+            self.state_rewards[self.state_at(level, pos)] = float(self.reward_locations[reward_loc])
+
+    def with_rewards(self, reward_location):
+        maze = copy.copy(self)
+        maze.reward_locations = reward_location
+        maze.init_reward()
+        maze.set_termination_states(reward_state = True, start_state = True)
+        return maze
+
+    def set_termination_states(self, reward_state = True, start_state = False):
+        self.termination_states = set()
+        if reward_state:
+            self.termination_states.update(state for state, reward in self.state_rewards.items() if reward != 0)
+        if start_state:
+            self.termination_states.add(self.start_state)
 
+    def next_state(self, state, action):
+        if action == 2:  # reversal, the root stays
+            return max((state - 1) // 2, 0)
+        if state >= self.first_leaf:
+            return state
+        return 2 * state + 1 + action
 
+    def reward(self, state):
+        return self.state_rewards.get(state, 0.)
 
+    def is_terminal(self, state):
+        return state in self.termination_states
 
+    def distance_to_rewards(self, states):
+        '''shortest number of moves from each of states to a rewarded state (-1: unreachable)'''
+        states = np.asarray(states)
+        distances = np.full(states.shape, -1, dtype = np.int64)
+        for reward_state, reward in self.state_rewards.items():
+            if reward == 0:
+                continue
+            to_reward = tree_distance(states, np.full(states.shape, reward_state), self.allow_reversals)
+            closer = (to_reward >= 0) & ((distances < 0) | (to_reward < distances))
+            distances[closer] = to_reward[closer]
+        return distances
 
+    def distance(self, states_a, states_b):
+        return tree_distance(states_a, states_b, self.allow_reversals)
 
+    def compute_neighbour_table(self, radius = 1):
+        raise Exception('Neighbour tables are not available for implicit mazes')
 
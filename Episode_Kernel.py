@@ -0,0 +1,214 @@
+'''
+Fused episode kernel. Runs whole trials of the common agent configurations in one
+loop, directly against the compiled transition / reward / termination tables, instead
+of exchanging observation lists between Interact and Agent every step.
+
+Per step, the kernel does what Agent.step + Interact.step do for the configurations
+below: novelty initialization and reduction, value initialization, action choice,
+TD(0) or TD(lambda) update, state transition. Random draws come from the trial's
+RandomStream in the same order as Agent / Interact, so trajectories and values are
+identical to the per-step loop for the same seed.
+
+Supported configurations:
+    value update: TD, any lambda (all trace modes)
+    exploration policy: e-greedy, softmax, random
+    add exploration bonus: True / False (without novelty increase)
+    learn model: False
+    probabilistic agent state: False
+Environment: episode_termination = 'environment termination states'
+
+Visited states and actions are written into preallocated buffers (grown by doubling)
+and handed to the Interact trajectory buffer at the end of each trial.
+
+A trial can also run in parts: run_trial returns the learned tables (Q rows, novelty),
+which continue the trial from the next episode with the same RandomStream (see Sweep.Halving).
+'''
+import numpy as np
+from Random_Stream import sample_index
+
+
+def kernel_supported(agent_spec, env_settings):
+    '''check whether the episode kernel implements this agent / environment configuration'''
+    if agent_spec['value update'] != 'TD':
+        return False
+    if agent_spec['exploration policy'] not in ['e-greedy', 'softmax', 'random']:
+        return False
+    if agent_spec['learn model'] or agent_spec.get('probabilistic agent state', False):
+        return False
+    if agent_spec.get('novelty increase', False):
+        return False
+    if env_settings['episode_termination'] != 'environment termination states':
+        return False
+    return True
+
+
+class EpisodeKernel:
+
+    flip_actions = {0: 1, 1: 0, 2: 3, 3: 2} # same reversal map as Agent.init_novelty
+
+    def __init__(self, agent_spec, Session, nb_episodes, capacity = 4096):
+        self.parameters = agent_spec
+        self.Session = Session
+        self.nb_episodes = nb_episodes
+        self.learn_rate = agent_spec.get('learning rate', 0.1)
+        self.discount_rate = agent_spec.get('discount rate', 0.8)
+        self.exploration_policy = agent_spec['exploration policy']
+        self.add_bonus = agent_spec['add exploration bonus']
+        self.TD_lambda = agent_spec['lambda']
+        self.trace_mode = agent_spec.get('trace', 'accumulating')
+        self.trace_cutoff = agent_spec.get('trace cutoff', 1e-8)
+        if self.trace_mode not in ['accumulating', 'replacing', 'dutch']:
+            raise Exception('Unknown trace: ' + str(self.trace_mode))
+        state_trans_matrix, rewards, terminals, self.episode_config = \
+            Session.compile_environment(nb_episodes)
+        # python lists: scalar indexing in the step loop is much cheaper than on arrays
+        self.state_trans_matrix = state_trans_matrix.tolist()
+        self.rewards = rewards.tolist()
+        self.terminals = terminals.tolist()
+        self.nb_states = Session.Maze.nb_states
+        self.nb_actions = Session.Maze.action_space
+        self.action_space = Session.action_space
+        self.states = np.zeros(capacity, dtype = np.int64)
+        self.actions = np.zeros(capacity, dtype = np.int64)
+        self.episode_offsets = np.zeros(nb_episodes + 1, dtype = np.int64)
+
+    def grow(self):
+        for name in ['states', 'actions']:
+            column = getattr(self, name)
+            new_column = np.zeros(2 * len(column), dtype = column.dtype)
+            new_column[:len(column)] = column
+            setattr(self, name, new_column)
+
+    def init_state(self, rng):
+        if self.Session.properties['init_state'] == 'random':
+            return rng.integers(self.nb_states)
+        return self.Session.fixed_init_state()
+
+    def choose(self, values, rng):
+        '''action choice, same draws as Agent.egreedy_choice / softmax_choice / random_choice'''
+        if self.exploration_policy == 'e-greedy':
+            if rng.random() >= self.parameters['epsilon'] and max(values) != min(values):
+                return values.index(max(values))
+            return rng.integers(self.nb_actions)
+        elif self.exploration_policy == 'softmax':
+            return sample_index(np.cumsum(np.exp(values)), rng.random())
+        return rng.integers(self.nb_actions)
+
+    def run_trial(self, rng, episodes = None, tables = None):
+        '''
+        run episodes (indices, in order, default all nb_episodes) of one trial with RandomStream rng.
+        Q rows are created per state (all actions at once), as Agent initializes them.
+        tables: (Q rows, novelty) returned by an earlier call for the same trial and rng, to
+        continue the trial from an episode boundary (updated in place). Returns the tables.
+        '''
+        if episodes is None:
+            episodes = range(self.nb_episodes)
+        learn_rate, discount_rate = self.learn_rate, self.discount_rate
+        reduction = self.parameters.get('reduction', 0)
+        trace_decay = self.TD_lambda * discount_rate
+        state_trans_matrix, nb_actions = self.state_trans_matrix, self.nb_actions
+        if tables is None:
+            tables = ([None] * self.nb_states, {})
+        Q, novelty = tables
+        # traces never carry over episodes, so (Q, novelty) is all the state between episodes
+        traces = {}
+        trace_boundary = False
+        trial = self.Session.trajectories.nb_trials
+        value_log, novelty_log = self.Session.value_log, self.Session.novelty_log
+        step = 0
+        self.episodes = episodes
+        for run, episode in enumerate(episodes):
+            self.episode_offsets[run] = step
+            config = self.episode_config[episode]
+            rewards, terminals = self.rewards[config], self.terminals[config]
+            state = self.init_state(rng)
+            prev_state = prev_action = None
+            first_step = True
+            while True:
+                if step == len(self.states):
+                    self.grow()
+                self.states[step] = state
+                reward, env_terminate = rewards[state], terminals[state]
+                terminate = env_terminate and not first_step
+                # pick action (Agent.pick_action)
+                action = None
+                if not terminate:
+                    if self.add_bonus:
+                        if prev_action is not None:
+                            reverse_key = (state, self.flip_actions[prev_action])
+                            if reverse_key not in novelty:
+                                novelty[reverse_key] = 1 - reduction
+                        for a in range(nb_actions):
+                            if (state, a) not in novelty:
+                                novelty[state, a] = 1
+                    if Q[state] is None:
+                        if self.add_bonus:
+                            Q[state] = [0.2 * novelty[state, a] for a in range(nb_actions)]
+                        else:
+                            Q[state] = [0] * nb_actions
+                    action = self.choose(Q[state], rng)
+                    if self.add_bonus:
+                        bonus_current = novelty[state, action]
+                        if bonus_current > 0:
+                            novelty[state, action] = max(bonus_current - reduction, 0)
+                # value update
+                if self.TD_lambda == 0:
+                    if prev_state is not None:
+                        if Q[state] is None:
+                            Q[state] = [0] * nb_actions
+                        prev_value = Q[prev_state][prev_action]
+                        Q[prev_state][prev_action] = prev_value + learn_rate * (
+                                reward + discount_rate * max(Q[state]) - prev_value)
+                else:
+                    if prev_state is not None and not trace_boundary:
+                        current_value = Q[state][action] if action is not None else 0
+                        if self.add_bonus:
+                            reward = reward + novelty[prev_state, prev_action]
+                        delta_target = reward + discount_rate * current_value - Q[prev_state][prev_action]
+                        traces = self.update_traces(traces, (prev_state, prev_action), trace_decay)
+                        for (s, a), eligibility in traces.items():
+                            Q[s][a] += learn_rate * eligibility * delta_target
+                    trace_boundary = env_terminate
+                    if env_terminate:
+                        traces = {}
+                if terminate:
+                    break
+                # environment step
+                self.actions[step] = action
+                prev_state, prev_action = state, action
+                state = state_trans_matrix[state][action]
+                first_step = False
+                step += 1
+            step += 1
+            # logs number the episodes of this run from 0, as Interact does for a continued trial
+            if value_log.wants(run):
+                seen = np.array([row is not None for row in Q])
+                values = np.zeros((self.nb_states, nb_actions))
+                values[seen] = [row for row in Q if row is not None]
+                value_log.record_array(trial, run, values, np.repeat(seen[:, None], nb_actions, axis = 1))
+                if self.add_bonus:
+                    novelty_log.record(trial, run, novelty)
+        self.episode_offsets[len(episodes)] = step
+        return tables
+
+    def update_traces(self, traces, prev_state_action, decay):
+        '''same as Agent.update_traces'''
+        new_traces = {}
+        for state_action, eligibility in traces.items():
+            eligibility *= decay
+            if eligibility >= self.trace_cutoff:
+                new_traces[state_action] = eligibility
+        if self.trace_mode == 'accumulating':
+            new_traces[prev_state_action] = new_traces.get(prev_state_action, 0) + 1
+        elif self.trace_mode == 'replacing':
+            new_traces[prev_state_action] = 1
+        else: # dutch
+            new_traces[prev_state_action] = (1 - self.learn_rate) * new_traces.get(prev_state_action, 0) + 1
+        return new_traces
+
+    def write_trial(self):
+        '''hand the buffers of the last trial to Interact'''
+        nb_run = len(self.episodes)
+        nb_obs = self.episode_offsets[nb_run]
+        self.Session.record_trial(self.states[:nb_obs], self.actions[:nb_obs], self.episode_offsets[:nb_run + 1].copy(),
+                                  first_episode = self.episodes[0])
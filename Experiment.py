@@ -7,25 +7,84 @@ Class inputs:
     agents: list of agents, or just one agent.
     if both agents and environments are lists, the corresponding indexed agent will be
     ran on the corresponding environment
+    engine: 'serial' (default) runs trials one after another. Supported agent configurations
+        run in the fused episode kernel (see Episode_Kernel.py), others step Agent / Interact objects.
+        'batch' runs all trials of a session in lockstep (see Batch_Engine.py) when the
+        agent configuration is supported, otherwise falls back to 'serial'.
+        Every lockstep tick has a fixed array overhead: 'batch' is faster than 'serial' only for
+        sessions with many trials (see benchmark_engines.py).
+        'agent' always steps Agent / Interact objects (e.g. for debugging agent code).
+        Implicit binary mazes ('implicit': True) always run as 'agent'.
+    seed: experiment seed (int). Every trial draws from its own stream derived from
+        (seed, session, trial), see Random_Stream.py, so results are reproducible and do
+        not depend on the engine. None draws fresh entropy, which is saved in config.txt.
+    workers: number of processes that run the trials of a session (default 1). Trials are
+        sharded over a process pool and merged back in trial order, see parallelloop.
+    processes: None (default) runs sessions one after another. An integer runs all sessions
+        concurrently under this cap on processes (see concurrentloop): simulation shards
+        ('workers' per session) on one pool, session analysis / plotting on another (in the
+        main process when processes <= 2).
+    snapshots: Q value / novelty logging at the end of episodes (see Snapshot_Log.py)
+        {'stride': 1, 'mode': 'dense', 'memmap': False}
+        stride: snapshot every k episodes. mode: 'dense', 'delta' (changed entries only) or
+        'final' (last episode only). memmap: keep dense snapshots in .npy files in the
+        experiment folder instead of memory.
+    checkpoints: None (default) or {'trials': 1, 'episodes': None}. Sessions then run in chunks
+        of 'trials' trials, each saved under <experiment folder>/checkpoints/ when done (logs of
+        its trials, plus the final state of their learners: Agent objects (Q, novelty, model) when
+        trials step Agent objects, {'rng': RandomStream, 'tables': (Q rows, novelty)} under the
+        episode kernel and the batched engine, see EpisodeKernel.run_trial).
+        With the batched engine, a chunk in progress is also saved every 'episodes' episodes.
+        An Experiment with the same name and settings as an unfinished checkpointed one reuses
+        its folder (and seed), skips finished sessions and resumes after the last saved chunk
+        or episode. Not available with 'processes'.
 '''
 
 from Binary_Maze import *
 from Interact import *
 from Agent import *
 from Analysis import *
+from Batch_Engine import *
+from Episode_Kernel import *
+from Random_Stream import RandomStream, trial_seed_sequences
+import contextlib
+import multiprocessing
+import pickle
+
+
+maze_caches = {}  # maze properties -> Interact maze cache, shared by the sessions of this process
 
 
 class Experiment:
 
-    def __init__(self, name, environments, agents, nb_episodes, nb_trials):
+    # set on loop-only Experiment objects that run a checkpointed chunk of trials (run_checkpointed)
+    partial_path = None  # batched engine: file of the chunk in progress
+    trial_learners = None  # final learner state of the trials run (see run_checkpointed), if a list
+
+    def __init__(self, name, environments, agents, nb_episodes, nb_trials, engine = 'serial', seed = None,
+                 snapshots = None, workers = 1, processes = None, checkpoints = None):
         self.verbose = True
+        self.workers = workers
+        self.processes = processes
+        self.snapshots = {'stride': 1, 'mode': 'dense', 'memmap': False}
+        if snapshots is not None:
+            self.snapshots.update(snapshots)
+        self.checkpoints = None
+        if checkpoints is not None:
+            self.checkpoints = {'trials': 1, 'episodes': None}
+            self.checkpoints.update(checkpoints)
+            if processes is not None:
+                raise Exception('Checkpoints are not available with processes')
+        self.engine = engine
+        self.requested_seed = seed
+        self.seed = np.random.SeedSequence(seed).entropy
         self.name = name
         self.environments = environments
         self.agents = agents
         self.nb_episodes = nb_episodes
         self.nb_trials = nb_trials
         self.env_settings = {
-            'init_state': 0,
+            'init_state': 'start',
             'episode_termination': 'environment termination states'
         }
         self.exp_data = []
@@ -38,6 +97,8 @@ class Experiment:
         self.output_path = root_path
         if not os.path.exists(root_path):
             os.mkdir(root_path)
+        if self.checkpoints is not None and self.resume_output_path(root_path):
+            return
         # Make experiment folder if missing
         self.exp_output_path = root_path + str(self.name)
         if not os.path.exists(self.exp_output_path):
@@ -49,6 +110,40 @@ class Experiment:
             # make folder with append_idx
             self.exp_output_path += '_' + str(append_idx) + '/'
             os.mkdir(self.exp_output_path)
+        if self.checkpoints is not None:
+            os.mkdir(self.checkpoint_path())
+            save_checkpoint(self.checkpoint_path('experiment.pkl'),
+                            {'settings': self.checkpoint_settings(), 'seed': self.seed})
+
+    def checkpoint_settings(self):
+        '''settings an experiment must share with a checkpointed one to resume it'''
+        return repr([self.agents, self.environments, self.nb_episodes, self.nb_trials, self.engine,
+                     self.requested_seed, self.snapshots, self.checkpoints, self.env_settings])
+
+    def checkpoint_path(self, file = ''):
+        return self.exp_output_path + '/checkpoints/' + file
+
+    def resume_output_path(self, root_path):
+        '''
+        reuse the latest folder of this experiment name if it holds unfinished checkpoints of the
+        same settings. Restores the seed. Returns whether the experiment resumes.
+        '''
+        exp_output_path = root_path + str(self.name)
+        append_idx = 1
+        while os.path.exists(root_path + str(self.name) + '_' + str(append_idx)):
+            exp_output_path = root_path + str(self.name) + '_' + str(append_idx) + '/'
+            append_idx += 1
+        checkpoint_path = exp_output_path + '/checkpoints/'
+        if not os.path.exists(checkpoint_path + 'experiment.pkl') or os.path.exists(checkpoint_path + 'complete'):
+            return False
+        with open(checkpoint_path + 'experiment.pkl', 'rb') as file:
+            saved = pickle.load(file)
+        if saved['settings'] != self.checkpoint_settings():
+            return False
+        self.exp_output_path = exp_output_path
+        self.seed = saved['seed']
+        print('Resuming experiment from ' + exp_output_path)
+        return True
 
     def save_configs(self):
         filename = 'config.txt'
@@ -56,7 +151,13 @@ class Experiment:
             data.write('agents = ' + str(self.agents)+'\n\n')
             data.write('environments = ' + str(self.environments)+'\n\n')
             data.write('nb_episodes = ' + str(self.nb_episodes)+'\n\n')
-            data.write('nb_trials = ' + str(self.nb_trials))
+            data.write('nb_trials = ' + str(self.nb_trials)+'\n\n')
+            data.write('engine = ' + str(self.engine)+'\n\n')
+            data.write('seed = ' + str(self.seed)+'\n\n')
+            data.write('snapshots = ' + str(self.snapshots)+'\n\n')
+            data.write('workers = ' + str(self.workers)+'\n\n')
+            data.write('processes = ' + str(self.processes)+'\n\n')
+            data.write('checkpoints = ' + str(self.checkpoints))
 
     def run_experiment(self):
         print('Starting experiment..')
@@ -72,6 +173,8 @@ class Experiment:
         self.get_legend_labels()
         ## Cross session analysis
         self.plot_comparison_visuals()
+        if self.checkpoints is not None:
+            open(self.checkpoint_path('complete'), 'w').close()
 
     def get_legend_labels(self):
         self.exp_labels = []
@@ -193,9 +296,7 @@ class Experiment:
         self.exp_mode = 'multi-agent'
         env = self.environments[0]
         self.init_cross_session_data(len(self.agents))
-        for exp_id, agent_i in enumerate(self.agents):
-            self.init_session(env)
-            self.baseloop(agent_i, exp_id, verbose = self.verbose)
+        self.run_sessions([(agent_i, env) for agent_i in self.agents])
 
     def multi_environment(self):
         '''
@@ -205,9 +306,7 @@ class Experiment:
         self.exp_mode = 'multi-env'
         agent = self.agents[0]
         self.init_cross_session_data(len(self.environments))
-        for exp_id, env_i in enumerate(self.environments):
-            self.init_session(env_i)
-            self.baseloop(agent, exp_id, verbose = self.verbose)
+        self.run_sessions([(agent, env_i) for env_i in self.environments])
 
     def multi_agent_multi_environment(self):
         '''
@@ -216,62 +315,372 @@ class Experiment:
         self.exp_mode = 'multi-agent, multi-env'
         print('Mode: multiple agents, multiple environments')
         self.init_cross_session_data(len(self.agents))
-        for exp_id, (agent_i, env_i) in enumerate(zip(self.agents, self.environments)):
-            self.init_session(env_i)
-            self.baseloop(agent_i, exp_id, verbose = self.verbose)
+        self.run_sessions(list(zip(self.agents, self.environments)))
 
+    def run_sessions(self, sessions):
+        '''runs sessions [(agent spec, environment properties), ..], session exp_id at index exp_id'''
+        if self.processes is not None:
+            self.concurrentloop(sessions, verbose = self.verbose)
+            return
+        for exp_id, (agent_i, env_i) in enumerate(sessions):
+            if self.checkpoints is not None and os.path.exists(self.checkpoint_path(f'sess_{exp_id}_results.pkl')):
+                # finished and analyzed before the experiment was interrupted
+                with open(self.checkpoint_path(f'sess_{exp_id}_results.pkl'), 'rb') as file:
+                    self.store_session_results(exp_id, pickle.load(file))
+                continue
+            self.init_session(env_i, exp_id)
+            self.baseloop(agent_i, exp_id, verbose = self.verbose)
 
-    def init_session(self, env_i_properties):
+    def init_session(self, env_i_properties, exp_id = 0):
         '''
         Note new change: environment initialization has been moved to episode
         to accomodate reward shifting
         '''
-        self.Session_current = Interact(init_properties = self.env_settings, maze_properties = env_i_properties)
+        self.env_current = env_i_properties
+        maze_cache = maze_caches.setdefault(repr(env_i_properties), {})
+        self.Session_current = Interact(init_properties = self.env_settings, maze_properties = env_i_properties,
+                                        maze_cache = maze_cache)
+        # build maze for first episode upfront so agents can size their tables from it
+        self.Session_current.create_maze(0)
+        if self.snapshots['memmap']:
+            path = f"{self.exp_output_path}/sess_{exp_id}_"
+        else:
+            path = None
+        self.Session_current.init_snapshot_logs(self.nb_trials, self.nb_episodes, self.snapshots['stride'],
+                                                self.snapshots['mode'], path)
 
 
     def baseloop(self, agent_spec, exp_id, visualize_sessions = True, verbose = True):
         '''
         This function is the basis for running all RL interactions. Inherit from this class when needed.
         '''
-        for trial in range(self.nb_trials):
-            # Init fresh incarnation of agent
-            Agent_current = Agent(agent_spec)
+        if self.checkpoints is not None:
+            self.checkpointloop(agent_spec, exp_id, verbose = verbose)
+        elif self.workers > 1 and self.nb_trials > 1:
+            self.parallelloop(agent_spec, exp_id, verbose = verbose)
+        else:
+            self.run_trials(agent_spec, exp_id, range(self.nb_trials), verbose = verbose)
+        ## Session analysis
+        if visualize_sessions:
+            results = analyze_session(self.exp_output_path, exp_id, self.Session_current)
+            self.store_session_results(exp_id, results)
+            if self.checkpoints is not None:
+                save_checkpoint(self.checkpoint_path(f'sess_{exp_id}_results.pkl'), results)
+
+    def store_session_results(self, exp_id, results):
+        '''session data for cross-session analysis (see analyze_session)'''
+        cumulative_rewards, timesteps_trial, steps = results
+        self.all_cumulative_rewards[exp_id] = np.array(cumulative_rewards)
+        self.all_timeteps_perepisode[exp_id] = np.array(timesteps_trial)
+        self.timesteps_until_reward[exp_id] = np.array(steps)
+
+    def run_trials(self, agent_spec, exp_id, trials, verbose = True):
+        '''
+        Runs the given trials (indices, in order) of session exp_id with the engine of the
+        experiment. Each trial uses the random stream of its index, see Random_Stream.py.
+        '''
+        trials = list(trials)
+        seed_sequences = trial_seed_sequences(self.seed, exp_id, trials[-1] + 1)
+        seed_sequences = [seed_sequences[trial] for trial in trials]
+        # implicit mazes have no compiled tables: always step Agent / Interact objects
+        tabular = not self.Session_current.implicit
+        if self.engine == 'batch' and tabular and batch_supported(agent_spec, self.env_settings):
+            self.batchloop(agent_spec, exp_id, seed_sequences, verbose = verbose)
+        elif self.engine != 'agent' and tabular and kernel_supported(agent_spec, self.env_settings):
+            self.kernelloop(agent_spec, exp_id, seed_sequences, verbose = verbose)
+        else:
+            self.serialloop(agent_spec, exp_id, seed_sequences, verbose = verbose)
+
+    def parallelloop(self, agent_spec, exp_id, verbose = True):
+        '''
+        Shards the trials of a session over a pool of 'workers' processes. Every shard is a
+        contiguous range of trials run by run_shard in a fresh Interact object; the logs it
+        returns are appended to Session_current in trial order. Results are identical to
+        running all trials in this process.
+        Scripts that use workers > 1 must start the experiment under
+        if __name__ == '__main__': (worker processes may import the main module).
+        '''
+        shards = self.trial_shards(agent_spec, exp_id)
+        with multiprocessing.Pool(len(shards)) as pool:
+            for shard, result in zip(shards, pool.imap(run_shard, shards)):
+                merge_shard(self.Session_current, shard, result)
+                if verbose:
+                    print('| EXP: ' + str(exp_id + 1) +
+                          ' | Trials: ' + str(shard[-1][-1] + 1) + ' (' + str(len(shards)) + ' workers) |')
+
+    def trial_shards(self, agent_spec, exp_id):
+        '''run_shard arguments of the current session: 'workers' contiguous ranges of trials'''
+        nb_shards = max(min(self.workers, self.nb_trials), 1)
+        return [(self.shard_settings(), self.env_current, agent_spec, exp_id, trials.tolist())
+                for trials in np.array_split(np.arange(self.nb_trials), nb_shards)]
+
+    def shard_settings(self):
+        '''experiment settings used by run_session in worker processes'''
+        return {'engine': self.engine, 'seed': self.seed, 'nb_episodes': self.nb_episodes,
+                'env_settings': self.env_settings, 'snapshots': self.snapshots,
+                'checkpoints': self.checkpoints}
+
+    def checkpointloop(self, agent_spec, exp_id, verbose = True):
+        '''
+        Runs the trials of a session in chunks of checkpoints['trials'] trials (run_checkpointed,
+        on a pool of 'workers' processes if workers > 1). Every finished chunk is saved in the
+        checkpoints folder, and chunks already saved by an interrupted run are loaded instead of
+        run again. Chunks are appended to Session_current in trial order. Same results as
+        without checkpoints.
+        '''
+        folder = self.checkpoint_path(f'sess_{exp_id}/')
+        os.makedirs(folder, exist_ok = True)
+        chunk_size = self.checkpoints['trials']
+        chunks = [list(range(first, min(first + chunk_size, self.nb_trials)))
+                  for first in range(0, self.nb_trials, chunk_size)]
+        saved = [os.path.exists(folder + chunk_file(trials)) for trials in chunks]
+        jobs = [((self.shard_settings(), self.env_current, agent_spec, exp_id, trials), folder)
+                for trials, is_saved in zip(chunks, saved) if not is_saved]
+        pool = None
+        if self.workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+            results = pool.imap(run_checkpointed, jobs)
+        else:
+            results = map(run_checkpointed, jobs)
+        for trials, is_saved in zip(chunks, saved):
+            if is_saved:
+                with open(folder + chunk_file(trials), 'rb') as file:
+                    _, result, _ = pickle.load(file)
+            else:
+                result = next(results)
+            merge_shard(self.Session_current, (trials,), result)
+            if verbose:
+                print('| EXP: ' + str(exp_id + 1) + ' | Trials: ' + str(trials[-1] + 1) +
+                      (' (from checkpoint) |' if is_saved else ' (checkpointed) |'))
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def concurrentloop(self, sessions, verbose = True):
+        '''
+        Runs sessions [(agent spec, environment properties), ..] concurrently, with at most
+        'processes' worker processes: one process analyzes / plots finished sessions, the
+        others simulate. With processes <= 2 all workers simulate and finished sessions are
+        analyzed in the main process, between shard results. The trial shards of all sessions (trial_shards) share the simulation
+        pool, so session and trial level parallelism never exceed the cap. Shards are merged
+        in trial order once a session is complete, then its analysis is queued while other
+        sessions keep simulating. Cross-session data is filled by exp_id as analyses finish.
+        Results are identical to running sessions one after another.
+        '''
+        analysis_inline = self.processes <= 2
+        nb_simulation = self.processes if analysis_inline else self.processes - 1
+        shards, done = [], {}
+        for exp_id, (agent_i, env_i) in enumerate(sessions):
+            self.env_current = env_i
+            shards += self.trial_shards(agent_i, exp_id)
+            done[exp_id] = {}
+        nb_shards = {exp_id: sum(shard[3] == exp_id for shard in shards) for exp_id in done}
+        analyses = []
+        with contextlib.ExitStack() as pools:
+            simulation_pool = pools.enter_context(multiprocessing.Pool(nb_simulation))
+            if not analysis_inline:
+                analysis_pool = pools.enter_context(multiprocessing.Pool(1))
+            for index, result in simulation_pool.imap_unordered(run_indexed_shard, enumerate(shards)):
+                exp_id = shards[index][3]
+                done[exp_id][index] = result
+                if len(done[exp_id]) < nb_shards[exp_id]:
+                    continue
+                # the session's logs are only allocated here, once all its trials are in
+                self.init_session(shards[index][1], exp_id)
+                Session, results = self.Session_current, done.pop(exp_id)
+                for shard_index in sorted(results):
+                    merge_shard(Session, shards[shard_index], results[shard_index])
+                if verbose:
+                    print('| EXP: ' + str(exp_id + 1) + ' | Trials: ' + str(self.nb_trials) + ' (concurrent) |')
+                if analysis_inline:
+                    self.store_session_results(exp_id, analyze_session(self.exp_output_path, exp_id, Session))
+                    continue
+                analyses.append(analysis_pool.apply_async(
+                    analyze_session, (self.exp_output_path, exp_id, Session),
+                    callback = lambda results, exp_id = exp_id: self.store_session_results(exp_id, results)))
+            for analysis in analyses:
+                analysis.get()  # raises errors of the analysis process
+
+    def serialloop(self, agent_spec, exp_id, seed_sequences, verbose = True):
+        '''
+        Runs trials one after another, stepping one Agent and one Interact object.
+        '''
+        for trial in range(len(seed_sequences)):
             # Get session and environment objects
             Session_current = self.Session_current
+            # agent and environment of a trial share one random stream
+            Session_current.rng = RandomStream(seed_sequences[trial])
+            # Init fresh incarnation of agent
+            Agent_current = Agent(agent_spec, maze = Session_current.Maze, rng = Session_current.rng)
+            if self.trial_learners is not None:
+                self.trial_learners.append(Agent_current)
             # Start trial
-            for episode in range(self.nb_episodes):
-                # Start episode
-                obs = Session_current.init_episode(episode)
-                action = Agent_current.step(obs, can_terminate = False)
-                termination = False
-                while termination == False:  # assert termination condition = False
-                    obs = Session_current.step(action)
-                    action = Agent_current.step(obs)
-                    termination = obs[-1]
-                # update logs
-                Session_current.update_logs()
-                # if verbose:
-                #     print('| EXP: ' + str(exp_id+1) +
-                #           ' | Trial: ' + str(trial + 1) +
-                #           ' | Episode: ' + str(episode + 1) +
-                #           ' | Reward = ' + str(obs[-2]) + ' |')
-                # End of episode processing
-                Qvalues = Agent_current.Qfunction  # obtain q values for analysis
-                Session_current.add_value_to_record(Qvalues)
-                if agent_spec['add exploration bonus']:
-                    Session_current.add_novelty_to_record(Agent_current.exploration_bonus)
+            self.run_episodes(Agent_current, agent_spec, range(self.nb_episodes))
             # End of trial processing
             Session_current.process_trial()
             if (trial + 1) % 50 == 0:
                 if verbose:
                     print('| EXP: ' + str(exp_id + 1) +
                           ' | Trial: ' + str(trial + 1) + ' |')
-        ## Session analysis
-        if visualize_sessions:
-            Analyze = Analysis(self.exp_output_path, exp_id,
-                               Session_current.Maze, Session_current)
-            Analyze.visualize(dpi = 300)
-            ## Obtain session data for cross-session analysis
-            self.all_cumulative_rewards[exp_id] = np.array(Analyze.cumulative_rewards)
-            self.all_timeteps_perepisode[exp_id] = np.array(Analyze.all_timesteps_trial)
-            self.timesteps_until_reward[exp_id] = np.array(Analyze.steps)
+
+    def run_episodes(self, Agent_current, agent_spec, episodes):
+        '''
+        runs episodes (indices, in order) of the current trial with Agent_current, which keeps
+        its state between calls: a trial may be continued from any episode boundary.
+        '''
+        Session_current = self.Session_current
+        Session_current.create_maze(episodes[0])
+        for episode in episodes:
+            # Start episode
+            obs = Session_current.init_episode(episode)
+            action = Agent_current.step(obs, can_terminate = False)
+            termination = False
+            while termination == False:  # assert termination condition = False
+                obs = Session_current.step(action)
+                action = Agent_current.step(obs)
+                termination = obs[-1]
+            # if verbose:
+            #     print('| EXP: ' + str(exp_id+1) +
+            #           ' | Trial: ' + str(trial + 1) +
+            #           ' | Episode: ' + str(episode + 1) +
+            #           ' | Reward = ' + str(obs[-2]) + ' |')
+            # End of episode processing
+            Qvalues = Agent_current.Qfunction  # obtain q values for analysis
+            Session_current.add_value_to_record(Qvalues)
+            if agent_spec['add exploration bonus']:
+                Session_current.add_novelty_to_record(Agent_current.exploration_bonus)
+
+    def batchloop(self, agent_spec, exp_id, seed_sequences, verbose = True):
+        '''
+        Runs all trials in lockstep. Results land in the same Interact logs as serialloop.
+        '''
+        if self.partial_path is not None and os.path.exists(self.partial_path):
+            with open(self.partial_path, 'rb') as file:
+                Batch = pickle.load(file)
+            self.Session_current = Batch.Session  # holds the logs of the episodes already run
+        else:
+            Batch = BatchTrials(agent_spec, self.Session_current, len(seed_sequences), self.nb_episodes, seed_sequences)
+        if self.partial_path is not None and self.checkpoints['episodes']:
+            # run in chunks of episodes, saving the whole batch (agents, environments, logs) in between
+            while len(Batch.env.active) > 0:
+                until_episode = (Batch.env.episode.min() // self.checkpoints['episodes'] + 1) * self.checkpoints['episodes']
+                Batch.run(until_episode)
+                if len(Batch.env.active) > 0:
+                    save_checkpoint(self.partial_path, Batch)
+        else:
+            Batch.run()
+        if self.trial_learners is not None:
+            self.trial_learners += [Batch.learner(trial) for trial in range(Batch.nb_trials)]
+        if verbose:
+            print('| EXP: ' + str(exp_id + 1) +
+                  ' | Trials: ' + str(len(seed_sequences)) + ' (batched) |')
+
+    def kernelloop(self, agent_spec, exp_id, seed_sequences, verbose = True):
+        '''
+        Runs trials one after another in the fused episode kernel. Same results as serialloop.
+        '''
+        Kernel = EpisodeKernel(agent_spec, self.Session_current, self.nb_episodes)
+        for trial in range(len(seed_sequences)):
+            rng = RandomStream(seed_sequences[trial])
+            tables = Kernel.run_trial(rng)
+            Kernel.write_trial()
+            if self.trial_learners is not None:
+                self.trial_learners.append({'rng': rng, 'tables': tables})
+            if (trial + 1) % 50 == 0:
+                if verbose:
+                    print('| EXP: ' + str(exp_id + 1) +
+                          ' | Trial: ' + str(trial + 1) + ' |')
+
+
+def run_shard(shard):
+    '''
+    worker process entry of Experiment.parallelloop: runs some trials of one session in a
+    fresh Interact object. Returns its trajectory buffer and snapshot logs (trials numbered
+    from 0 in the shard).
+    '''
+    Session = run_session(*shard)
+    Session.trajectories.shrink()
+    return Session.trajectories, Session.value_log, Session.novelty_log
+
+
+def run_session(settings, env_properties, agent_spec, exp_id, trials):
+    '''
+    runs trials (indices) of session exp_id without experiment folder or analysis, in a fresh
+    Interact object that is returned. settings: engine, seed, nb_episodes, env_settings and
+    snapshots of the experiment (memory snapshots only).
+    '''
+    Runner = session_runner(settings, env_properties, exp_id, len(trials))
+    Runner.run_trials(agent_spec, exp_id, trials, verbose = False)
+    return Runner.Session_current
+
+
+def session_runner(settings, env_properties, exp_id, nb_trials):
+    '''Experiment object for loops only (no experiment folder / analysis), with session exp_id initialized'''
+    Runner = Experiment.__new__(Experiment)
+    Runner.__dict__.update(settings)
+    Runner.nb_trials = nb_trials
+    Runner.snapshots = dict(settings['snapshots'], memmap = False)
+    Runner.init_session(env_properties, exp_id)
+    return Runner
+
+
+def run_checkpointed(job):
+    '''
+    runs a chunk of trials (run_session arguments) for Experiment.checkpointloop and saves it as
+    folder/trials_<first>_<last>.pkl: trials, their logs (as run_shard) and the final state of
+    their learners, one per trial: Agent objects, or {'rng': RandomStream, 'tables': (Q rows,
+    novelty)} from the episode kernel / batched engine, which EpisodeKernel.run_trial continues.
+    With the batched engine the chunk in progress is saved to folder/partial_<first>.pkl every
+    checkpoints['episodes'] episodes and resumed from there.
+    '''
+    shard, folder = job
+    settings, env_properties, agent_spec, exp_id, trials = shard
+    Runner = session_runner(settings, env_properties, exp_id, len(trials))
+    Runner.partial_path = folder + f'partial_{trials[0]}.pkl'
+    Runner.trial_learners = []
+    Runner.run_trials(agent_spec, exp_id, trials, verbose = False)
+    Session = Runner.Session_current
+    Session.trajectories.shrink()
+    result = (Session.trajectories, Session.value_log, Session.novelty_log)
+    save_checkpoint(folder + chunk_file(trials),
+                    (trials, result, Runner.trial_learners))
+    if os.path.exists(Runner.partial_path):
+        os.remove(Runner.partial_path)
+    return result
+
+
+def chunk_file(trials):
+    return f'trials_{trials[0]}_{trials[-1]}.pkl'
+
+
+def save_checkpoint(path, data):
+    '''pickle data to path through a temporary file, so an interrupted write never leaves a partial checkpoint'''
+    with open(path + '.tmp', 'wb') as file:
+        pickle.dump(data, file, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def run_indexed_shard(indexed_shard):
+    '''run_shard for Experiment.concurrentloop: results come back with the shard index'''
+    index, shard = indexed_shard
+    return index, run_shard(shard)
+
+
+def merge_shard(Session, shard, result):
+    '''append the trials run by run_shard(shard) to the logs of Session (in trial order)'''
+    trajectories, value_log, novelty_log = result
+    first_trial = shard[-1][0]
+    Session.trajectories.extend(trajectories)
+    Session.value_log.merge(value_log, first_trial)
+    Session.novelty_log.merge(novelty_log, first_trial)
+
+
+def analyze_session(output_path, exp_id, Session):
+    '''
+    session analysis and plots (Analysis.visualize). Returns the session data for cross-session
+    analysis: cumulative rewards, timesteps per episode and steps until reward, per trial.
+    '''
+    Analyze = Analysis(output_path, exp_id, Session.Maze, Session)
+    Analyze.visualize(dpi = 300)
+    return Analyze.cumulative_rewards, Analyze.all_timesteps_trial, Analyze.steps
+
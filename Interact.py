@@ -1,6 +1,6 @@
 '''
 Interact Class - modified from original under Maze.py.
-This class works exclusively with Binary_Maze.py.
+This class works with Binary_Maze.py and Spatial_Maze.py.
 this class is used as intermediary between agent and environment.
 Basically, Interact feeds observations to the agent based on the environment,
 and receive actions from the agent, which it then processes to feed the next obs.
@@ -10,6 +10,7 @@ This class has a default set of properties that can be changed by feeding in the
 Properties:
     'init_state':
         random: random start state, even distribution over state space.
+        'start': start state of the maze (state 0 of binary mazes, start position of spatial mazes).
         state: non random, always start from same spot.
 
     'episode_termination':
@@ -19,21 +20,41 @@ Properties:
 
     max_steps (if set above):
         nb_steps: integer
+
+Binary maze properties may set 'implicit': True to use ImplicitBinaryMaze (no transition /
+reward tables, see Binary_Maze.py) for very deep trees. Implicit mazes are stepped
+arithmetically, log Q values / novelty in 'sparse' snapshot mode and are not compiled
+for the episode kernel / batched engine.
+'branching': k for k-ary trees (binary mazes, default 2).
+'generator': spatial mazes generated by Maze_Generator.generate(spec) instead of drawn in 'map'.
+'maze store': folder of a Maze_Store.MazeStore. Maze structure arrays are then compiled once
+into that folder and memory-mapped by every session / process that uses the same maze.
 '''
 import numpy as np
 from copy import deepcopy
-from Binary_Maze import BinaryMaze
+import bisect
+from Trajectory_Buffer import TrajectoryBuffer
+from Snapshot_Log import SnapshotLog
+from Binary_Maze import BinaryMaze, ImplicitBinaryMaze
 from Spatial_Maze import SpatialMaze
+from Random_Stream import RandomStream
+from Maze_Store import get_store
+from Maze_Generator import generate
 import pdb
 
 
 class Interact:
 
-    def __init__(self, init_properties, maze_properties):
+    def __init__(self, init_properties, maze_properties, rng = None, maze_cache = None):
         '''
         NOTE: agent should not have access to any variables in this section.
         These variables are for tracking progress for evaluation / debug purposes.
+        rng: RandomStream for random start states. Experiment replaces it with the
+        stream of the current trial, which the agent of that trial shares.
+        maze_cache: optional dictionary shared by sessions with the same maze properties,
+        so mazes are built once (see maze_of_config). Mazes are never modified once built.
         '''
+        self.rng = rng if rng is not None else RandomStream()
         self.maze_properties = maze_properties
         if self.maze_properties['maze type'] in ['binary', 'Binary']:
             self.maze_type = 'binary'
@@ -41,7 +62,11 @@ class Interact:
             self.maze_type = 'spatial'
         else:
             raise Exception('Error: maze type not found')
+        self.implicit = self.maze_type == 'binary' and self.maze_properties.get('implicit', False)
         self.properties = init_properties
+        self.compile_reward_schedule()
+        if maze_cache is not None:
+            self.maze_cache = maze_cache
         self.init_log_data()
         self.termination_condition = init_properties['episode_termination']
         self.episode_nb = 0
@@ -50,34 +75,57 @@ class Interact:
 
     def init_log_data(self):
         ## instantiate history variables for evaluation / debugging
-        self.state_act_history = []  # record of agent's state and picked actions
-        self.state_obs_history = []  # record agent's observed state history (action spaces in current case)
-        self.state_act_history_episodes = []
-        self.state_obs_history_episodes = []
-        self.state_act_history_trials = []
-        self.state_obs_history_trials = []
-        self.agent_qvalues_history_episodes = []
-        self.agent_qvalues_history_trials = []
-        self.agent_novelty_history_episodes = []
-        self.agent_novelty_history_trials = []
+        # transitions and observations of all trials, see Trajectory_Buffer.py
+        self.trajectories = TrajectoryBuffer()
+        # Q function / novelty snapshots (Snapshot_Log.py), see init_snapshot_logs
+        self.value_log = None
+        self.novelty_log = None
+
+    def init_snapshot_logs(self, nb_trials, nb_episodes, stride = 1, mode = 'dense', path = None):
+        '''
+        allocate snapshot logs for Q values and novelty. Call after the first maze is built.
+        path: optional prefix for on-disk logs (path + 'values.npy', path + 'novelty.npy').
+        '''
+        nb_states, nb_actions = self.Maze.nb_states, self.Maze.action_space
+        if self.implicit:  # dense snapshots would not fit
+            if mode == 'final':
+                stride = nb_episodes
+            mode, path = 'sparse', None
+        self.value_log = SnapshotLog(nb_trials, nb_episodes, nb_states, nb_actions, stride, mode,
+                                     path + 'values.npy' if path is not None else None)
+        # novelty tables may hold reversal actions 0-3 outside the action space (Agent.init_novelty)
+        self.novelty_log = SnapshotLog(nb_trials, nb_episodes, nb_states, max(nb_actions, 4), stride, mode,
+                                       path + 'novelty.npy' if path is not None else None)
+
+    def current_trial_episode(self):
+        '''trial and episode index of the episode being run (per-step loop)'''
+        trajectories = self.trajectories
+        return trajectories.nb_trials, trajectories.nb_episodes - trajectories.trial_offsets[-1] - 1
 
     def init_episode(self, episode):
         self.episode_nb += 1
         self.reset_environment(episode)
         if self.properties['init_state'] == 'random':
-            self.init_state = np.random.randint(self.Maze.nb_states)
+            self.init_state = self.rng.integers(self.Maze.nb_states)
         else: # specific state
-            self.init_state = self.properties['init_state']
+            self.init_state = self.fixed_init_state()
         self.current_state = self.init_state
         reward = self.check_reward()
         term = self.check_termination()
+        self.trajectories.start_episode(self.current_state, reward, term)
         output = self.return_observation(reward, term)
         return output
 
+    def fixed_init_state(self):
+        '''start state of every episode when init_state is not random'''
+        if self.properties['init_state'] == 'start':
+            return self.Maze.start_state
+        return self.properties['init_state']
+
     def reset_environment(self, episode):
         '''
         this is called at the beginning of EACH episode.
-        1. clear history 2. reset environment
+        reset environment
         steps for the first episode, regardless of the actual events
         New: episode being passed in here in order to accommodate
         changing of reward location within a trial.
@@ -85,46 +133,138 @@ class Interact:
         if self.episode_nb > 0: # only apply AFTER first episode
             # self.Maze = deepcopy(self.Maze_original)
             self.create_maze(episode)
-            self.state_act_history, self.state_obs_history = [], []
+
+    def compile_reward_schedule(self):
+        '''
+        reward locations per episode, compiled once: reward_schedule holds the sorted episodes
+        at which the reward location changes, reward_configs the reward location from each
+        change on. Episodes before the first change use the first configuration.
+        '''
+        reward_location = self.maze_properties['reward locations']
+        if self.maze_properties['change reward location']:
+            self.reward_schedule = sorted(reward_location.keys())
+            self.reward_configs = [reward_location[ep_change] for ep_change in self.reward_schedule]
+        else:
+            self.reward_schedule = [0]
+            self.reward_configs = [reward_location]
+        self.maze_cache = {}  # reward config index -> maze
+
+    def reward_config_of(self, episode):
+        return max(bisect.bisect_right(self.reward_schedule, episode) - 1, 0)
 
     def create_maze(self, episode):
+        '''
+        set the maze of this episode. Mazes are built once per reward configuration and cached;
+        configurations after the first share the structure (transition matrix..) of the first maze built.
+        '''
+        self.Maze = self.maze_of_config(self.reward_config_of(episode))
+        self.action_space = np.arange(self.Maze.action_space)  # Based on environment
+
+    def maze_of_config(self, config):
+        '''maze of a reward configuration (index into reward_configs), built on first use'''
+        if config not in self.maze_cache:
+            self.maze_cache[config] = self.build_maze(self.reward_configs[config])
+        return self.maze_cache[config]
+
+    def maze_store(self):
+        '''MazeStore of the 'maze store' folder in the maze properties (opt-in), else None'''
+        if self.maze_properties.get('maze store'):
+            return get_store(self.maze_properties['maze store'])
+        return None
+
+    def build_maze(self, reward_location):
         mazeName = self.maze_properties['maze name']
-        reward_location = self.maze_properties['reward locations']
+        if len(self.maze_cache) > 0:  # same structure, only rewards differ
+            return next(iter(self.maze_cache.values())).with_rewards(reward_location)
         if self.maze_type == 'binary':
             nb_levels = self.maze_properties['number of levels']
             allow_reversals = self.maze_properties['allow reversals']
-            if self.maze_properties['change reward location']:
-                change_episodes = list(reward_location.keys())
-                change_episodes.reverse()
-                for ep_change in change_episodes:
-                    if episode >= ep_change:
-                        reward_location = reward_location[ep_change]
-                        break
-            self.Maze = BinaryMaze(mazeName, nb_levels=nb_levels, reward_location=reward_location,
-                                   allow_reversals=allow_reversals)
+            if self.implicit:
+                if self.maze_properties.get('branching', 2) != 2:
+                    raise Exception('Implicit mazes are binary trees')
+                return ImplicitBinaryMaze(mazeName, nb_levels = nb_levels, reward_location = reward_location,
+                                          allow_reversals = allow_reversals)
+            return BinaryMaze(mazeName, nb_levels=nb_levels, reward_location=reward_location,
+                              allow_reversals=allow_reversals, store=self.maze_store(),
+                              branching=self.maze_properties.get('branching', 2))
         elif self.maze_type == 'spatial':
-            # todo: think about how to implment reward changes for spatial mazes
-            # as currently it's implemented within Maze, not outside of it
-            self.Maze = SpatialMaze(mazeName,
-                                    self.maze_properties['map'],
-                                    reward_location,
-                                    self.maze_properties['start position'])
-        self.action_space = np.arange(self.Maze.action_space)  # Based on environment
+            if 'generator' in self.maze_properties:  # procedural maze, see Maze_Generator.py
+                return SpatialMaze(mazeName, None, reward_location, self.maze_properties['start position'],
+                                   structure = generate(self.maze_properties['generator'], self.maze_store()))
+            return SpatialMaze(mazeName,
+                               self.maze_properties['map'],
+                               reward_location,
+                               self.maze_properties['start position'],
+                               store = self.maze_store())
+
+    def termination_mask(self):
+        '''boolean termination flag per state of the current maze'''
+        if hasattr(self.Maze, 'termination_mask'):
+            return self.Maze.termination_mask
+        terminal = np.zeros(self.Maze.nb_states, dtype = bool)
+        terminal[np.asarray(self.Maze.termination_states, dtype = int)] = True
+        return terminal
+
+    def compile_environment(self, nb_episodes):
+        '''
+        arrays for engines that step the environment themselves (Batch_Engine, Episode_Kernel).
+        Not available for implicit mazes.
+        Returns state_trans_matrix (states, actions) int32, rewards (configs, states),
+        terminals (configs, states) bool and episode_config (episodes,): config index per episode.
+        Leaves Interact with the maze of the last episode, as the per-step loop does.
+        '''
+        if self.implicit:
+            raise Exception('Implicit mazes have no tables to compile')
+        rewards, terminals = [], []
+        for config in range(len(self.reward_configs)):
+            self.create_maze(self.reward_schedule[config])
+            rewards.append(np.asarray(self.Maze.state_reward_matrix, dtype = float))
+            terminals.append(self.termination_mask())
+        episode_config = np.array([self.reward_config_of(episode) for episode in range(nb_episodes)])
+        state_trans_matrix = np.asarray(self.Maze.state_trans_matrix, dtype = np.int32)
+        self.create_maze(nb_episodes - 1)
+        self.reward_table, self.terminal_table = np.array(rewards), np.array(terminals)
+        self.episode_config = episode_config
+        return state_trans_matrix, self.reward_table, self.terminal_table, episode_config
+
+    def record_trial(self, obs_states, actions, obs_offsets, first_episode = 0):
+        '''
+        store a whole trial run outside of step (batched engine, episode kernel), after
+        compile_environment. Observations of episode e are obs_states[obs_offsets[e]:obs_offsets[e + 1]],
+        actions[t] is the action taken at observation t. Value snapshots are recorded by the engine.
+        first_episode: episode index of the first episode (trials continued from an episode boundary).
+        '''
+        episode = first_episode + np.repeat(np.arange(len(obs_offsets) - 1), np.diff(obs_offsets))
+        config = self.episode_config[episode]
+        self.trajectories.add_trial(obs_states, actions, self.reward_table[config, obs_states],
+                                    self.terminal_table[config, obs_states], obs_offsets)
+        self.process_trial()
 
-    def update_logs(self):
-        self.state_act_history_episodes.append(self.state_act_history)
-        self.state_obs_history_episodes.append(self.state_obs_history)
+    @property
+    def state_act_history_trials(self):
+        '''nested lists [trial][episode][t] = [s, a, s'], rebuilt from the trajectory buffer'''
+        return self.trajectories.state_act_history()
+
+    @property
+    def state_obs_history_trials(self):
+        '''nested lists [trial][episode][t] = [action space, s, r, done], rebuilt from the trajectory buffer'''
+        return self.trajectories.state_obs_history(self.action_space)
 
     def step(self, action, verbose = False):
         # get new state from environment class
-        new_state = int(self.Maze.state_trans_matrix[self.current_state, action])
+        if self.implicit:
+            new_state = self.Maze.next_state(self.current_state, action)
+        else:
+            # item() reads the int32 table straight into a python int
+            new_state = self.Maze.state_trans_matrix.item(self.current_state, action)
         if verbose:
             print(f"| Action: {action} | New State: {new_state}")
-        # save to history
-        self.state_act_history.append([self.current_state, action, new_state])
+        prev_state = self.current_state
         self.current_state = new_state # set new state to current state
         reward = self.check_reward()
         termination = self.check_termination()
+        # save to history
+        self.trajectories.add(prev_state, action, new_state, reward, termination)
         output = self.return_observation(reward, termination)
         return output
 
@@ -132,39 +272,40 @@ class Interact:
         '''
         THIS FUNCTION DECIDES WHAT OBSERVATION TO GIVE TO AGENT
         Since we are assuming full MDP, the agent is fed perfect information (e.g. state = 1)
-        Note: state_obs_history is a history of what the agent observes.
+        Note: the trajectory buffer records what the agent observes.
         If the agent observe the underlying MDP, then it's the same as the environment
-        MDP history, state_act_history.
+        MDP history.
         '''
         combined_output_to_agent = [self.action_space, self.current_state, reward, termination]
-        self.state_obs_history.append(combined_output_to_agent)
         return combined_output_to_agent
 
     def process_trial(self):
         # Call this after the end of a trial before reinitializing agent to naive state.
         # populates trial data into one
-        if len(self.state_obs_history_episodes) > 0:
-            self.state_obs_history_trials.append(self.state_obs_history_episodes)
-            self.state_act_history_trials.append(self.state_act_history_episodes)
-            # reset episode history memory
-            self.state_obs_history_episodes = []
-            self.state_act_history_episodes = []
-        if len(self.agent_qvalues_history_episodes) > 0:
-            self.agent_qvalues_history_trials.append(self.agent_qvalues_history_episodes)
-            self.agent_qvalues_history_episodes = []
-        if len(self.agent_novelty_history_episodes) > 0:
-            self.agent_novelty_history_trials.append(self.agent_novelty_history_episodes)
-            self.agent_novelty_history_episodes = []
+        if self.trajectories.nb_episodes > self.trajectories.trial_offsets[-1]:
+            self.trajectories.end_trial()
 
     def add_value_to_record(self, Qvalues):
-        self.agent_qvalues_history_episodes.append(Qvalues.copy())
-        # use .copy because of pointer issue with python dictionaries
+        # call at the end of an episode, before process_trial
+        trial, episode = self.current_trial_episode()
+        self.value_log.record(trial, episode, Qvalues)
 
     def add_novelty_to_record(self, novelty):
-        self.agent_novelty_history_episodes.append(novelty.copy())
-        # use .copy because of pointer issue with python dictionaries
+        trial, episode = self.current_trial_episode()
+        self.novelty_log.record(trial, episode, novelty)
+
+    @property
+    def agent_qvalues_history_trials(self):
+        '''[trial][snapshot] = {(state, action): value}, rebuilt from the snapshot log'''
+        return [self.value_log.trial_dicts(trial) for trial in np.flatnonzero(self.value_log.recorded)]
+
+    @property
+    def agent_novelty_history_trials(self):
+        return [self.novelty_log.trial_dicts(trial) for trial in np.flatnonzero(self.novelty_log.recorded)]
 
     def check_reward(self):
+        if self.implicit:
+            return self.Maze.reward(self.current_state)
         reward = self.Maze.state_reward_matrix[self.current_state]
 
 
@@ -183,6 +324,10 @@ class Interact:
             else:
                 return False
         elif self.termination_condition == 'environment termination states':
+            if self.implicit:
+                return self.Maze.is_terminal(self.current_state)
+            if hasattr(self.Maze, 'termination_mask'):
+                return bool(self.Maze.termination_mask[self.current_state])
             if self.current_state in self.Maze.termination_states:
                 return True
             else:
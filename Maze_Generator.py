@@ -0,0 +1,179 @@
+'''
+Procedural mazes for scaling benchmarks, from ~10^2 to ~10^7 states.
+
+generate(spec, store = None) compiles the maze described by spec, a dictionary:
+    'generator': 'tree'
+        k-ary tree: 'levels', 'branching' (default 2), 'allow reversals' (default True).
+        Same arrays as BinaryMaze (which compiles them in closed form).
+    'generator': 'grid'
+        random spatial grid maze: 'rows', 'cols', 'loop density' (default 0), 'seed' (default 0).
+        A random spanning tree of the grid (one path between any two states), then a fraction
+        'loop density' of the remaining walls is opened, which creates loops.
+    'generator': 'labyrinth'
+        MazeV4-style labyrinth: 'tile rows' x 'tile cols' copies of a hand-drawn map 'tile'
+        (default LABYRINTH_TILE, the MazeV4 map), 'seed' (default 0). Neighbouring copies are
+        joined by one corridor, at a random row / column of their shared border.
+Spatial generators return the structure arrays of Spatial_Maze.parse_map (positions,
+transition matrix, CSR adjacency); labyrinth states are numbered tile by tile.
+
+Everything is drawn from numpy Generators seeded with 'seed', so a spec always gives the
+same maze. Compiled arrays are cached on disk in a Maze_Store.MazeStore (by default under
+data/maps/store/) and memory-mapped on later loads.
+
+Usage with Interact / Experiment:
+    trees: binary maze properties with 'branching': k
+    grids, labyrinths: spatial maze properties with 'generator': spec instead of 'map'
+Note: agents with exploration bonus map reversal actions with Agent.init_novelty, which
+covers 4 actions (k-ary trees: branching <= 3 with reversals).
+'''
+import numpy as np
+from Binary_Maze import BinaryMaze
+from Spatial_Maze import parse_map, compile_structure
+from Maze_Store import get_store
+
+
+default_store = 'data/maps/store/'
+
+LABYRINTH_TILE = [
+    'o-o-o   o-o-o   o-o-o   o-o-o',
+    '  |       |       |       |  ',
+    '  o-o-o-o-o       o-o-o-o-o  ',
+    '  |   |   |       |   |   |  ',
+    'o-o-o o o-o-o   o-o-o o o-o-o',
+    '      |               |      ',
+    '      o-o-o-o-o-o-o-o-o      ',
+    '      |       |       |      ',
+    'o-o-o o o-o-o o o-o-o o o-o-o',
+    '  |   |   |   |   |   |   |  ',
+    '  o-o-o-o-o   o   o-o-o-o-o  ',
+    '  |       |   |   |       |  ',
+    'o-o-o   o-o-o o o-o-o   o-o-o',
+    '              |              ',
+    'o-o-o-o-o-o-o-o              ',
+    '              |              ',
+    'o-o-o   o-o-o o o-o-o   o-o-o',
+    '  |       |   |   |       |  ',
+    '  o-o-o-o-o   o   o-o-o-o-o  ',
+    '  |   |   |   |   |   |   |  ',
+    'o-o-o o o-o-o o o-o-o o o-o-o',
+    '      |       |       |      ',
+    '      o-o-o-o-o-o-o-o-o      ',
+    '      |               |      ',
+    'o-o-o o o-o-o   o-o-o o o-o-o',
+    '  |   |   |       |   |   |  ',
+    '  o-o-o-o-o       o-o-o-o-o  ',
+    '  |       |       |       |  ',
+    'o-o-o   o-o-o   o-o-o   o-o-o']
+
+
+def generate(spec, store = None):
+    '''structure arrays {name: array} of the maze described by spec (see above)'''
+    if store is None:
+        store = get_store(default_store)
+    generator = spec['generator']
+    if generator == 'tree':
+        maze = BinaryMaze('tree', spec['levels'], {}, spec.get('allow reversals', True), store = store,
+                          branching = spec.get('branching', 2))
+        return {name: getattr(maze, name) for name in BinaryMaze.structure_arrays}
+    elif generator == 'grid':
+        return store.load(spec, lambda: grid_maze(spec['rows'], spec['cols'], spec.get('loop density', 0.),
+                                                  spec.get('seed', 0)))
+    elif generator == 'labyrinth':
+        return store.load(spec, lambda: tiled_labyrinth(spec.get('tile', LABYRINTH_TILE), spec['tile rows'],
+                                                        spec['tile cols'], spec.get('seed', 0)))
+    raise Exception('Unknown maze generator: ' + str(generator))
+
+
+def spanning_tree(nb_states, src, dst):
+    '''
+    minimum spanning forest of the edges (src, dst), whose weights are their indices.
+    Boruvka rounds: every component joins along its lightest outgoing edge, components are
+    relabelled by pointer jumping and edges inside a component are dropped. Returns a
+    boolean mask over edges.
+    '''
+    in_tree = np.zeros(len(src), dtype = bool)
+    labels = np.arange(nb_states)
+    edges = np.arange(len(src))
+    while True:
+        src_labels, dst_labels = labels[src[edges]], labels[dst[edges]]
+        crossing = src_labels != dst_labels
+        edges, src_labels, dst_labels = edges[crossing], src_labels[crossing], dst_labels[crossing]
+        if len(edges) == 0:
+            return in_tree
+        # lightest edge leaving each component
+        lightest = np.full(nb_states, len(src))
+        np.minimum.at(lightest, src_labels, edges)
+        np.minimum.at(lightest, dst_labels, edges)
+        picked = lightest[lightest < len(src)]
+        in_tree[picked] = True
+        # merge components joined by picked edges: hook onto the smaller label, then jump
+        heads, tails = labels[src[picked]], labels[dst[picked]]
+        parent = np.arange(nb_states)
+        while True:
+            head_roots, tail_roots = parent[heads], parent[tails]
+            if np.array_equal(head_roots, tail_roots):
+                break
+            smaller = np.minimum(head_roots, tail_roots)
+            np.minimum.at(parent, head_roots, smaller)
+            np.minimum.at(parent, tail_roots, smaller)
+            while True:
+                jumped = parent[parent]
+                if np.array_equal(jumped, parent):
+                    break
+                parent = jumped
+        labels = parent[labels]
+
+
+def grid_maze(nb_rows, nb_cols, loop_density = 0., seed = 0):
+    '''structure arrays of a random nb_rows x nb_cols grid maze (see generate)'''
+    rng = np.random.default_rng(seed)
+    nb_states = nb_rows * nb_cols
+    states = np.arange(nb_states, dtype = np.int32).reshape(nb_rows, nb_cols)
+    # candidate connections: left-right, then up-down, in random order (index = weight)
+    src = np.concatenate([states[:, :-1].ravel(), states[:-1].ravel()])
+    dst = np.concatenate([states[:, 1:].ravel(), states[1:].ravel()])
+    horizontal = np.arange(len(src)) < nb_rows * (nb_cols - 1)
+    order = rng.permutation(len(src))
+    src, dst, horizontal = src[order], dst[order], horizontal[order]
+    is_open = spanning_tree(nb_states, src, dst)
+    is_open |= rng.random(len(src)) < loop_density
+    positions = np.stack(np.divmod(np.arange(nb_states, dtype = np.int32), nb_cols), axis = 1)
+    state_trans_matrix = np.repeat(np.arange(nb_states, dtype = np.int32)[:, None], 4, axis = 1)
+    link_states(state_trans_matrix, src[is_open & horizontal], dst[is_open & horizontal], 3)
+    link_states(state_trans_matrix, src[is_open & ~horizontal], dst[is_open & ~horizontal], 1)
+    return compile_structure(positions, state_trans_matrix)
+
+
+def tiled_labyrinth(tile, nb_tile_rows, nb_tile_cols, seed = 0):
+    '''structure arrays of nb_tile_rows x nb_tile_cols copies of an ASCII map tile (see generate)'''
+    rng = np.random.default_rng(seed)
+    base = parse_map(tile)
+    tile_positions, tile_trans = base['position_of_state'], base['state_trans_matrix']
+    tile_shape = np.max(tile_positions, axis = 0) + 1
+    tile_states = len(tile_positions)
+    tile_grid = np.full(tile_shape, -1, dtype = np.int64)
+    tile_grid[tile_positions[:, 0], tile_positions[:, 1]] = np.arange(tile_states)
+    tiles = np.arange(nb_tile_rows * nb_tile_cols).reshape(nb_tile_rows, nb_tile_cols)
+    tile_rows, tile_cols = np.divmod(np.arange(tiles.size), nb_tile_cols)
+    # state of tile t, local state s: t * tile_states + s
+    offsets = np.arange(tiles.size, dtype = np.int64)[:, None] * tile_states
+    if offsets[-1, 0] + tile_states > np.iinfo(np.int32).max:
+        raise Exception('Labyrinth too large for int32 states')
+    positions = (tile_positions[None] + (np.stack([tile_rows, tile_cols], axis = 1) * tile_shape)[:, None]).reshape(-1, 2)
+    state_trans_matrix = (tile_trans[None] + offsets[:, :, None]).reshape(-1, 4)
+    # corridors between neighbouring tiles, at border rows / columns with states on both sides
+    for action, left, right, border in [(3, tiles[:, :-1], tiles[:, 1:], tile_grid[:, [-1, 0]]),
+                                        (1, tiles[:-1], tiles[1:], tile_grid[[-1, 0]].T)]:
+        doors = np.flatnonzero((border[:, 0] >= 0) & (border[:, 1] >= 0))
+        if len(doors) == 0:
+            raise Exception('Tile has no states facing each other across its borders')
+        door = doors[rng.integers(len(doors), size = left.size)]
+        link_states(state_trans_matrix, left.ravel() * tile_states + border[door, 0],
+                    right.ravel() * tile_states + border[door, 1], action)
+    return compile_structure(positions.astype(np.int32), state_trans_matrix.astype(np.int32))
+
+
+def link_states(state_trans_matrix, src, dst, action):
+    '''connect src to dst with action (3 right or 1 down) and dst to src with the opposite action'''
+    state_trans_matrix[src, action] = dst
+    state_trans_matrix[dst, action - 1] = src
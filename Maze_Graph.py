@@ -0,0 +1,92 @@
+'''
+Graph helpers shared by the table based mazes (BinaryMaze, SpatialMaze).
+
+Mazes are graphs given by their transition table: state s moves to
+state_trans_matrix[s, a]. Moves that leave the state unchanged (blocked moves in
+spatial mazes) are not edges. Sparse graphs are kept in CSR form: the entries of
+row r are indices[indptr[r]:indptr[r + 1]].
+
+MazeGraph: neighbour and distance tables of a maze, only using its nb_states,
+state_trans_matrix, state_reward_matrix and distance_cache attributes.
+'''
+import numpy as np
+
+
+def transition_edges(state_trans_matrix):
+    '''(source, destination) states of the transitions between distinct states, in action order'''
+    src = np.repeat(np.arange(len(state_trans_matrix), dtype = state_trans_matrix.dtype), state_trans_matrix.shape[1])
+    dst = state_trans_matrix.ravel()
+    moves = src != dst
+    return src[moves], dst[moves]
+
+
+def csr(rows, columns, nb_rows):
+    '''CSR form (indptr, indices) of (row, column) pairs, keeping the order of each row's columns'''
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength = nb_rows))])
+    return indptr, columns[np.argsort(rows, kind = 'stable')]
+
+
+def csr_gather(indptr, indices, rows):
+    '''entries of the given rows, concatenated, and the number of entries of each row'''
+    degree = indptr[rows + 1] - indptr[rows]
+    offsets = np.arange(degree.sum()) - np.repeat(np.cumsum(degree) - degree, degree)
+    return indices[np.repeat(indptr[rows], degree) + offsets], degree
+
+
+class MazeGraph:
+
+    def compute_neighbour_table(self, radius = 1):
+        '''
+        States within 'radius' moves of each state (ignoring move direction), excluding the state itself.
+        Returned in CSR form: neighbours of state s are indices[indptr[s]:indptr[s + 1]].
+        Built by vectorized frontier expansion over the transition table.
+        '''
+        nb_states = self.nb_states
+        src, dst = transition_edges(np.asarray(self.state_trans_matrix, dtype = np.int64))
+        edges = np.unique(np.concatenate([src * nb_states + dst, dst * nb_states + src]))
+        adj_indptr, adj_states = csr(edges // nb_states, edges % nb_states, nb_states)
+        # expand (origin, state) pairs one move at a time
+        frontier = np.arange(nb_states) * nb_states + np.arange(nb_states)
+        reached = frontier
+        for _ in range(radius):
+            origin, state = frontier // nb_states, frontier % nb_states
+            next_states, degree = csr_gather(adj_indptr, adj_states, state)
+            frontier = np.unique(np.repeat(origin, degree) * nb_states + next_states)
+            frontier = frontier[~np.isin(frontier, reached)]
+            reached = np.union1d(reached, frontier)
+        origin, state = reached // nb_states, reached % nb_states
+        keep = origin != state
+        return csr(origin[keep], state[keep], nb_states)
+
+    def distance_table(self, targets = None):
+        '''
+        number of moves from every state to the nearest state in targets (default: rewarded
+        states), following the transition table (so reversals are only used if allowed).
+        -1 for states that cannot reach a target. Episode termination along the way is ignored.
+        Multi-source BFS backwards from targets, one vectorized frontier per distance.
+        Tables are cached per target set, and shared with copies made by with_rewards.
+        '''
+        if targets is None:
+            targets = np.flatnonzero(self.state_reward_matrix != 0)
+        targets = np.unique(np.asarray(targets, dtype = np.int64))
+        key = tuple(targets.tolist())
+        if key not in self.distance_cache:
+            self.distance_cache[key] = self.compute_distance_table(targets)
+        return self.distance_cache[key]
+
+    def compute_distance_table(self, targets):
+        # predecessors of s (states with a transition into s) in CSR form
+        src, dst = transition_edges(self.state_trans_matrix)
+        indptr, predecessors = csr(dst, src, self.nb_states)
+        distances = np.full(self.nb_states, -1, dtype = np.int32)
+        frontier, distance = targets, 0
+        while len(frontier) > 0:
+            distances[frontier] = distance
+            candidates, _ = csr_gather(indptr, predecessors, frontier)
+            frontier = np.unique(candidates[distances[candidates] < 0])
+            distance += 1
+        return distances
+
+    def distance_to_rewards(self, states):
+        '''shortest number of moves from each of states to a rewarded state (-1: unreachable)'''
+        return self.distance_table()[states]
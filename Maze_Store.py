@@ -0,0 +1,71 @@
+'''
+Content-addressed store for compiled maze structure.
+
+Mazes are identified by their structural parameters only (e.g. number of levels and
+reversals for binary mazes, map text for spatial mazes; not rewards). The parameters are
+hashed into a key, and the structure arrays (transition matrix, level tables..) are saved
+once as uncompressed .npy files under root/<key>/:
+    root/<key>/params.txt          parameters the key was computed from
+    root/<key>/<array name>.npy    one file per array
+and loaded back with mmap_mode = 'r'. Processes that load the same maze share its pages
+through the OS page cache instead of rebuilding and holding their own copy.
+
+Arrays are written to a temporary folder that is then renamed, so concurrent processes
+compiling the same maze never read partial files. Loaded arrays are read-only.
+
+Usage (opt-in): maze properties {'maze store': 'data/maps/store/', ..}, see Interact.py.
+'''
+import numpy as np
+import hashlib
+import os, shutil
+
+
+stores = {}  # root -> MazeStore, one per process
+
+
+def get_store(root):
+    '''shared MazeStore of a root folder (keeps loaded mazes across sessions)'''
+    if root not in stores:
+        stores[root] = MazeStore(root)
+    return stores[root]
+
+
+class MazeStore:
+
+    def __init__(self, root = 'data/maps/store/'):
+        self.root = root
+        self.loaded = {}  # key -> {name: memmap array}
+
+    def key(self, params):
+        '''hash of the structural parameters (dictionary)'''
+        text = repr(sorted(params.items()))
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def load(self, params, compile_arrays):
+        '''
+        structure arrays of the maze with these parameters, as read-only memmaps.
+        compile_arrays: function returning {name: array}, only called if the maze is not stored yet.
+        '''
+        key = self.key(params)
+        if key not in self.loaded:
+            folder = os.path.join(self.root, key)
+            if not os.path.exists(os.path.join(folder, 'params.txt')):
+                self.save(folder, params, compile_arrays())
+            names = [file[:-4] for file in os.listdir(folder) if file.endswith('.npy')]
+            self.loaded[key] = {name: np.load(os.path.join(folder, name + '.npy'), mmap_mode = 'r')
+                                for name in names}
+        return self.loaded[key]
+
+    def save(self, folder, params, arrays):
+        os.makedirs(self.root, exist_ok = True)
+        temp_folder = folder + '.tmp' + str(os.getpid())
+        os.makedirs(temp_folder, exist_ok = True)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_folder, name + '.npy'), np.ascontiguousarray(array))
+        # written last: marks a complete entry
+        with open(os.path.join(temp_folder, 'params.txt'), 'w') as file:
+            file.write(repr(sorted(params.items())))
+        try:
+            os.rename(temp_folder, folder)
+        except OSError:  # another process stored the same maze first
+            shutil.rmtree(temp_folder)
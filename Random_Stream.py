@@ -0,0 +1,116 @@
+'''
+Seeded random streams for agents and environments.
+
+Every trial owns one numpy Generator, derived from the experiment seed with
+SeedSequence spawn keys (experiment seed -> session -> trial), so the draws of a
+trial only depend on (seed, session, trial) and not on how trials are scheduled.
+Uniforms are drawn from the generator in blocks and consumed from a buffer.
+
+All random decisions are made from uniforms with one fixed recipe, shared by the
+Agent / Interact loop and the batched engine:
+    random():      one uniform u in [0, 1)
+    integers(n):   floor(u * n)                       (one uniform)
+    choice(p):     first index where cumsum(p) >= u    (one uniform)
+As long as both code paths consume the same uniforms in the same order, a trial
+is bit-reproducible whether it runs serially, batched or in a worker process.
+
+RandomStream: one trial, scalar draws (Agent, Interact).
+RandomStreams: many trials, one vectorized draw per selected trial (Batch_Engine).
+'''
+import numpy as np
+
+
+def trial_seed_sequences(seed, session_id, nb_trials):
+    '''SeedSequence of every trial of a session. seed = None draws fresh entropy.'''
+    root = np.random.SeedSequence(seed)
+    session = np.random.SeedSequence(root.entropy, spawn_key = (session_id,))
+    return session.spawn(nb_trials)
+
+
+def sample_index(cdf, rand):
+    '''index sampled from (unnormalized) cumulative probabilities cdf with uniform rand'''
+    return min(int(np.sum(cdf < rand * cdf[-1])), len(cdf) - 1)
+
+
+class RandomStream:
+
+    def __init__(self, seed_sequence = None, block_size = 4096):
+        self.generator = np.random.default_rng(seed_sequence)
+        self.block_size = block_size
+        self.buffer = []
+        self.cursor = 0
+
+    def refill(self):
+        self.buffer = self.generator.random(self.block_size).tolist()
+        self.cursor = 0
+
+    def random(self):
+        if self.cursor == len(self.buffer):
+            self.refill()
+        rand = self.buffer[self.cursor]
+        self.cursor += 1
+        return rand
+
+    def random_array(self, size):
+        '''size uniforms, the same as size calls to random(), taken from the buffer then fresh blocks'''
+        head = self.buffer[self.cursor:self.cursor + size]
+        self.cursor += len(head)
+        missing = size - len(head)
+        if missing == 0:
+            return np.array(head)
+        # whole blocks in one generator call: the generator yields the same uniforms as block by block
+        nb_blocks = -(-missing // self.block_size)
+        fresh = self.generator.random(nb_blocks * self.block_size)
+        self.buffer = fresh[(nb_blocks - 1) * self.block_size:].tolist()
+        self.cursor = missing - (nb_blocks - 1) * self.block_size
+        return np.concatenate([head, fresh[:missing]])
+
+    def integers(self, n):
+        return int(self.random() * n)
+
+    def integers_array(self, n, size):
+        return (self.random_array(size) * n).astype(np.int64)
+
+    def choice(self, options, p = None):
+        if p is None:
+            return options[self.integers(len(options))]
+        return options[sample_index(np.cumsum(p), self.random())]
+
+
+class RandomStreams:
+
+    def __init__(self, seed_sequences, block_size = 4096):
+        self.generators = [np.random.default_rng(seed_sequence) for seed_sequence in seed_sequences]
+        self.block_size = block_size
+        self.buffer = np.zeros((len(self.generators), block_size))
+        self.cursor = np.full(len(self.generators), block_size)  # empty buffers
+
+    def random(self, streams):
+        '''one uniform for each stream index in streams (indices must be unique)'''
+        cursor = self.cursor[streams]
+        empty = cursor == self.block_size
+        if np.count_nonzero(empty):
+            for stream in streams[empty].tolist():
+                self.buffer[stream] = self.generators[stream].random(self.block_size)
+                self.cursor[stream] = 0
+            cursor = self.cursor[streams]
+        rand = self.buffer[streams, cursor]
+        self.cursor[streams] = cursor + 1
+        return rand
+
+    def integers(self, n, streams):
+        return (self.random(streams) * n).astype(np.int64)
+
+    def stream(self, index):
+        '''RandomStream that continues stream index from its current position'''
+        stream = RandomStream(block_size = self.block_size)
+        stream.generator = self.generators[index]
+        stream.buffer = self.buffer[index].tolist()
+        stream.cursor = int(self.cursor[index])
+        return stream
+
+    def choice(self, p, streams):
+        '''one index per stream, sampled from the rows of (unnormalized) probabilities p'''
+        cdf = np.cumsum(p, axis = 1)
+        rand = self.random(streams)
+        return np.minimum(np.sum(cdf < rand[:, None] * cdf[:, -1:], axis = 1), p.shape[1] - 1)
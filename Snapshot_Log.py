@@ -0,0 +1,170 @@
+'''
+Compact log of agent tables (Q function, exploration bonus) over episodes.
+
+Snapshots are rows of a preallocated (trials, snapshots, states * actions) float32
+array, with NaN for state-action pairs that are not in the table yet. The entry of
+pair (s, a) is at column s * nb_actions + a.
+
+Parameters:
+    stride: take a snapshot every 'stride' episodes (episodes stride - 1, 2 * stride - 1, ..).
+        The last episode is always recorded.
+    mode:
+        'dense' (default): full snapshots in the array above.
+        'delta': only entries that changed since the previous snapshot of the trial are
+            stored, as (trial, snapshot, column, value) rows. Snapshots are rebuilt on read.
+        'final': one snapshot per trial, at the last episode.
+        'sparse': all entries of every snapshot as (trial, snapshot, column, value) rows, without
+            any (states * actions) array. For mazes too large to index densely (implicit mazes).
+    path: optional .npy file. The dense array is then a memmap on disk instead of memory
+        (not used in 'delta' / 'sparse' mode).
+
+Episodes without a snapshot are skipped before the table is read, so the cost of
+recording is proportional to the number of snapshots, not episodes.
+'''
+import numpy as np
+
+
+class SnapshotLog:
+
+    def __init__(self, nb_trials, nb_episodes, nb_states, nb_actions, stride = 1, mode = 'dense', path = None):
+        if mode not in ['dense', 'delta', 'final', 'sparse']:
+            raise Exception('Unknown snapshot mode: ' + str(mode))
+        self.nb_trials = nb_trials
+        self.nb_states = nb_states
+        self.nb_actions = nb_actions
+        self.mode = mode
+        if mode == 'final':
+            self.snapshot_episodes = np.array([nb_episodes - 1])
+        else:
+            self.snapshot_episodes = np.union1d(np.arange(stride - 1, nb_episodes, stride), [nb_episodes - 1])
+        self.snapshot_of = np.full(nb_episodes, -1)  # episode -> snapshot index
+        self.snapshot_of[self.snapshot_episodes] = np.arange(len(self.snapshot_episodes))
+        shape = (nb_trials, len(self.snapshot_episodes), nb_states * nb_actions)
+        self.recorded = np.zeros(nb_trials, dtype = bool)
+        if mode == 'sparse':
+            self.entries = {'trial': [], 'snapshot': [], 'column': [], 'value': []}
+        elif mode == 'delta':
+            self.last = np.full((nb_trials, nb_states * nb_actions), np.nan, dtype = np.float32)
+            self.deltas = {'trial': [], 'snapshot': [], 'column': [], 'value': []}
+        elif path is not None:
+            self.values = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.float32, shape = shape)
+            self.values[:] = np.nan
+        else:
+            self.values = np.full(shape, np.nan, dtype = np.float32)
+
+    def wants(self, episode):
+        return self.snapshot_of[episode] >= 0
+
+    def record(self, trial, episode, table):
+        '''snapshot of a value table (dictionary or Value_Table object) keyed by (state, action)'''
+        if not self.wants(episode):
+            return
+        if hasattr(table, 'seen'):  # dense tables
+            states, actions = np.nonzero(table.seen)
+        else:
+            keys = list(table.keys())
+            states = np.array([key[0] for key in keys], dtype = np.int64)
+            actions = np.array([key[1] for key in keys], dtype = np.int64)
+        columns = states * self.nb_actions + actions
+        if self.mode == 'sparse':
+            self.store_entries(trial, self.snapshot_of[episode], columns, np.array(list(table.values()), dtype = np.float32))
+            return
+        flat = np.full(self.nb_states * self.nb_actions, np.nan, dtype = np.float32)
+        flat[columns] = list(table.values())
+        self.store(trial, self.snapshot_of[episode], flat)
+
+    def record_array(self, trial, episode, values, seen):
+        '''snapshot of a (states, actions) value array with a seen mask'''
+        if not self.wants(episode):
+            return
+        flat = np.full((self.nb_states, self.nb_actions), np.nan, dtype = np.float32)
+        flat[:, :values.shape[1]] = np.where(seen, values, np.nan)
+        flat = flat.ravel()
+        if self.mode == 'sparse':
+            columns = np.flatnonzero(~np.isnan(flat))
+            self.store_entries(trial, self.snapshot_of[episode], columns, flat[columns])
+            return
+        self.store(trial, self.snapshot_of[episode], flat)
+
+    def store(self, trial, snapshot, flat):
+        self.recorded[trial] = True
+        if self.mode != 'delta':
+            self.values[trial, snapshot] = flat
+            return
+        last = self.last[trial]
+        changed = np.flatnonzero(~((flat == last) | (np.isnan(flat) & np.isnan(last))))
+        self.deltas['trial'].append(np.full(len(changed), trial, dtype = np.int32))
+        self.deltas['snapshot'].append(np.full(len(changed), snapshot, dtype = np.int32))
+        self.deltas['column'].append(changed.astype(np.int32))
+        self.deltas['value'].append(flat[changed])
+        self.last[trial] = flat
+
+    def store_entries(self, trial, snapshot, columns, values):
+        '''sparse mode: entries of one snapshot (columns: int64, states * actions may exceed int32)'''
+        self.recorded[trial] = True
+        self.entries['trial'].append(np.full(len(columns), trial, dtype = np.int32))
+        self.entries['snapshot'].append(np.full(len(columns), snapshot, dtype = np.int32))
+        self.entries['column'].append(np.asarray(columns, dtype = np.int64))
+        self.entries['value'].append(values)
+
+    def trial_entries(self, trial):
+        '''sparse mode: snapshot, column and value arrays of the entries of one trial'''
+        trials = np.concatenate(self.entries['trial'])
+        rows = trials == trial
+        return tuple(np.concatenate(self.entries[name])[rows] for name in ['snapshot', 'column', 'value'])
+
+    def trial_snapshots(self, trial):
+        '''(snapshots, states * actions) array of one trial'''
+        if self.mode == 'sparse':
+            snapshots, columns, values = self.trial_entries(trial)
+            result = np.full((len(self.snapshot_episodes), self.nb_states * self.nb_actions), np.nan, dtype = np.float32)
+            result[snapshots, columns] = values
+            return result
+        if self.mode != 'delta':
+            return self.values[trial]
+        trials = np.concatenate(self.deltas['trial'])
+        rows = trials == trial
+        snapshots = np.concatenate(self.deltas['snapshot'])[rows]
+        columns = np.concatenate(self.deltas['column'])[rows]
+        values = np.concatenate(self.deltas['value'])[rows]
+        result = np.full((len(self.snapshot_episodes), self.nb_states * self.nb_actions), np.nan, dtype = np.float32)
+        for snapshot in range(len(self.snapshot_episodes)):
+            if snapshot > 0:
+                result[snapshot] = result[snapshot - 1]
+            at_snapshot = snapshots == snapshot
+            result[snapshot, columns[at_snapshot]] = values[at_snapshot]
+        return result
+
+    def trial_dicts(self, trial):
+        '''snapshots of one trial as {(state, action): value} dictionaries'''
+        if self.mode == 'sparse':
+            snapshots, columns, values = self.trial_entries(trial)
+            dicts = []
+            for snapshot in range(len(self.snapshot_episodes)):
+                at_snapshot = snapshots == snapshot
+                keys = zip((columns[at_snapshot] // self.nb_actions).tolist(), (columns[at_snapshot] % self.nb_actions).tolist())
+                dicts.append(dict(zip(keys, values[at_snapshot].tolist())))
+            return dicts
+        dicts = []
+        for flat in self.trial_snapshots(trial):
+            columns = np.flatnonzero(~np.isnan(flat))
+            keys = zip((columns // self.nb_actions).tolist(), (columns % self.nb_actions).tolist())
+            dicts.append(dict(zip(keys, flat[columns].tolist())))
+        return dicts
+
+    def merge(self, other, trial_offset):
+        '''copy the snapshots of another log (same shape and mode) in as trials trial_offset, ..'''
+        trials = slice(trial_offset, trial_offset + other.nb_trials)
+        self.recorded[trials] = other.recorded
+        if self.mode in ['sparse', 'delta']:
+            rows = self.entries if self.mode == 'sparse' else self.deltas
+            other_rows = other.entries if self.mode == 'sparse' else other.deltas
+            for name in rows:
+                column = other_rows[name]
+                if name == 'trial':
+                    column = [trial + trial_offset for trial in column]
+                rows[name].extend(column)
+            if self.mode == 'delta':
+                self.last[trials] = other.last
+        else:
+            self.values[trials] = other.values
@@ -0,0 +1,152 @@
+'''
+Spatial (grid) maze environment object for RL agent, compiled from an ASCII map.
+
+Map format: list of strings, e.g.
+    'o-o-o',
+    '  |  ',
+    'o-o o',
+    'o' at even rows / columns are states (nodes), '-' connects horizontal neighbours and
+    '|' vertical neighbours. Node at map row r, column c has position (r // 2, c // 2).
+
+Parameters:
+    name: string description.
+    map: list of strings, see above.
+    reward_location: {(row, col): reward, ..} in node positions. Index by zero.
+    start_position: (row, col) node position of the start state.
+    store: optional Maze_Store.MazeStore to load the compiled map from (memory-mapped).
+    structure: optional compiled arrays ({name: array}, as returned by parse_map) used instead
+        of a map, e.g. generated mazes (Maze_Generator.py). maze_map is then ignored.
+
+Variables:
+    Actions: 4 (0 up, 1 down, 2 left, 3 right). Moves without a connection leave the state
+        unchanged. Opposite moves are pairs (0, 1), (2, 3), as in the agent's reversal map.
+    States: nodes in map order (row by row, left to right). position_of_state[s] = (row, col).
+    Transition matrix: State(t+1) = state_trans_matrix[State(t), action(t)], int32
+    Termination: rewarded states and the start state (as in BinaryMaze).
+Same surface as BinaryMaze (state_trans_matrix, state_reward_matrix, termination_states /
+termination_mask, with_rewards, neighbour and distance tables), so Interact, the engines and
+Analysis run on it unchanged.
+
+Maps are parsed once per process (cached by hash of the map text) with array operations.
+The adjacency between nodes is also kept in CSR form: neighbours of state s are
+adjacency_states[adjacency_indptr[s]:adjacency_indptr[s + 1]].
+'''
+import numpy as np
+import hashlib
+import copy
+from Maze_Graph import MazeGraph, transition_edges, csr
+
+
+parsed_maps = {}  # map hash -> parsed arrays
+
+
+def map_hash(maze_map):
+    return hashlib.sha1('\n'.join(maze_map).encode()).hexdigest()[:16]
+
+
+def parse_map(maze_map):
+    '''node positions, transition matrix and CSR adjacency of an ASCII map, as {name: array}'''
+    width = max(len(row) for row in maze_map)
+    grid = np.array([list(row.ljust(width)) for row in maze_map])
+    is_node = grid[0::2, 0::2] == 'o'
+    node_ids = np.full(is_node.shape, -1, dtype = np.int32)
+    node_ids[is_node] = np.arange(is_node.sum())
+    positions = np.argwhere(is_node).astype(np.int32)
+    state_trans_matrix = np.repeat(np.arange(len(positions), dtype = np.int32)[:, None], 4, axis = 1)
+    # horizontal connections: '-' at (2i, 2j + 1) between nodes (i, j) and (i, j + 1)
+    nb_rows, nb_cols = is_node.shape
+    links = (grid[0::2, 1::2] == '-')[:, :nb_cols - 1] & is_node[:, :-1] & is_node[:, 1:]
+    left, right = node_ids[:, :-1][links], node_ids[:, 1:][links]
+    state_trans_matrix[left, 3] = right
+    state_trans_matrix[right, 2] = left
+    # vertical connections: '|' at (2i + 1, 2j) between nodes (i, j) and (i + 1, j)
+    links = (grid[1::2, 0::2] == '|')[:nb_rows - 1] & is_node[:-1] & is_node[1:]
+    upper, lower = node_ids[:-1][links], node_ids[1:][links]
+    state_trans_matrix[upper, 1] = lower
+    state_trans_matrix[lower, 0] = upper
+    return compile_structure(positions, state_trans_matrix)
+
+
+def compile_structure(positions, state_trans_matrix):
+    '''structure arrays of a spatial maze from node positions and its transition matrix'''
+    # CSR adjacency (distinct neighbours, in action order)
+    adjacency_indptr, adjacency_states = csr(*transition_edges(state_trans_matrix), len(positions))
+    return {'position_of_state': positions, 'state_trans_matrix': state_trans_matrix,
+            'adjacency_indptr': adjacency_indptr, 'adjacency_states': adjacency_states}
+
+
+def render_map(structure):
+    '''ASCII map (list of strings, see above) of spatial maze structure arrays. For small mazes.'''
+    positions, state_trans_matrix = structure['position_of_state'], structure['state_trans_matrix']
+    nb_rows, nb_cols = np.max(positions, axis = 0) + 1
+    grid = np.full((2 * nb_rows - 1, 2 * nb_cols - 1), ' ')
+    rows, cols = 2 * positions[:, 0], 2 * positions[:, 1]
+    grid[rows, cols] = 'o'
+    states = np.arange(len(positions))
+    right, down = state_trans_matrix[:, 3] != states, state_trans_matrix[:, 1] != states
+    grid[rows[right], cols[right] + 1] = '-'
+    grid[rows[down] + 1, cols[down]] = '|'
+    return [''.join(row) for row in grid]
+
+
+class SpatialMaze(MazeGraph):
+
+    def __init__(self, name, maze_map, reward_location, start_position, store = None, structure = None):
+        self.name = name
+        self.map = maze_map
+        self.action_space = 4
+        if structure is not None:
+            for array_name, array in structure.items():
+                setattr(self, array_name, array)
+        else:
+            self.init_structure(store)
+        self.nb_states = len(self.position_of_state)
+        if self.nb_states == 0:
+            raise Exception('Map of maze ' + str(name) + ' has no states')
+        # (row, col) -> state, -1 where there is no state
+        self.state_grid = np.full(np.max(self.position_of_state, axis = 0) + 1, -1, dtype = np.int32)
+        self.state_grid[self.position_of_state[:, 0], self.position_of_state[:, 1]] = np.arange(self.nb_states)
+        self.distance_cache = {}  # target states -> distance table, see distance_table
+        self.start_state = self.state_at(start_position)
+        self.reward_locations = reward_location
+        self.init_reward()
+        self.set_termination_states(reward_state = True, start_state = True)
+
+    def init_structure(self, store = None):
+        if store is not None:
+            arrays = store.load({'maze type': 'spatial', 'map': '\n'.join(self.map)}, lambda: parse_map(self.map))
+        else:
+            key = map_hash(self.map)
+            if key not in parsed_maps:
+                parsed_maps[key] = parse_map(self.map)
+            arrays = parsed_maps[key]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def state_at(self, position):
+        row, col = position
+        if not (0 <= row < self.state_grid.shape[0] and 0 <= col < self.state_grid.shape[1]) \
+                or self.state_grid[row, col] < 0:
+            raise Exception('No state at position ' + str(tuple(position)) + ' of maze ' + str(self.name))
+        return int(self.state_grid[row, col])
+
+    def init_reward(self):
+        self.state_reward_matrix = np.zeros(self.nb_states)
+        for position in self.reward_locations:
+            self.state_reward_matrix[self.state_at(position)] = self.reward_locations[position]
+
+    def with_rewards(self, reward_location):
+        '''copy of this maze with another reward location, sharing the parsed structure'''
+        maze = copy.copy(self)
+        maze.reward_locations = reward_location
+        maze.init_reward()
+        maze.set_termination_states(reward_state = True, start_state = True)
+        return maze
+
+    def set_termination_states(self, reward_state = True, start_state = False):
+        self.termination_mask = np.zeros(self.nb_states, dtype = bool)
+        if reward_state:
+            self.termination_mask[self.state_reward_matrix != 0] = True
+        if start_state:
+            self.termination_mask[self.start_state] = True
+        self.termination_states = np.flatnonzero(self.termination_mask)
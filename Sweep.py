@@ -0,0 +1,339 @@
+'''
+Parameter sweeps over agent / environment spec dictionaries.
+
+A sweep expands a search space into points (one agent spec and one environment each), runs
+every point as a session without plots, and writes one row per point and episode to a
+results table instead of a folder of figures per point.
+
+Class inputs:
+    name: sweep name, output folder data/analysis/<name>/ (suffixed like Experiment folders).
+    agent, environment: base spec dictionaries (as in run.py).
+    agent_space, environment_space: {key: values} over keys of the base specs.
+        grid search: values is a list, every combination is a point.
+        random search: values is a list (uniform choice) or a tuple (low, high) (uniform float).
+    nb_episodes, nb_trials: per point.
+    search: 'grid' (default) or 'random'.
+    nb_points: number of points of a random search.
+    engine, seed: as in Experiment. All points use the trial streams of session 0 (common
+        random numbers), so differences between points are not due to different draws.
+    processes: number of processes running points (default 1: in this process).
+        Scripts that use processes > 1 must run the sweep under if __name__ == '__main__':.
+
+Output (data/analysis/<name>/):
+    config.txt: the sweep settings.
+    episodes.csv: tidy table, one row per point and episode: point, swept keys, episode, then
+        mean / std over trials of the episode reward and the timesteps per episode.
+    points.csv: one row per point: point, swept keys, reward rate (fraction of rewarded
+        episodes), mean / median steps until first reward (Trajectory_Buffer.steps_until_reward).
+
+Rows are written as points finish (in any order: sort by point to get the search order).
+Points return only these summaries, so memory stays bounded by one point per process.
+Mazes are built once per process and reused by all points on the same environment
+(Experiment.maze_caches), compiled arrays are shared across processes with 'maze store'.
+
+Halving: successive halving over the same search spaces (see class Halving below).
+'''
+import numpy as np
+import itertools, csv, os, pickle
+import multiprocessing
+from Experiment import run_session, session_runner, save_checkpoint
+from Episode_Kernel import EpisodeKernel, kernel_supported
+from Agent import Agent
+from Random_Stream import RandomStream, trial_seed_sequences
+
+
+class Sweep:
+
+    def __init__(self, name, agent, environment, agent_space, nb_episodes, nb_trials, environment_space = None,
+                 search = 'grid', nb_points = None, engine = 'serial', seed = None, processes = 1):
+        self.name = name
+        self.agent = agent
+        self.environment = environment
+        self.agent_space = agent_space
+        self.environment_space = environment_space if environment_space is not None else {}
+        self.nb_episodes = nb_episodes
+        self.nb_trials = nb_trials
+        self.search = search
+        self.nb_points = nb_points
+        self.engine = engine
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.processes = processes
+        self.keys = list(self.agent_space) + list(self.environment_space)
+        self.points = self.expand_space()
+        self.init_output_path(root_path = 'data/analysis/')
+        self.save_configs()
+        self.run_sweep()
+
+    def init_output_path(self, root_path):
+        os.makedirs(root_path, exist_ok = True)
+        self.output_path = root_path + str(self.name)
+        if os.path.exists(self.output_path):
+            append_idx = 1
+            while os.path.exists(self.output_path + '_' + str(append_idx)):
+                append_idx += 1
+            self.output_path += '_' + str(append_idx)
+        os.mkdir(self.output_path)
+
+    def save_configs(self):
+        with open(self.output_path + '/config.txt', 'w') as data:
+            data.write('agent = ' + str(self.agent)+'\n\n')
+            data.write('environment = ' + str(self.environment)+'\n\n')
+            data.write('agent_space = ' + str(self.agent_space)+'\n\n')
+            data.write('environment_space = ' + str(self.environment_space)+'\n\n')
+            data.write('search = ' + str(self.search) + ', nb_points = ' + str(len(self.points))+'\n\n')
+            data.write('nb_episodes = ' + str(self.nb_episodes)+'\n\n')
+            data.write('nb_trials = ' + str(self.nb_trials)+'\n\n')
+            data.write('engine = ' + str(self.engine)+'\n\n')
+            data.write('seed = ' + str(self.seed))
+
+    def expand_space(self):
+        '''list of points, each a dictionary {key: value} over the swept keys'''
+        space = dict(self.agent_space, **self.environment_space)
+        if self.search == 'grid':
+            return [dict(zip(self.keys, values)) for values in itertools.product(*[space[key] for key in self.keys])]
+        elif self.search == 'random':
+            if self.nb_points is None:
+                raise Exception('Random search needs nb_points')
+            rng = np.random.default_rng(self.seed)
+            points = []
+            for _ in range(self.nb_points):
+                point = {}
+                for key in self.keys:
+                    if isinstance(space[key], tuple):
+                        point[key] = float(rng.uniform(*space[key]))
+                    else:
+                        point[key] = space[key][rng.integers(len(space[key]))]
+                points.append(point)
+            return points
+        raise Exception('Unknown search: ' + str(self.search))
+
+    def point_specs(self, point):
+        '''agent spec and environment properties of a point'''
+        agent = dict(self.agent, **{key: point[key] for key in self.agent_space})
+        environment = dict(self.environment, **{key: point[key] for key in self.environment_space})
+        return agent, environment
+
+    def run_sweep(self):
+        settings = {'engine': self.engine, 'seed': self.seed, 'nb_episodes': self.nb_episodes,
+                    'env_settings': {'init_state': 'start',
+                                     'episode_termination': 'environment termination states'},
+                    'snapshots': {'stride': self.nb_episodes, 'mode': 'final', 'memmap': False}}
+        jobs = [(index, settings) + self.point_specs(point) + (self.nb_trials,)
+                for index, point in enumerate(self.points)]
+        print('Sweep: ' + str(len(jobs)) + ' points')
+        with open(self.output_path + '/episodes.csv', 'w', newline = '') as episodes_file, \
+                open(self.output_path + '/points.csv', 'w', newline = '') as points_file:
+            episodes_csv, points_csv = csv.writer(episodes_file), csv.writer(points_file)
+            episodes_csv.writerow(['point'] + self.keys + ['episode', 'reward mean', 'reward std',
+                                                          'timesteps mean', 'timesteps std'])
+            points_csv.writerow(['point'] + self.keys + ['reward rate', 'steps until reward mean',
+                                                        'steps until reward median'])
+            if self.processes > 1:
+                with multiprocessing.Pool(self.processes) as pool:
+                    for result in pool.imap_unordered(run_point, jobs):
+                        self.write_point(episodes_csv, points_csv, *result)
+            else:
+                for job in jobs:
+                    self.write_point(episodes_csv, points_csv, *run_point(job))
+
+    def write_point(self, episodes_csv, points_csv, index, summary):
+        rewards, timesteps, steps = summary
+        config = [self.points[index][key] for key in self.keys]
+        columns = [np.arange(1, self.nb_episodes + 1), rewards.mean(axis = 0), rewards.std(axis = 0),
+                   timesteps.mean(axis = 0), timesteps.std(axis = 0)]
+        episodes_csv.writerows([index] + config + list(row) for row in zip(*[column.tolist() for column in columns]))
+        points_csv.writerow([index] + config + [float(np.mean(rewards > 0)), float(np.mean(steps)),
+                                                float(np.median(steps))])
+        print('| Point: ' + str(index + 1) + '/' + str(len(self.points)) + ' | ' + str(self.points[index]) + ' |')
+
+
+def run_point(job):
+    '''
+    runs the trials of one sweep point (worker process entry). Returns the point index and its
+    summary: rewards and timesteps (trials, episodes), steps until first reward (trials,).
+    '''
+    index, settings, agent, environment, nb_trials = job
+    trajectories = run_session(settings, environment, agent, 0, range(nb_trials)).trajectories
+    rewards = trajectories.per_trial(trajectories.final_obs('reward').astype(float))
+    timesteps = trajectories.per_trial(trajectories.episode_lengths())
+    return index, (rewards, timesteps, trajectories.steps_until_reward())
+
+
+class Halving(Sweep):
+    '''
+    Successive halving: all points run a short budget, are scored, and only the best fraction
+    continues, from the saved state of their trials, with more episodes and trials.
+
+    Class inputs (others as Sweep):
+        rungs: [(nb_episodes, nb_trials), ..] cumulative budget of every rung, non decreasing.
+            Survivors continue their trials from the last episode of the previous rung; trials
+            added in a rung first catch up on the earlier episodes.
+        metric: score of a point in a rung (higher is better):
+            'reward rate': fraction of rewarded episodes in the rung's episodes.
+            'steps until reward': minus the mean number of steps until first reward since
+                episode 0 (trials without reward count all their steps so far).
+            function(trajectories) -> score, called with the TrajectoryBuffer of the rung's
+                episodes (all trials), e.g. a fit to animal data. Must be a module level
+                function when processes > 1.
+        keep: fraction of the points kept after every rung but the last (at least one).
+        engine: 'serial' (default) continues trials in the episode kernel (Episode_Kernel.py)
+            when the configuration is supported, from their Q / novelty tables; otherwise and
+            with 'agent', trials are Agent objects stepped by Experiment.run_episodes.
+            'batch' runs as 'serial'. Results are the same with every engine.
+
+    Between rungs, the state of every point (trial tables or agents, random streams) is saved
+    by the process that ran it under <output folder>/rungs/ and only reloaded if the point
+    survives; points dropped are deleted, the last rung saves nothing.
+    Output: halving.csv, one row per rung and point: rung, point, swept keys, episodes, trials,
+    score, kept. self.best is the best point of the last rung.
+    '''
+
+    def __init__(self, name, agent, environment, agent_space, rungs, environment_space = None,
+                 search = 'grid', nb_points = None, metric = 'reward rate', keep = 0.5, engine = 'serial',
+                 seed = None, processes = 1):
+        if any(b[0] < a[0] or b[1] < a[1] for a, b in zip(rungs[:-1], rungs[1:])):
+            raise Exception('Rung budgets must not decrease: ' + str(rungs))
+        self.rungs = rungs
+        self.metric = metric
+        self.keep = keep
+        super().__init__(name, agent, environment, agent_space, rungs[-1][0], rungs[-1][1],
+                         environment_space = environment_space, search = search, nb_points = nb_points,
+                         engine = engine, seed = seed, processes = processes)
+
+    def save_configs(self):
+        Sweep.save_configs(self)
+        with open(self.output_path + '/config.txt', 'a') as data:
+            data.write('\n\nrungs = ' + str(self.rungs)+'\n\n')
+            data.write('metric = ' + str(self.metric) + ', keep = ' + str(self.keep))
+
+    def state_path(self, index):
+        return self.output_path + '/rungs/point_' + str(index) + '.pkl'
+
+    def run_sweep(self):
+        settings = {'engine': self.engine, 'seed': self.seed,
+                    'env_settings': {'init_state': 'start',
+                                     'episode_termination': 'environment termination states'},
+                    'snapshots': {'stride': 1, 'mode': 'final', 'memmap': False}}
+        os.makedirs(self.output_path + '/rungs', exist_ok = True)
+        points = list(range(len(self.points)))
+        start = 0
+        print('Halving: ' + str(len(self.points)) + ' points, rungs ' + str(self.rungs))
+        pool = multiprocessing.Pool(self.processes) if self.processes > 1 else None
+        with open(self.output_path + '/halving.csv', 'w', newline = '') as halving_file:
+            halving_csv = csv.writer(halving_file)
+            halving_csv.writerow(['rung', 'point'] + self.keys + ['episodes', 'trials', 'score', 'kept'])
+            for rung, (end, nb_trials) in enumerate(self.rungs):
+                last = rung == len(self.rungs) - 1
+                jobs = [(index, settings) + self.point_specs(self.points[index]) +
+                        (self.state_path(index), start, end, nb_trials, self.metric, not last) for index in points]
+                results = pool.imap_unordered(run_rung, jobs) if pool is not None else map(run_rung, jobs)
+                scores = dict(results)
+                # best first, NaN scores last, ties in point order
+                ranking = sorted(scores, key = lambda index: (np.isnan(scores[index]), -scores[index], index))
+                if not last:
+                    ranking = ranking[:max(int(np.ceil(len(ranking) * self.keep)), 1)]
+                for index in sorted(scores):
+                    halving_csv.writerow([rung, index] + [self.points[index][key] for key in self.keys] +
+                                         [end, nb_trials, scores[index], index in ranking])
+                    if index not in ranking or last:
+                        if os.path.exists(self.state_path(index)):
+                            os.remove(self.state_path(index))
+                halving_file.flush()
+                points = sorted(ranking)
+                print('| Rung: ' + str(rung + 1) + '/' + str(len(self.rungs)) + ' | Episodes: ' + str(end) +
+                      ' | Kept: ' + str(len(ranking)) + '/' + str(len(scores)) + ' |')
+                start = end
+        if pool is not None:
+            pool.close()
+            pool.join()
+        os.rmdir(self.output_path + '/rungs')
+        self.best = self.points[ranking[0]]
+        print('Best point: ' + str(self.best))
+
+
+def run_rung(job):
+    '''
+    runs one rung of a Halving point (worker process entry): continues the saved trials of the
+    point (none in the first rung) to episode end and adds trials up to nb_trials. The state of
+    the point (per trial: learner and random stream, steps until first reward so far and whether
+    it was found) is read from / saved to path. Returns the point index and its score.
+    '''
+    index, settings, agent_spec, environment, path, start, end, nb_trials, metric, save = job
+    if start > 0:
+        with open(path, 'rb') as file:
+            state = pickle.load(file)
+    else:
+        state = {'learners': [], 'steps': np.zeros(0, dtype = int), 'found': np.zeros(0, dtype = bool)}
+    learners, steps, found = state['learners'], state['steps'], state['found']
+    Runner = session_runner(dict(settings, nb_episodes = end - start), environment, 0, nb_trials)
+    use_kernel = uses_kernel(settings, agent_spec, Runner.Session_current)
+    seed_sequences = trial_seed_sequences(settings['seed'], 0, nb_trials)
+    if nb_trials > len(learners):
+        # new trials catch up on the episodes of earlier rungs
+        new_learners, new_steps, new_found = continue_trials(settings, environment, agent_spec, range(start),
+                                                             seed_sequences[len(learners):], use_kernel)
+        learners, steps, found = learners + new_learners, np.append(steps, new_steps), np.append(found, new_found)
+    run_learners(Runner, agent_spec, learners, range(start, end), use_kernel)
+    trajectories = Runner.Session_current.trajectories
+    rung_steps, rung_found = reward_search(trajectories)
+    steps = steps + np.where(found, 0, rung_steps)
+    found = found | rung_found
+    if metric == 'reward rate':
+        score = float(np.mean(trajectories.final_obs('reward') > 0))
+    elif metric == 'steps until reward':
+        score = -float(np.mean(steps))
+    elif callable(metric):
+        score = float(metric(trajectories))
+    else:
+        raise Exception('Unknown halving metric: ' + str(metric))
+    if save:
+        save_checkpoint(path, {'learners': learners, 'steps': steps, 'found': found})
+    return index, score
+
+
+def uses_kernel(settings, agent_spec, Session):
+    '''whether Halving trials run in the episode kernel (same rule as Experiment.run_trials)'''
+    return settings['engine'] != 'agent' and not Session.implicit and \
+        kernel_supported(agent_spec, settings['env_settings'])
+
+
+def run_learners(Runner, agent_spec, learners, episodes, use_kernel):
+    '''
+    continue every trial through episodes in Runner.Session_current. A learner is an Agent, or
+    with the kernel a dictionary of its random stream and tables (EpisodeKernel.run_trial).
+    '''
+    Session = Runner.Session_current
+    if use_kernel:
+        Kernel = EpisodeKernel(agent_spec, Session, episodes[-1] + 1)
+        for learner in learners:
+            learner['tables'] = Kernel.run_trial(learner['rng'], episodes, learner['tables'])
+            Kernel.write_trial()
+        return
+    for Agent_current in learners:
+        Session.rng = Agent_current.rng
+        Runner.run_episodes(Agent_current, agent_spec, episodes)
+        Session.process_trial()
+
+
+def continue_trials(settings, environment, agent_spec, episodes, seed_sequences, use_kernel):
+    '''new learners (one per seed sequence) run through episodes; returns them with reward_search'''
+    Runner = session_runner(dict(settings, nb_episodes = max(len(episodes), 1)), environment, 0, len(seed_sequences))
+    Session = Runner.Session_current
+    learners = []
+    for seed_sequence in seed_sequences:
+        if use_kernel:
+            learners.append({'rng': RandomStream(seed_sequence), 'tables': None})
+        else:
+            Session.rng = RandomStream(seed_sequence)
+            learners.append(Agent(agent_spec, maze = Session.Maze, rng = Session.rng))
+    if len(episodes) == 0:
+        return learners, np.zeros(len(learners), dtype = int), np.zeros(len(learners), dtype = bool)
+    run_learners(Runner, agent_spec, learners, episodes, use_kernel)
+    return (learners,) + reward_search(Session.trajectories)
+
+
+def reward_search(trajectories):
+    '''per trial: steps until first reward (Trajectory_Buffer.steps_until_reward) and whether there was one'''
+    steps = trajectories.steps_until_reward()
+    nb_obs = np.add.reduceat(trajectories.episode_lengths(), trajectories.trial_offsets[:-1])
+    return steps, steps < nb_obs
@@ -0,0 +1,186 @@
+'''
+Columnar trajectory store for Interact histories.
+
+One row per transition, in growable arrays (doubling):
+    state, action, next_state (int32), reward, done (float32 / bool) of next_state
+One row per episode: transition offset plus the initial observation
+    (init_state, init_reward, init_done), since an episode of n transitions has n + 1 observations.
+trial_offsets[k]:trial_offsets[k + 1] are the episodes of trial k.
+
+The observations of an episode are its initial observation followed by the next_state /
+reward / done of each transition. obs_column returns any of them in that order, for all
+trials at once, so analysis runs on flat arrays instead of nested lists.
+state_act_history / state_obs_history rebuild the former nested lists on demand.
+'''
+import numpy as np
+
+
+class TrajectoryBuffer:
+
+    transition_columns = {'state': np.int32, 'action': np.int32, 'next_state': np.int32,
+                          'reward': np.float32, 'done': bool}
+    episode_columns = {'episode_offset': np.int64, 'init_state': np.int32,
+                       'init_reward': np.float32, 'init_done': bool}
+
+    def __init__(self, capacity = 4096, episode_capacity = 256):
+        for name, dtype in self.transition_columns.items():
+            setattr(self, name, np.zeros(capacity, dtype = dtype))
+        for name, dtype in self.episode_columns.items():
+            setattr(self, name, np.zeros(episode_capacity, dtype = dtype))
+        self.size = 0  # transitions
+        self.nb_episodes = 0
+        self.trial_offsets = [0]
+
+    def reserve(self, columns, size, needed):
+        '''grow columns (by doubling) so that needed rows fit'''
+        capacity = len(getattr(self, next(iter(columns))))
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, dtype in columns.items():
+            column = np.zeros(capacity, dtype = dtype)
+            column[:size] = getattr(self, name)[:size]
+            setattr(self, name, column)
+
+    def start_episode(self, state, reward, done):
+        self.reserve(self.episode_columns, self.nb_episodes, self.nb_episodes + 1)
+        row = self.nb_episodes
+        self.episode_offset[row] = self.size
+        self.init_state[row], self.init_reward[row], self.init_done[row] = state, reward, done
+        self.nb_episodes += 1
+
+    def add(self, state, action, next_state, reward, done):
+        if self.size == len(self.state):
+            self.reserve(self.transition_columns, self.size, self.size + 1)
+        row = self.size
+        self.state[row], self.action[row], self.next_state[row] = state, action, next_state
+        self.reward[row], self.done[row] = reward, done
+        self.size += 1
+
+    def end_trial(self):
+        self.trial_offsets.append(self.nb_episodes)
+
+    def add_trial(self, obs_states, actions, obs_rewards, obs_dones, obs_offsets):
+        '''
+        bulk append of the episodes of one trial (close it with end_trial), given in
+        observation order: observations of episode e are obs_*[obs_offsets[e]:obs_offsets[e + 1]]
+        and actions[t] is the action taken at observation t (ignored for the last observation
+        of an episode).
+        '''
+        obs_offsets = np.asarray(obs_offsets)
+        starts = obs_offsets[:-1]
+        is_transition = np.ones(obs_offsets[-1], dtype = bool)
+        is_transition[obs_offsets[1:] - 1] = False  # last observation of an episode
+        rows = np.nonzero(is_transition)[0]
+        nb_episodes, nb_transitions = len(starts), len(rows)
+        self.reserve(self.episode_columns, self.nb_episodes, self.nb_episodes + nb_episodes)
+        self.reserve(self.transition_columns, self.size, self.size + nb_transitions)
+        episodes = slice(self.nb_episodes, self.nb_episodes + nb_episodes)
+        # episode e starts after the transitions of all earlier episodes
+        self.episode_offset[episodes] = self.size + starts - np.arange(nb_episodes)
+        self.init_state[episodes] = obs_states[starts]
+        self.init_reward[episodes] = obs_rewards[starts]
+        self.init_done[episodes] = obs_dones[starts]
+        transitions = slice(self.size, self.size + nb_transitions)
+        self.state[transitions] = obs_states[rows]
+        self.action[transitions] = actions[rows]
+        self.next_state[transitions] = obs_states[rows + 1]
+        self.reward[transitions] = obs_rewards[rows + 1]
+        self.done[transitions] = obs_dones[rows + 1]
+        self.nb_episodes += nb_episodes
+        self.size += nb_transitions
+
+    def extend(self, other):
+        '''append all trials of another buffer (e.g. returned by a worker process)'''
+        self.reserve(self.episode_columns, self.nb_episodes, self.nb_episodes + other.nb_episodes)
+        self.reserve(self.transition_columns, self.size, self.size + other.size)
+        episodes = slice(self.nb_episodes, self.nb_episodes + other.nb_episodes)
+        for name in self.episode_columns:
+            getattr(self, name)[episodes] = getattr(other, name)[:other.nb_episodes]
+        self.episode_offset[episodes] += self.size
+        transitions = slice(self.size, self.size + other.size)
+        for name in self.transition_columns:
+            getattr(self, name)[transitions] = getattr(other, name)[:other.size]
+        self.trial_offsets.extend([self.nb_episodes + offset for offset in other.trial_offsets[1:]])
+        self.nb_episodes += other.nb_episodes
+        self.size += other.size
+
+    def shrink(self):
+        '''drop unused capacity (before pickling)'''
+        for name in self.transition_columns:
+            setattr(self, name, getattr(self, name)[:self.size].copy())
+        for name in self.episode_columns:
+            setattr(self, name, getattr(self, name)[:self.nb_episodes].copy())
+
+    @property
+    def nb_trials(self):
+        return len(self.trial_offsets) - 1
+
+    def episode_bounds(self):
+        '''transition start / end of every episode'''
+        starts = self.episode_offset[:self.nb_episodes]
+        ends = np.append(starts[1:], self.size)
+        return starts, ends
+
+    def episode_lengths(self):
+        '''number of observations per episode (transitions + 1)'''
+        starts, ends = self.episode_bounds()
+        return ends - starts + 1
+
+    def final_obs(self, name):
+        '''state / reward / done of the last observation of every episode'''
+        starts, ends = self.episode_bounds()
+        last = getattr(self, 'next_state' if name == 'state' else name)[np.maximum(ends - 1, 0)]
+        return np.where(ends > starts, last, getattr(self, 'init_' + name)[:self.nb_episodes])
+
+    def obs_column(self, name):
+        '''state / reward / done of every observation, in order, plus observation offsets per trial'''
+        starts, _ = self.episode_bounds()
+        column = getattr(self, 'next_state' if name == 'state' else name)[:self.size]
+        obs = np.insert(column, starts, getattr(self, 'init_' + name)[:self.nb_episodes])
+        episode_obs_offsets = np.append(starts + np.arange(self.nb_episodes), len(obs))
+        return obs, episode_obs_offsets[self.trial_offsets]
+
+    def steps_until_reward(self):
+        '''
+        per trial, number of observations before the first rewarded one (across episodes),
+        or the number of observations of the trial if it never got a reward
+        '''
+        rewards, trial_offsets = self.obs_column('reward')
+        rewarded = np.flatnonzero(rewards > 0)
+        first = np.searchsorted(rewarded, trial_offsets[:-1])
+        found = np.append(rewarded, trial_offsets[-1])[first]
+        return np.minimum(found, trial_offsets[1:]) - trial_offsets[:-1]
+
+    def per_trial(self, values):
+        '''split a per-episode array into per-trial rows (2D if all trials have the same length)'''
+        rows = [values[self.trial_offsets[k]:self.trial_offsets[k + 1]] for k in range(self.nb_trials)]
+        if len(set(len(row) for row in rows)) == 1:
+            return np.array(rows)
+        return rows
+
+    def state_act_history(self):
+        '''former Interact.state_act_history_trials: [trial][episode][t] = [s, a, s']'''
+        starts, ends = self.episode_bounds()
+        rows = np.stack([self.state[:self.size], self.action[:self.size],
+                         self.next_state[:self.size]], axis = 1).tolist()
+        episodes = [rows[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+        return [episodes[self.trial_offsets[k]:self.trial_offsets[k + 1]] for k in range(self.nb_trials)]
+
+    def state_obs_history(self, action_space):
+        '''former Interact.state_obs_history_trials: [trial][episode][t] = [action space, s, r, done]'''
+        states, _ = self.obs_column('state')
+        rewards, _ = self.obs_column('reward')
+        dones, _ = self.obs_column('done')
+        obs = [[action_space, s, r, d] for s, r, d in zip(states.tolist(), rewards.tolist(), dones.tolist())]
+        starts, _ = self.episode_bounds()
+        offsets = np.append(starts + np.arange(self.nb_episodes), len(obs)).tolist()
+        episodes = [obs[offsets[e]:offsets[e + 1]] for e in range(self.nb_episodes)]
+        return [episodes[self.trial_offsets[k]:self.trial_offsets[k + 1]] for k in range(self.nb_trials)]
+
+    def save(self, path):
+        '''all columns in one .npz file'''
+        columns = {name: getattr(self, name)[:self.size] for name in self.transition_columns}
+        columns.update({name: getattr(self, name)[:self.nb_episodes] for name in self.episode_columns})
+        np.savez(path, trial_offsets = np.array(self.trial_offsets), **columns)
@@ -0,0 +1,71 @@
+'''
+Learned environment model for Dyna-Q planning.
+
+Transitions are stored as parallel arrays (state, action, reward, next_state), one
+row per modelled state-action pair, plus an index {(state, action): row}.
+Uniform sampling of modelled pairs is a random row number, so it costs O(1)
+regardless of the model size, and a whole batch of planning samples is drawn
+with one call.
+
+The model keeps the first observed outcome of every pair (deterministic mazes),
+and can still be read like the former dictionary model:
+    model[state, action] -> (reward, next_state)
+A predecessor index {next_state: [rows]} is kept alongside, for prioritized sweeping.
+'''
+import numpy as np
+
+
+class TransitionModel:
+
+    def __init__(self, capacity = 64):
+        self.states = np.zeros(capacity, dtype = np.int64)
+        self.actions = np.zeros(capacity, dtype = np.int64)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype = np.int64)
+        self.index = {}  # (state, action) -> row
+        self.predecessors = {}  # next_state -> rows leading to it
+        self.size = 0
+
+    def grow(self):
+        capacity = 2 * len(self.states)
+        for name in ['states', 'actions', 'rewards', 'next_states']:
+            column = getattr(self, name)
+            new_column = np.zeros(capacity, dtype = column.dtype)
+            new_column[:self.size] = column[:self.size]
+            setattr(self, name, new_column)
+
+    def add(self, state, action, reward, next_state):
+        '''record a transition, unless the pair is already modelled'''
+        if (state, action) in self.index:
+            return
+        if self.size == len(self.states):
+            self.grow()
+        row = self.size
+        self.states[row], self.actions[row] = state, action
+        self.rewards[row], self.next_states[row] = reward, next_state
+        self.index[state, action] = row
+        self.predecessors.setdefault(next_state, []).append(row)
+        self.size += 1
+
+    def sample(self, nb_samples, rng):
+        '''uniformly sample modelled transitions (with replacement) from RandomStream rng. Returns column arrays.'''
+        rows = rng.integers_array(self.size, nb_samples)
+        return self.states[rows], self.actions[rows], self.rewards[rows], self.next_states[rows]
+
+    def predecessors_of(self, state):
+        '''modelled transitions (state, action, reward) that lead to state'''
+        rows = self.predecessors.get(state, [])
+        return zip(self.states[rows].tolist(), self.actions[rows].tolist(), self.rewards[rows].tolist())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        row = self.index[key]
+        return self.rewards[row], self.next_states[row]
+
+    def __len__(self):
+        return self.size
+
+    def keys(self):
+        return self.index.keys()
@@ -0,0 +1,269 @@
+'''
+Dense array-backed tables for agent values (Q function, exploration bonus).
+
+DenseTable stores one float per (state, action) pair in a preallocated
+nb_states x nb_actions array, together with a boolean 'seen' mask that marks
+which pairs have been assigned. The mask plays the role of dictionary keys,
+so the table can be read and written exactly like the original
+{(state, action): value} dictionaries:
+
+    table[state, action] = 0.5
+    (state, action) in table
+    table.copy()  # returns a plain dictionary view of all seen pairs
+
+Agent methods that run every step read and write single pairs through the python
+row copies (row, write, unseen), vectorized code (planning, snapshots) uses the
+.table / .seen arrays and calls refresh after writing to .table.
+Indices beyond the preallocated size grow the arrays (doubling), so a
+table can be created without knowing the exact maze size.
+
+RecoveringTable / RecoveringDenseTable hold novelty with lazy recovery. Every step,
+novelty of all state-action pairs except the current one recovers towards max_value:
+e <- e + rate * (max_value - e). Instead of rewriting every entry, the tables keep a
+step clock and the step at which each entry was last written; reads evaluate the
+recovery in closed form:
+    e(now) = max_value - (max_value - e_written) * (1 - rate) ** (now - step_written)
+so a recovery step costs O(1) and is exact.
+
+VisitedStates is an incrementally maintained set of states with O(1) uniform sampling.
+'''
+import numpy as np
+
+
+class DenseTable:
+
+    def __init__(self, nb_states, nb_actions, dtype = np.float64):
+        self.table = np.zeros((max(nb_states, 1), max(nb_actions, 1)), dtype = dtype)
+        self.seen = np.zeros(self.table.shape, dtype = bool)
+        # python copy of each state's row, made on first access, None for pairs not seen yet.
+        # single pair reads and writes go through it: numpy scalar indexing costs more than
+        # a whole step of the dictionary backend for 3-4 actions
+        self.rows = [None] * self.table.shape[0]
+
+    def grow(self, state, action):
+        '''make sure (state, action) fits in the arrays. Grows by doubling.'''
+        nb_states, nb_actions = self.table.shape
+        if state < nb_states and action < nb_actions:
+            return
+        new_shape = (max(nb_states, 2 * nb_states if state >= nb_states else 0, state + 1),
+                     max(nb_actions, action + 1))
+        table = np.zeros(new_shape, dtype = self.table.dtype)
+        seen = np.zeros(new_shape, dtype = bool)
+        table[:nb_states, :nb_actions] = self.table
+        seen[:nb_states, :nb_actions] = self.seen
+        self.table, self.seen = table, seen
+        self.rows.extend([None] * (new_shape[0] - nb_states))
+        if new_shape[1] > nb_actions:
+            for row in self.rows:
+                if row is not None:
+                    row.extend([None] * (new_shape[1] - nb_actions))
+
+    def row(self, state):
+        '''python list of the values of state, None where the pair was not assigned'''
+        if state < len(self.rows):
+            row = self.rows[state]
+            if row is not None:
+                return row
+        else:
+            self.grow(state, 0)
+        row = self.rows[state]
+        if row is None:
+            row = [value if seen else None
+                   for value, seen in zip(self.table[state].tolist(), self.seen[state].tolist())]
+            self.rows[state] = row
+        return row
+
+    def refresh(self, states):
+        '''copy rows back from the arrays after a vectorized write to .table'''
+        for state in set(states.tolist()):
+            self.rows[state] = None
+
+    def write(self, state, action, value):
+        row = self.row(state)
+        if action >= len(row):
+            self.grow(state, action)
+        row[action] = value
+        self.table[state, action] = value
+        self.seen[state, action] = True
+
+    def unseen(self, state, actions):
+        '''actions a for which (state, a) was not assigned yet'''
+        row = self.row(state)
+        try:
+            return [a for a in actions if row[a] is None]
+        except IndexError:
+            self.grow(state, max(actions))
+            return [a for a in actions if row[a] is None]
+
+    def ensure(self, state, actions, init_value = 0):
+        '''
+        assign init_value to all (state, a) pairs in actions that are not yet seen.
+        Equivalent of 'if (s, a) not in Q: Q[s, a] = init'.
+        '''
+        for action in self.unseen(state, actions):
+            self.write(state, action, init_value)
+
+    def __getitem__(self, key):
+        state, action = key
+        if state < len(self.rows):
+            row = self.row(state)
+            if action < len(row) and row[action] is not None:
+                return row[action]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.write(key[0], key[1], value)
+
+    def __contains__(self, key):
+        state, action = key
+        if state >= len(self.rows):
+            return False
+        row = self.row(state)
+        return action < len(row) and row[action] is not None
+
+    def __len__(self):
+        return int(np.count_nonzero(self.seen))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        states, actions = np.nonzero(self.seen)
+        return [(s, a) for s, a in zip(states.tolist(), actions.tolist())]
+
+    def values(self):
+        return self.table[self.seen].tolist()
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def copy(self):
+        '''dictionary view of all seen pairs, same format as the dictionary backend'''
+        return dict(self.items())
+
+    def lookup(self, state, actions):
+        '''values of (state, a) for all a in actions, as a list. All pairs must be seen.'''
+        row = self.row(state)
+        return [row[a] for a in actions]
+
+
+class RecoveringTable:
+    '''dictionary backend: {(state, action): (value, step_written)}'''
+
+    def __init__(self, rate, max_value = 1):
+        self.rate = rate
+        self.max_value = max_value
+        self.clock = 0
+        self.entries = {}
+
+    def recovered(self, value, stamp):
+        return self.max_value - (self.max_value - value) * (1 - self.rate) ** (self.clock - stamp)
+
+    def advance(self, exclude):
+        '''one recovery step for all pairs except exclude (the pair just visited)'''
+        value = self[exclude]
+        self.clock += 1
+        self.entries[exclude] = (value, self.clock)
+
+    def __getitem__(self, key):
+        return self.recovered(*self.entries[key])
+
+    def __setitem__(self, key, value):
+        self.entries[key] = (value, self.clock)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def values(self):
+        return [self.recovered(*entry) for entry in self.entries.values()]
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def copy(self):
+        '''dictionary of current (recovered) values'''
+        return dict(self.items())
+
+
+class RecoveringDenseTable(DenseTable):
+    '''dense backend: DenseTable plus an array of the step each entry was written at'''
+
+    def __init__(self, nb_states, nb_actions, rate, max_value = 1):
+        super().__init__(nb_states, nb_actions)
+        self.stamps = np.zeros(self.table.shape, dtype = np.int64)
+        self.rate = rate
+        self.max_value = max_value
+        self.clock = 0
+
+    def recovered(self, values, stamps):
+        return self.max_value - (self.max_value - values) * (1 - self.rate) ** (self.clock - stamps)
+
+    def advance(self, exclude):
+        '''one recovery step for all pairs except exclude (the pair just visited)'''
+        value = self[exclude]
+        self.clock += 1
+        self.write(exclude[0], exclude[1], value)
+
+    def grow(self, state, action):
+        nb_states, nb_actions = self.stamps.shape
+        super().grow(state, action)
+        if self.table.shape != self.stamps.shape:
+            stamps = np.zeros(self.table.shape, dtype = np.int64)
+            stamps[:nb_states, :nb_actions] = self.stamps
+            self.stamps = stamps
+
+    def write(self, state, action, value):
+        super().write(state, action, value)
+        self.stamps[state, action] = self.clock
+
+    def lookup(self, state, actions):
+        row = self.row(state)
+        return [self.recovered(row[a], self.stamps[state, a]) for a in actions]
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        return self.recovered(value, self.stamps[key])
+
+    def values(self):
+        return self.recovered(self.table[self.seen], self.stamps[self.seen]).tolist()
+
+
+class VisitedStates:
+    '''
+    states[:size] holds the visited states in order of first visit, position maps a state
+    to its index. Insertion, membership and uniform sampling are O(1).
+    '''
+
+    def __init__(self, capacity = 64):
+        self.states = np.zeros(capacity, dtype = np.int64)
+        self.position = {}
+        self.size = 0
+
+    def add(self, state):
+        if state in self.position:
+            return
+        if self.size == len(self.states):
+            states = np.zeros(2 * len(self.states), dtype = np.int64)
+            states[:self.size] = self.states
+            self.states = states
+        self.states[self.size] = state
+        self.position[state] = self.size
+        self.size += 1
+
+    def sample(self, rng):
+        return self.states[rng.integers(self.size)]
+
+    def __contains__(self, state):
+        return state in self.position
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,116 @@
+'''
+Batched counterpart of Interact. Holds nb_envs instances of one environment (binary or
+spatial maze, reward schedule included) as arrays, indexed by instance:
+    state, episode counter, first-step flag: (nb_envs,) arrays
+Transition / reward / termination tables are compiled once by Interact.compile_environment,
+so observing or stepping any subset of instances is one array lookup.
+
+Each instance runs its own sequence of episodes, as Interact does for one trial:
+    observe(envs) -> state, reward, termination flag of the current state
+    episode_done(envs, terminal) -> termination flag, except at the first state of an episode
+        (Experiment loops do not end an episode at its start state)
+    step(envs, actions, done): instances whose episode is done start the next one (auto-reset,
+        their actions are ignored); the others move along their action.
+A caller that already observed the instances this tick passes the termination flags on
+(terminal, done), so the tables are read once per tick.
+The episode counter selects the reward configuration of every instance, so reward
+location changes ('change reward location') apply per instance. Instances that ran all
+their episodes are no longer active.
+
+Visited states and actions are logged as one array chunk per step, then sorted per
+instance and handed to the wrapped Interact object in instance order by write_logs
+(Interact.record_trial), one instance per trial.
+'''
+import numpy as np
+
+
+class VecInteract:
+
+    def __init__(self, Session, nb_envs, nb_episodes, rng):
+        '''
+        Session: Interact object that provides the maze, init properties and logs.
+        rng: Random_Stream.RandomStreams with one stream per instance (random start states).
+        '''
+        self.Session = Session
+        self.nb_envs = nb_envs
+        self.nb_episodes = nb_episodes
+        self.rng = rng
+        self.properties = Session.properties
+        self.state_trans_matrix, self.rewards, self.terminals, self.episode_config = \
+            Session.compile_environment(nb_episodes)
+        self.nb_states = Session.Maze.nb_states
+        self.nb_actions = Session.Maze.action_space
+        self.action_space = np.arange(self.nb_actions)
+        self.state = np.zeros(nb_envs, dtype = int)
+        self.episode = np.zeros(nb_envs, dtype = int)
+        self.config = np.full(nb_envs, self.episode_config[0])  # reward configuration of the current episode
+        self.first_step = np.ones(nb_envs, dtype = bool)
+        # one array chunk per step call: instances, their states and actions (-1 at episode end)
+        self.log_envs, self.log_states, self.log_actions = [], [], []
+        self.reset(np.arange(nb_envs))
+
+    def init_state(self, envs):
+        if self.properties['init_state'] == 'random':
+            return self.rng.integers(self.nb_states, envs)
+        return np.full(len(envs), self.Session.fixed_init_state())
+
+    def reset(self, envs):
+        '''start a new episode (Interact.init_episode) for the given instances'''
+        self.state[envs] = self.init_state(envs)
+        self.first_step[envs] = True
+
+    @property
+    def active(self):
+        '''instances that have episodes left to run'''
+        return (self.episode < self.nb_episodes).nonzero()[0]
+
+    def active_before(self, episode):
+        '''instances that have not started this episode yet (all active instances if None)'''
+        if episode is None:
+            return self.active
+        return (self.episode < min(episode, self.nb_episodes)).nonzero()[0]
+
+    def observe(self, envs):
+        '''state, reward and termination flag of the current state, per instance'''
+        config = self.config[envs]
+        states = self.state[envs]
+        return states, self.rewards[config, states], self.terminals[config, states]
+
+    def episode_done(self, envs, terminal = None):
+        '''termination flag, except at the start state of an episode. terminal: from observe(envs)'''
+        if terminal is None:
+            _, _, terminal = self.observe(envs)
+        return terminal & ~self.first_step[envs]
+
+    def step(self, envs, actions, done = None):
+        '''
+        advance the given instances. Instances whose episode is done start the next episode,
+        the others move along actions. done: episode_done(envs), if already computed this tick.
+        '''
+        if done is None:
+            done = self.episode_done(envs)
+        actions = np.where(done, -1, actions)
+        self.log_envs.append(envs.copy())
+        self.log_states.append(self.state[envs])
+        self.log_actions.append(actions)
+        moving = envs
+        if np.count_nonzero(done):
+            ending = envs[done]
+            self.episode[ending] += 1
+            self.config[ending] = self.episode_config[np.minimum(self.episode[ending], self.nb_episodes - 1)]
+            self.reset(ending[self.episode[ending] < self.nb_episodes])
+            moving, actions = envs[~done], actions[~done]
+        self.state[moving] = self.state_trans_matrix[self.state[moving], actions]
+        self.first_step[moving] = False
+
+    def write_logs(self):
+        '''hand logs to Interact, one trial per instance, in instance order'''
+        envs = np.concatenate(self.log_envs)
+        order = np.argsort(envs, kind = 'stable')  # per instance, in time order
+        states = np.concatenate(self.log_states)[order]
+        actions = np.concatenate(self.log_actions)[order]
+        env_offsets = np.append(0, np.cumsum(np.bincount(envs, minlength = self.nb_envs)))
+        for env in range(self.nb_envs):
+            start, end = env_offsets[env], env_offsets[env + 1]
+            episode_ends = np.flatnonzero(actions[start:end] == -1) + 1
+            self.Session.record_trial(states[start:end], actions[start:end], np.append(0, episode_ends))
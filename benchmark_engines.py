@@ -0,0 +1,56 @@
+'''
+Timing of the 'serial' (episode kernel) and 'batch' (lockstep arrays) engines on the same
+seeded session (TD(0) e-greedy with novelty bonus, binary maze). Both engines follow the
+same trajectories. 'batch' pays a fixed cost per lockstep tick, so it only gets ahead of
+'serial' once a session has enough trials.
+
+    python benchmark_engines.py [nb_trials] [number of levels]
+'''
+import sys
+import time
+from Experiment import run_session
+
+nb_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+nb_levels = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+
+env = {
+    'maze type': 'Binary',
+    'maze name': 'benchmark',
+    'number of levels': nb_levels,
+    'reward locations': {(nb_levels - 1, 5): 10},
+    'change reward location': False,
+    'allow reversals': True
+}
+
+agent = {
+    'learning rate': 0.5,
+    'value update': 'TD',
+    'lambda': 0,
+    'exploration policy': 'e-greedy',
+    'epsilon': 0.1,
+    'learn model': False,
+    'discount rate': 0.9,
+    'add exploration bonus': True,
+    'reduction': 0.5
+}
+
+timings = {}
+steps = {}
+for engine in ['serial', 'batch']:
+    settings = {
+        'engine': engine,
+        'seed': 1,
+        'nb_episodes': 100,
+        'env_settings': {'init_state': 'start', 'episode_termination': 'environment termination states'},
+        'snapshots': {'stride': 100, 'mode': 'final', 'memmap': False}
+    }
+    start = time.time()
+    session = run_session(settings, env, agent, 0, range(nb_trials))
+    timings[engine] = time.time() - start
+    steps[engine] = session.trajectories.size
+
+if steps['serial'] != steps['batch']:
+    raise Exception('engines diverged: {} vs {} steps'.format(steps['serial'], steps['batch']))
+for engine in timings:
+    print('{:>6}: {:.2f}s ({} trials, {} steps)'.format(engine, timings[engine], nb_trials, steps[engine]))
+print('batch / serial: {:.2f}'.format(timings['batch'] / timings['serial']))
@@ -0,0 +1,56 @@
+'''
+Timing of the 'dict' and 'dense' Q table backends on the same seeded session
+(engine 'agent', TD(0) e-greedy with novelty bonus, 9 level binary maze).
+Both backends follow the same trajectories, only the time per session differs.
+
+    python benchmark_q_table.py [nb_trials]
+'''
+import sys
+import time
+from Experiment import run_session
+
+nb_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+env = {
+    'maze type': 'Binary',
+    'maze name': 'benchmark',
+    'number of levels': 9,
+    'reward locations': {(8, 17): 10},
+    'change reward location': False,
+    'allow reversals': True
+}
+
+settings = {
+    'engine': 'agent',
+    'seed': 1,
+    'nb_episodes': 100,
+    'env_settings': {'init_state': 'start', 'episode_termination': 'environment termination states'},
+    'snapshots': {'stride': 100, 'mode': 'final', 'memmap': False}
+}
+
+timings = {}
+steps = {}
+for table in ['dict', 'dense']:
+    agent = {
+        'learning rate': 0.5,
+        'value update': 'TD',
+        'lambda': 0,
+        'exploration policy': 'e-greedy',
+        'epsilon': 0.1,
+        'learn model': False,
+        'discount rate': 0.9,
+        'add exploration bonus': True,
+        'reduction': 0.5,
+        'Q table': table
+    }
+    start = time.time()
+    session = run_session(settings, env, agent, 0, range(nb_trials))
+    timings[table] = time.time() - start
+    steps[table] = session.trajectories.size
+
+if steps['dict'] != steps['dense']:
+    raise Exception('Q table backends diverged: {} vs {} steps'.format(steps['dict'], steps['dense']))
+for table in timings:
+    print('{:>5}: {:.2f}s ({} steps, {:.1f} us / step)'.format(
+        table, timings[table], steps[table], 1e6 * timings[table] / steps[table]))
+print('dense / dict: {:.2f}'.format(timings['dense'] / timings['dict']))
@@ -108,9 +108,10 @@ env = [
 ]
 
 
-# Run experiment
-Experiment = Experiment(name = experiment_name,
-                        environments = env,
-                        agents = agents,
-                        nb_episodes = 3000,
-                        nb_trials = 50)
\ No newline at end of file
+# Run experiment (guarded: worker processes may import this script when workers > 1)
+if __name__ == '__main__':
+    Experiment = Experiment(name = experiment_name,
+                            environments = env,
+                            agents = agents,
+                            nb_episodes = 3000,
+                            nb_trials = 50)
\ No newline at end of file
@@ -0,0 +1,10 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse = True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    '''experiments write data/analysis/.. relative to the working directory'''
+    monkeypatch.chdir(tmp_path)
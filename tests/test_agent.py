@@ -0,0 +1,51 @@
+import numpy as np
+from Agent import Agent
+from Experiment import session_runner
+from Random_Stream import RandomStream
+
+
+def agent_spec(**kw):
+    spec = {'learning rate': 0.5, 'value update': 'TD', 'lambda': 0, 'exploration policy': 'e-greedy',
+            'epsilon': 0.1, 'learn model': False, 'discount rate': 0.9, 'add exploration bonus': True,
+            'reduction': 0.5}
+    spec.update(kw)
+    return spec
+
+
+def test_mc_agent_on_deep_implicit_maze():
+    # 30 levels: ~2^30 states, dense tables would need tens of GiB
+    env = {'maze type': 'Binary', 'maze name': 'deep', 'number of levels': 30, 'implicit': True,
+           'reward locations': {(2, 0): 10, (2, 1): 10, (2, 2): 10, (2, 3): 10}, 'change reward location': False, 'allow reversals': True}
+    settings = {'engine': 'agent', 'seed': 1, 'nb_episodes': 5,
+                'env_settings': {'init_state': 'start', 'episode_termination': 'environment termination states'},
+                'snapshots': {'stride': 5, 'mode': 'final', 'memmap': False}}
+    spec = agent_spec(**{'value update': 'MC'})
+    Runner = session_runner(settings, env, 0, 1)
+    Session = Runner.Session_current
+    Session.rng = RandomStream(np.random.SeedSequence(1))
+    Agent_current = Agent(spec, maze = Session.Maze, rng = Session.rng)
+    Runner.run_episodes(Agent_current, spec, range(5))
+    assert isinstance(Agent_current.return_counts, dict)
+    assert len(Agent_current.return_counts) > 0
+    assert set(Agent_current.return_counts) <= set(Agent_current.Qfunction.keys())
+
+
+def test_dense_and_dict_q_tables_match():
+    env = {'maze type': 'Binary', 'maze name': 'small', 'number of levels': 5, 'reward locations': {(4, 5): 10},
+           'change reward location': False, 'allow reversals': True}
+    settings = {'engine': 'agent', 'seed': 2, 'nb_episodes': 10,
+                'env_settings': {'init_state': 'start', 'episode_termination': 'environment termination states'},
+                'snapshots': {'stride': 5, 'mode': 'dense', 'memmap': False}}
+    results = {}
+    for table in ['dict', 'dense']:
+        spec = agent_spec(**{'lambda': 0.5, 'novelty increase': True, 'Q table': table})
+        Runner = session_runner(settings, env, 0, 1)
+        Session = Runner.Session_current
+        Session.rng = RandomStream(np.random.SeedSequence(2))
+        Agent_current = Agent(spec, maze = Session.Maze, rng = Session.rng)
+        Runner.run_episodes(Agent_current, spec, range(10))
+        results[table] = (Session.trajectories.state[:Session.trajectories.size].tolist(),
+                          Agent_current.Qfunction.copy(), Agent_current.exploration_bonus.copy())
+    assert results['dict'][0] == results['dense'][0]
+    assert results['dict'][1] == results['dense'][1]
+    assert results['dict'][2] == results['dense'][2]
@@ -0,0 +1,34 @@
+import numpy as np
+from Experiment import session_runner
+from test_agent import agent_spec
+
+
+env = {'maze type': 'Binary', 'maze name': 'engines', 'number of levels': 5,
+       'reward locations': {0: {(4, 5): 10}, 15: {(4, 12): 10}}, 'change reward location': True, 'allow reversals': True}
+
+
+def run(engine, spec, workers = 1, nb_trials = 4):
+    settings = {'engine': engine, 'seed': 3, 'nb_episodes': 30, 'workers': workers, 'checkpoints': None,
+                'env_settings': {'init_state': 'start', 'episode_termination': 'environment termination states'},
+                'snapshots': {'stride': 5, 'mode': 'dense', 'memmap': False}}
+    Runner = session_runner(settings, env, 0, nb_trials)
+    if workers > 1:
+        Runner.parallelloop(spec, 0, verbose = False)
+    else:
+        Runner.run_trials(spec, 0, range(nb_trials), verbose = False)
+    Session = Runner.Session_current
+    trajectories = Session.trajectories
+    columns = [getattr(trajectories, name)[:trajectories.size].tolist() for name in trajectories.transition_columns]
+    return columns, trajectories.trial_offsets, Session.value_log.values, Session.novelty_log.values
+
+
+def test_engines_and_workers_match():
+    # TD(0) runs in the batched engine, TD(lambda) falls back to the episode kernel
+    for spec in [agent_spec(), agent_spec(**{'lambda': 0.5})]:
+        reference = run('agent', spec)
+        for engine, workers in [('serial', 1), ('batch', 1), ('serial', 2), ('batch', 2)]:
+            result = run(engine, spec, workers)
+            assert result[0] == reference[0], (engine, workers)
+            assert result[1] == reference[1], (engine, workers)
+            assert np.array_equal(result[2], reference[2], equal_nan = True), (engine, workers)
+            assert np.array_equal(result[3], reference[3], equal_nan = True), (engine, workers)
@@ -0,0 +1,16 @@
+import numpy as np
+from Random_Stream import RandomStream
+
+
+def test_array_draws_match_scalar_draws():
+    # sizes cross buffer refills: part of a block, several blocks, the rest of a block
+    sizes = [0, 3, 10, 1, 40, 7, 16, 2, 64]
+    scalar = RandomStream(np.random.SeedSequence(7), block_size = 16)
+    vector = RandomStream(np.random.SeedSequence(7), block_size = 16)
+    for size in sizes:
+        expected = np.array([scalar.random() for _ in range(size)])
+        assert np.array_equal(vector.random_array(size), expected)
+        assert vector.random() == scalar.random()
+    expected = np.array([scalar.integers(5) for _ in range(50)])
+    assert np.array_equal(vector.integers_array(5, 50), expected)
+    assert vector.integers(5) == scalar.integers(5)